@@ -10,22 +10,73 @@ Helpers for monitoring Neutron agents, reschedule failed agents,
 cleaned resources on failed nodes.
 """
 
+import datetime
+import fnmatch
+import json
 import os
 import re
 import sys
 import signal
 import socket
 import subprocess
+import threading
 import time
 
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
 from oslo.config import cfg
 from neutron.agent.linux import ovs_lib
 from neutron.agent.linux import ip_lib
-from neutron.common import exceptions
 from neutron.openstack.common import log as logging
 
+try:
+    from neutronclient.common import exceptions as client_exceptions
+    ClientException = client_exceptions.NeutronClientException
+except ImportError:
+    # quantumclient, before havana
+    from quantumclient.common import exceptions as client_exceptions
+    ClientException = client_exceptions.QuantumClientException
+
 LOG = logging.getLogger(__name__)
 
+NETNS_DIR = '/var/run/netns'
+METRICS_FILE = '/var/lib/juju-neutron-ha/metrics.json'
+HEARTBEAT_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def run_bounded(tasks, concurrency):
+    """Run callables using at most concurrency worker threads.
+
+    Exceptions raised by a task are logged and do not stop other tasks.
+    """
+    if not tasks:
+        return
+    pending = queue.Queue()
+    for task in tasks:
+        pending.put(task)
+
+    def worker():
+        while True:
+            try:
+                task = pending.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                task()
+            except Exception:
+                LOG.exception('Task failed')
+
+    workers = [threading.Thread(target=worker)
+               for _ in range(min(max(1, concurrency), len(tasks)))]
+    for w in workers:
+        w.daemon = True
+        w.start()
+    for w in workers:
+        w.join()
+
 
 class Daemon(object):
     """A generic daemon class.
@@ -88,6 +139,278 @@ class Daemon(object):
         pass
 
 
+class ServiceSupervisor(object):
+    """Track the state of local services and restart those not running.
+
+    The state of all supervised services is fetched with a single command
+    per refresh, ``systemctl show`` on systemd hosts and ``initctl list`` on
+    upstart hosts. Restarts are rate limited per service and dependents of a
+    restarted service are restarted after it.
+    """
+
+    SYSTEMD_SYSTEM = '/run/systemd/system'
+
+    def __init__(self, services, dependents=None, restart_burst=3,
+                 restart_window=300):
+        """ServiceSupervisor constructor.
+
+        :param services: Names of services to supervise, in restart order
+        :param dependents: {service: [services to restart after it]}
+        :param restart_burst: Restarts allowed per service per window
+        :param restart_window: Length of rate limiting window in seconds
+        """
+        self.services = services
+        self.dependents = dependents or {}
+        self.restart_burst = restart_burst
+        self.restart_window = restart_window
+        # service -> True if running, False if not, None if unknown
+        self.states = {}
+        # service -> times of recent restarts
+        self._restarts = {}
+
+    def _systemd_states(self):
+        cmd = ['systemctl', 'show', '--property=LoadState,ActiveState']
+        cmd.extend(self.services)
+        output = subprocess.check_output(cmd)
+        states = {}
+        for name, block in zip(self.services, output.strip().split('\n\n')):
+            props = dict(line.split('=', 1)
+                         for line in block.splitlines() if '=' in line)
+            if props.get('LoadState') == 'not-found':
+                states[name] = None
+            else:
+                states[name] = props.get('ActiveState') in ('active',
+                                                            'reloading')
+        return states
+
+    def _upstart_states(self):
+        output = subprocess.check_output(['initctl', 'list'])
+        jobs = {}
+        for line in output.splitlines():
+            fields = line.split()
+            if len(fields) > 1 and fields[0] in self.services:
+                jobs[fields[0]] = fields[1].startswith('start/running')
+        states = {}
+        for name in self.services:
+            if name in jobs:
+                states[name] = jobs[name]
+                continue
+            # not an upstart job, ask its init script
+            states[name] = subprocess.call(
+                ['sudo', 'service', name, 'status']) == 0
+        return states
+
+    def refresh(self):
+        """Fetch the state of all supervised services."""
+        try:
+            if os.path.isdir(self.SYSTEMD_SYSTEM):
+                self.states = self._systemd_states()
+            else:
+                self.states = self._upstart_states()
+        except (OSError, subprocess.CalledProcessError) as e:
+            LOG.error('Failed to query service states: %s' % e)
+            self.states = {}
+        return self.states
+
+    def _allow_restart(self, service):
+        now = time.time()
+        recent = [t for t in self._restarts.get(service, [])
+                  if now - t < self.restart_window]
+        self._restarts[service] = recent
+        if len(recent) >= self.restart_burst:
+            LOG.error('Not restarting %s, already restarted %s times in '
+                      '%ss' % (service, len(recent), self.restart_window))
+            return False
+        recent.append(now)
+        return True
+
+    def restart(self, service):
+        if not self._allow_restart(service):
+            return False
+        LOG.error('Restart service: %s' % service)
+        try:
+            subprocess.check_output(['sudo', 'service', service, 'restart'])
+        except subprocess.CalledProcessError as e:
+            LOG.error('Failed to restart %s: %s' % (service, e))
+            return False
+        return True
+
+    def supervise(self):
+        """Restart services which are not running, then their dependents.
+
+        Service health is read from the last refresh().
+        """
+        restarted = set()
+        for service in self.services:
+            if self.states.get(service) is not False:
+                continue
+            if service in restarted:
+                continue
+            restarted.add(service)
+            if not self.restart(service):
+                continue
+            for dependent in self.dependents.get(service, []):
+                if dependent not in restarted:
+                    restarted.add(dependent)
+                    self.restart(dependent)
+        return restarted
+
+
+class TunnelMonitor(object):
+    """Verify the local OVS agent has the tunnel ports it should have.
+
+    With l2_population an agent hosting devices is expected to have at
+    least one working tunnel port of its tunnel types on br-tun. OVSDB is
+    only consulted again when the agent's device count changes or while a
+    mismatch is pending, and a mismatch must persist for the debounce
+    window before a restart is requested.
+
+    The l2_population FDB entries themselves are not compared, since which
+    entries an agent should have is only known to neutron-server. This
+    catches the failure of Bug #1411163, an agent with devices but no
+    tunnel, not a tunnel to a particular peer that is missing.
+    """
+
+    BRIDGE = 'br-tun'
+    TUNNEL_TYPES = ('gre', 'vxlan', 'geneve')
+
+    def __init__(self, debounce=30):
+        self.debounce = debounce
+        # name -> {'name', 'type', 'ofport', 'error'} of tunnel interfaces
+        self.ports = {}
+        self._devices = None
+        self._mismatch_since = None
+
+    def refresh(self):
+        """Read the tunnel interfaces of br-tun from OVSDB."""
+        names = subprocess.check_output(
+            ['ovs-vsctl', 'list-ports', self.BRIDGE]).split()
+        ports = {}
+        if names:
+            cmd = ['ovs-vsctl', '-f', 'json',
+                   '--columns=name,type,ofport,error', 'list',
+                   'Interface'] + names
+            data = json.loads(subprocess.check_output(cmd))
+            for row in data['data']:
+                iface = dict(zip(data['headings'], row))
+                if iface['type'] in self.TUNNEL_TYPES:
+                    ports[iface['name']] = iface
+        self.ports = ports
+
+    def healthy_ports(self, tunnel_types):
+        """Return tunnel ports of tunnel_types with an ofport and no error.
+
+        Empty OVSDB columns are represented as ``["set", []]``.
+        """
+        healthy = []
+        for name, iface in self.ports.items():
+            if iface['type'] not in tunnel_types:
+                continue
+            if not isinstance(iface['ofport'], int) or iface['ofport'] < 1:
+                continue
+            if isinstance(iface['error'], list):
+                healthy.append(name)
+        return healthy
+
+    def needs_restart(self, conf):
+        """Check the agent configurations reported to neutron.
+
+        :returns: True if the agent should be restarted
+        """
+        tunnel_types = set(conf.get('tunnel_types', [])) & \
+            set(self.TUNNEL_TYPES)
+        devices = conf.get('devices')
+        if not (tunnel_types and conf.get('l2_population') and devices):
+            self._devices = None
+            self._mismatch_since = None
+            return False
+        if devices == self._devices and self._mismatch_since is None:
+            return False
+        self._devices = devices
+        self.refresh()
+        if self.healthy_ports(tunnel_types):
+            self._mismatch_since = None
+            return False
+        now = time.time()
+        if self._mismatch_since is None:
+            LOG.warning('Local agent has %s devices, but no %s tunnel is '
+                        'up' % (devices, '/'.join(sorted(tunnel_types))))
+            self._mismatch_since = now
+            return False
+        if now - self._mismatch_since < self.debounce:
+            return False
+        # verify again after the restart
+        self._devices = None
+        self._mismatch_since = None
+        return True
+
+
+class AgentStateListener(object):
+    """Wake the monitor loop when agent state notifications arrive.
+
+    Listens on the notifications topic of the transport given by
+    notification_url in its own pool, so other consumers of the topic are
+    unaffected.  Any oslo.messaging transport works, including ``fake://``
+    which needs no broker.
+
+    The agent.* notifications are sent by neutron-server, when it has a
+    notification driver configured, as agent.update.* and agent.delete.*
+    whenever an agent is updated or deleted through the API, e.g. when an
+    operator disables it.  An agent that stops reporting does not cause a
+    notification; that is only found by polling, see
+    MonitorNeutronAgentsDaemon.next_interval().
+    """
+
+    def __init__(self, url, event_types, wakeup):
+        self.url = url
+        self.event_types = event_types
+        self.wakeup = wakeup
+        self._listener = None
+
+    def start(self):
+        try:
+            import oslo_messaging as messaging
+        except ImportError:
+            from oslo import messaging
+
+        transport = messaging.get_transport(cfg.CONF, url=self.url)
+        targets = [messaging.Target(topic='notifications')]
+        try:
+            self._listener = messaging.get_notification_listener(
+                transport, targets, [self], pool='neutron-ha-monitor')
+        except TypeError:
+            # pools are not supported by older oslo.messaging
+            self._listener = messaging.get_notification_listener(
+                transport, targets, [self])
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+
+    def _run(self):
+        try:
+            self._listener.start()
+            self._listener.wait()
+        except Exception:
+            LOG.exception('Agent state notification listener failed')
+
+    def _notify(self, event_type):
+        for pattern in self.event_types:
+            if fnmatch.fnmatch(event_type, pattern):
+                LOG.info('Received %s notification, checking agents' %
+                         event_type)
+                self.wakeup.set()
+                return
+
+    def info(self, ctxt, publisher_id, event_type, payload, metadata=None):
+        self._notify(event_type)
+
+    def warn(self, ctxt, publisher_id, event_type, payload, metadata=None):
+        self._notify(event_type)
+
+    def error(self, ctxt, publisher_id, event_type, payload, metadata=None):
+        self._notify(event_type)
+
+
 class MonitorNeutronAgentsDaemon(Daemon):
     def __init__(self):
         super(MonitorNeutronAgentsDaemon, self).__init__()
@@ -95,24 +418,43 @@ class MonitorNeutronAgentsDaemon(Daemon):
         LOG.info('Monitor Neutron Agent Loop Init')
         self.hostname = None
         self.env = {}
+        self._envrc_mtime = None
+        self._quantum = None
+        self._quantum_env_mtime = None
+        # failed agent id -> (heartbeat_timestamp, hosted resource ids)
+        self._hosting_cache = {}
+        # agents seen by the last survey, None if the survey failed
+        self._agents = None
+        # agent id -> time the agent was first seen down
+        self._down_since = {}
+        self._wakeup = threading.Event()
+        self.tunnels = TunnelMonitor(debounce=int(cfg.CONF.tunnel_debounce))
+        self.supervisor = ServiceSupervisor(
+            ['openvswitch-switch', 'neutron-dhcp-agent',
+             'neutron-metadata-agent', 'neutron-vpn-agent'],
+            dependents={'neutron-metadata-agent': ['neutron-vpn-agent']},
+            restart_burst=int(cfg.CONF.service_restart_burst),
+            restart_window=int(cfg.CONF.service_restart_window))
 
     def get_env(self):
+        """Return OpenStack credentials from the legacy HA envrc file.
+
+        The file is only parsed again when its mtime changes.
+        """
         envrc_f = '/etc/legacy_ha_envrc'
-        envrc_f_m = False
         if os.path.isfile(envrc_f):
-            ctime = time.ctime(os.stat(envrc_f).st_ctime)
-            mtime = time.ctime(os.stat(envrc_f).st_mtime)
-            if ctime != mtime:
-                envrc_f_m = True
-
-            if not self.env or envrc_f_m:
+            mtime = os.stat(envrc_f).st_mtime
+            if not self.env or mtime != self._envrc_mtime:
+                env = {}
                 with open(envrc_f, 'r') as f:
                     for line in f:
                         data = line.strip().split('=')
                         if data and data[0] and data[1]:
-                            self.env[data[0]] = data[1]
+                            env[data[0]] = data[1]
                         else:
                             raise Exception("OpenStack env data uncomplete.")
+                self.env = env
+                self._envrc_mtime = mtime
         return self.env
 
     def get_hostname(self):
@@ -163,6 +505,46 @@ class MonitorNeutronAgentsDaemon(Daemon):
         result = pattern.findall(text)
         return result
 
+    def list_namespaces(self):
+        """List network namespaces without forking where possible."""
+        try:
+            return os.listdir(NETNS_DIR)
+        except OSError:
+            cmd = ['sudo', 'ip', 'netns']
+            return [line.split()[0] for line in
+                    subprocess.check_output(cmd).splitlines() if line.strip()]
+
+    def namespace_devices(self, namespaces):
+        """Inventory the devices of all namespaces with a single command.
+
+        This forks ``ip -all netns exec ip -o link show`` once rather than
+        reading each namespace over netlink, which would need a netlink
+        library the gateway does not have.
+
+        :returns: {namespace: [device name, ...]} for the namespaces that
+                  exist, or None if the inventory could not be taken.
+        """
+        cmd = ['sudo', 'ip', '-all', 'netns', 'exec', 'ip', '-o', 'link',
+               'show']
+        try:
+            output = subprocess.check_output(cmd)
+        except (OSError, subprocess.CalledProcessError) as e:
+            LOG.debug('Unable to inventory all namespaces at once: %s' % e)
+            return None
+        wanted = set(namespaces)
+        devices = {}
+        current = None
+        for line in output.splitlines():
+            if line.startswith('netns: '):
+                current = line.split(None, 1)[1].strip()
+                if current in wanted:
+                    devices[current] = []
+            elif current in devices and ': ' in line:
+                name = line.split(': ', 2)[1].split('@')[0]
+                if name != 'lo':
+                    devices[current].append(name)
+        return devices
+
     def _cleanup(self, key1, key2):
         namespaces = []
         if key1:
@@ -170,10 +552,9 @@ class MonitorNeutronAgentsDaemon(Daemon):
                 namespaces.append(key2 + '-' + k)
         else:
             try:
-                cmd = ['sudo', 'ip', 'netns']
-                ns = subprocess.check_output(cmd)
-                namespaces = self.get_pattern('(%s.*)' % key2, ns)
-            except RuntimeError as e:
+                namespaces = [ns for ns in self.list_namespaces()
+                              if ns.startswith(key2)]
+            except (OSError, subprocess.CalledProcessError) as e:
                 LOG.error('Failed to list namespace, (%s)' % e)
 
         if namespaces:
@@ -186,18 +567,51 @@ class MonitorNeutronAgentsDaemon(Daemon):
     def cleanup_router(self, routers):
         self._cleanup(routers, 'qrouter')
 
+    def destroy_namespace(self, namespace, devices=None):
+        """Unplug all devices of namespace and delete it.
+
+        :param devices: Names of devices in namespace from a prior
+                        inventory, looked up through ip_lib if None.
+        """
+        start = time.time()
+        root_helper = self.get_root_helper()
+        ip = ip_lib.IPWrapper(root_helper, namespace)
+        if devices is None:
+            if not ip.netns.exists(namespace):
+                return
+            devices = ip.get_devices(exclude_loopback=True)
+        else:
+            devices = [ip_lib.IPDevice(name, root_helper, namespace)
+                       for name in devices]
+        for device in devices:
+            self.unplug_device(device)
+        ip.garbage_collect_namespace()
+        LOG.info('Destroyed namespace %s in %.3fs' %
+                 (namespace, time.time() - start))
+
     def destroy_namespaces(self, namespaces):
-        try:
-            root_helper = self.get_root_helper()
-            for namespace in namespaces:
-                ip = ip_lib.IPWrapper(root_helper, namespace)
-                if ip.netns.exists(namespace):
-                    for device in ip.get_devices(exclude_loopback=True):
-                        self.unplug_device(device)
+        start = time.time()
+        inventory = self.namespace_devices(namespaces)
+        if inventory is not None:
+            # namespaces missing from the inventory no longer exist
+            namespaces = [ns for ns in namespaces if ns in inventory]
 
-            ip.garbage_collect_namespace()
-        except Exception:
-            LOG.exception('Error unable to destroy namespace: %s', namespace)
+        def task(namespace):
+            def destroy():
+                try:
+                    self.destroy_namespace(
+                        namespace,
+                        inventory[namespace] if inventory is not None
+                        else None)
+                except Exception:
+                    LOG.exception('Error unable to destroy namespace: %s',
+                                  namespace)
+            return destroy
+
+        run_bounded([task(ns) for ns in namespaces],
+                    int(cfg.CONF.cleanup_concurrency))
+        LOG.info('Destroyed %s namespaces in %.3fs' %
+                 (len(namespaces), time.time() - start))
 
     def is_same_host(self, host):
         return str(host).strip() == self.get_hostname()
@@ -214,56 +628,126 @@ class MonitorNeutronAgentsDaemon(Daemon):
             return False
         return True
 
-    def l3_agents_reschedule(self, l3_agents, routers, quantum):
-        if not self.validate_reschedule():
-            return
+    def _call_with_retry(self, func, **kwargs):
+        """Call a neutron API function, retrying with exponential backoff.
 
-        index = 0
-        for router_id in routers:
-            agent = index % len(l3_agents)
-            LOG.info('Moving router %s from %s to %s' %
-                     (router_id, routers[router_id], l3_agents[agent]))
+        Errors raised by the client are retried, except for a 404 since the
+        resource has already gone away.
+        """
+        retries = int(cfg.CONF.reschedule_retries)
+        backoff = float(cfg.CONF.reschedule_backoff)
+        attempt = 0
+        while True:
             try:
-                quantum.remove_router_from_l3_agent(
-                    l3_agent=routers[router_id], router_id=router_id)
+                return func(**kwargs)
+            except ClientException as e:
+                if e.status_code == 404 or attempt >= retries:
+                    raise
+                delay = backoff * (2 ** attempt)
+                LOG.warning('%s failed (%s), retrying in %ss' %
+                            (func.__name__, e, delay))
+                time.sleep(delay)
+                attempt += 1
 
-            except exceptions.NeutronException as e:
-                LOG.error('Remove router raised exception: %s' % e)
-            try:
-                quantum.add_router_to_l3_agent(l3_agent=l3_agents[agent],
-                                               body={'router_id': router_id})
-            except exceptions.NeutronException as e:
-                LOG.error('Add router raised exception: %s' % e)
-            index += 1
+    def _run_concurrently(self, tasks, quantum):
+        """Run tasks using a bounded pool of worker threads.
 
-    def dhcp_agents_reschedule(self, dhcp_agents, networks, quantum):
-        if not self.validate_reschedule():
+        Each task is called with a neutron client. The client is not thread
+        safe, so with more than one worker every worker builds its own from
+        the envrc. A single worker uses quantum, which the calling thread
+        leaves alone until all tasks are done.
+        """
+        concurrency = min(int(cfg.CONF.reschedule_concurrency), len(tasks))
+        if concurrency <= 1:
+            run_bounded([lambda task=task: task(quantum) for task in tasks],
+                        1)
             return
+        env = self.get_env()
+        local = threading.local()
+
+        def client():
+            if getattr(local, 'client', None) is None:
+                local.client = self._new_quantum_client(env)
+            return local.client
 
-        index = 0
-        for network_id in networks:
-            agent = index % len(dhcp_agents)
-            LOG.info('Moving network %s from %s to %s' % (network_id,
-                     networks[network_id], dhcp_agents[agent]))
+        run_bounded([lambda task=task: task(client()) for task in tasks],
+                    concurrency)
+
+    def _move_task(self, kind, res_id, src, dst, remove, add, timings):
+        """Return a task moving resource res_id from agent src to dst."""
+        def task(quantum):
+            start = time.time()
+            LOG.info('Moving %s %s from %s to %s' % (kind, res_id, src, dst))
             try:
-                quantum.remove_network_from_dhcp_agent(
-                    dhcp_agent=networks[network_id], network_id=network_id)
-            except exceptions.NeutronException as e:
-                LOG.error('Remove network raised exception: %s' % e)
+                remove(quantum, src, res_id)
+            except ClientException as e:
+                LOG.error('Remove %s raised exception: %s' % (kind, e))
             try:
-                quantum.add_network_to_dhcp_agent(
-                    dhcp_agent=dhcp_agents[agent],
-                    body={'network_id': network_id})
-            except exceptions.NeutronException as e:
-                LOG.error('Add network raised exception: %s' % e)
-            index += 1
+                add(quantum, dst, res_id)
+            except ClientException as e:
+                LOG.error('Add %s raised exception: %s' % (kind, e))
+            elapsed = time.time() - start
+            timings[res_id] = elapsed
+            LOG.info('Moved %s %s in %.3fs' % (kind, res_id, elapsed))
+        return task
 
-    def get_quantum_client(self):
-        env = self.get_env()
-        if not env:
-            LOG.info('Unable to re-assign resources at this time')
-            return None
+    def _reschedule(self, kind, agents, resources, remove, add, quantum):
+        """Spread resources over agents round-robin, moving concurrently."""
+        timings = {}
+        tasks = []
+        for index, res_id in enumerate(resources):
+            dst = agents[index % len(agents)]
+            tasks.append(self._move_task(kind, res_id, resources[res_id],
+                                         dst, remove, add, timings))
+        start = time.time()
+        self._run_concurrently(tasks, quantum)
+        if timings:
+            LOG.info('Rescheduled %s %ss in %.3fs (slowest %.3fs)' %
+                     (len(timings), kind, time.time() - start,
+                      max(timings.values())))
+        return timings
+
+    def l3_agents_reschedule(self, l3_agents, routers, quantum):
+        """Move routers from failed agents to l3_agents.
+
+        :returns: True if any router was rescheduled
+        """
+        if not routers or not self.validate_reschedule():
+            return False
+
+        def remove(client, agent, router_id):
+            self._call_with_retry(client.remove_router_from_l3_agent,
+                                  l3_agent=agent, router_id=router_id)
+
+        def add(client, agent, router_id):
+            self._call_with_retry(client.add_router_to_l3_agent,
+                                  l3_agent=agent,
+                                  body={'router_id': router_id})
+
+        return bool(self._reschedule('router', l3_agents, routers, remove,
+                                     add, quantum))
+
+    def dhcp_agents_reschedule(self, dhcp_agents, networks, quantum):
+        """Move networks from failed agents to dhcp_agents.
+
+        :returns: True if any network was rescheduled
+        """
+        if not networks or not self.validate_reschedule():
+            return False
+
+        def remove(client, agent, network_id):
+            self._call_with_retry(client.remove_network_from_dhcp_agent,
+                                  dhcp_agent=agent, network_id=network_id)
 
+        def add(client, agent, network_id):
+            self._call_with_retry(client.add_network_to_dhcp_agent,
+                                  dhcp_agent=agent,
+                                  body={'network_id': network_id})
+
+        return bool(self._reschedule('network', dhcp_agents, networks,
+                                     remove, add, quantum))
+
+    def _new_quantum_client(self, env):
         try:
             from quantumclient.v2_0 import client
         except ImportError:
@@ -279,6 +763,46 @@ class MonitorNeutronAgentsDaemon(Daemon):
                                 region_name=env['region'])
         return quantum
 
+    def get_quantum_client(self):
+        """Return the shared, authenticated quantum client.
+
+        The client, its token and its HTTP connection are reused across
+        loop iterations. The client authenticates again by itself once the
+        token expires and is only rebuilt when the envrc file changes.
+        """
+        env = self.get_env()
+        if not env:
+            LOG.info('Unable to re-assign resources at this time')
+            return None
+
+        if self._quantum is None or self._quantum_env_mtime != \
+                self._envrc_mtime:
+            LOG.info('Creating quantum client')
+            self._quantum = self._new_quantum_client(env)
+            self._quantum_env_mtime = self._envrc_mtime
+        return self._quantum
+
+    def _hosted_resources(self, agent, list_hosted, key):
+        """Return ids of resources hosted by agent.
+
+        Only ask about failed agents: results are cached per agent for as
+        long as its heartbeat_timestamp is unchanged, so a dead agent is
+        only queried once. The hosting of a live agent changes whenever
+        resources are scheduled onto it and is looked up with list_hosted.
+
+        :param agent: Agent as returned by list_agents
+        :param list_hosted: Client method listing resources on an agent
+        :param key: Key of resource list in list_hosted response
+        :returns: list of resource ids
+        """
+        heartbeat = agent.get('heartbeat_timestamp')
+        cached = self._hosting_cache.get(agent['id'])
+        if cached and cached[0] == heartbeat:
+            return cached[1]
+        hosted = [r['id'] for r in list_hosted(agent['id'])[key]]
+        self._hosting_cache[agent['id']] = (heartbeat, hosted)
+        return hosted
+
     def reassign_agent_resources(self, quantum=None):
         """Use agent scheduler API to detect down agents and re-schedule"""
         if not quantum:
@@ -288,49 +812,73 @@ class MonitorNeutronAgentsDaemon(Daemon):
         try:
             DHCP_AGENT = "DHCP Agent"
             L3_AGENT = "L3 Agent"
-            agents = quantum.list_agents(agent_type=DHCP_AGENT)
-        except exceptions.NeutronException as e:
+            # NOTE: a single call returns liveness for every agent type;
+            #       hosting maps are only fetched where they are needed.
+            agents = quantum.list_agents()['agents']
+        except ClientException as e:
             LOG.error('Failed to get quantum agents, %s' % e)
+            self._agents = None
             return
+        self._agents = agents
+        now = time.time()
+        for agent in agents:
+            if agent['alive']:
+                self._down_since.pop(agent['id'], None)
+                self._hosting_cache.pop(agent['id'], None)
+            else:
+                self._down_since.setdefault(agent['id'], now)
 
         dhcp_agents = []
         l3_agents = []
         networks = {}
-        for agent in agents['agents']:
-            hosted_networks = quantum.list_networks_on_dhcp_agent(
-                agent['id'])['networks']
+        for agent in agents:
+            if agent['agent_type'] != DHCP_AGENT:
+                continue
             if not agent['alive']:
                 LOG.info('DHCP Agent %s down' % agent['id'])
-                for network in hosted_networks:
-                    networks[network['id']] = agent['id']
+                for network_id in self._hosted_resources(
+                        agent, quantum.list_networks_on_dhcp_agent,
+                        'networks'):
+                    networks[network_id] = agent['id']
                 if self.is_same_host(agent['host']):
                     self.cleanup_dhcp(networks)
             else:
                 dhcp_agents.append(agent['id'])
                 LOG.info('Active dhcp agents: %s' % agent['id'])
-                if not hosted_networks and self.is_same_host(agent['host']):
-                    self.cleanup_dhcp(None)
+                if self.is_same_host(agent['host']):
+                    # NOTE: never from the cache, an empty list destroys
+                    #       every dhcp namespace on this host.
+                    hosted = quantum.list_networks_on_dhcp_agent(
+                        agent['id'])['networks']
+                    if not hosted:
+                        self.cleanup_dhcp(None)
 
-        agents = quantum.list_agents(agent_type=L3_AGENT)
         routers = {}
-        for agent in agents['agents']:
-            hosted_routers = quantum.list_routers_on_l3_agent(
-                agent['id'])['routers']
+        for agent in agents:
+            if agent['agent_type'] != L3_AGENT:
+                continue
             if not agent['alive']:
                 LOG.info('L3 Agent %s down' % agent['id'])
-                for router in hosted_routers:
-                    routers[router['id']] = agent['id']
+                for router_id in self._hosted_resources(
+                        agent, quantum.list_routers_on_l3_agent, 'routers'):
+                    routers[router_id] = agent['id']
                 if self.is_same_host(agent['host']):
                     self.cleanup_router(routers)
             else:
                 l3_agents.append(agent['id'])
                 LOG.info('Active l3 agents: %s' % agent['id'])
-                if not hosted_routers and self.is_same_host(agent['host']):
-                    self.cleanup_router(None)
+                if self.is_same_host(agent['host']):
+                    # NOTE: never from the cache, an empty list destroys
+                    #       every router namespace on this host.
+                    hosted = quantum.list_routers_on_l3_agent(
+                        agent['id'])['routers']
+                    if not hosted:
+                        self.cleanup_router(None)
 
         if not networks and not routers:
             LOG.info('No networks and routers hosted on failed agents.')
             return
+        failover_start = time.time()
 
         if len(dhcp_agents) == 0 and len(l3_agents) == 0:
             LOG.error('Unable to relocate resources, there are %s dhcp_agents '
@@ -338,12 +886,54 @@ class MonitorNeutronAgentsDaemon(Daemon):
                                                             len(l3_agents)))
             return
 
+        # agents whose resources were moved
+        failed_agents = set()
         if len(l3_agents) > 0:
-            self.l3_agents_reschedule(l3_agents, routers, quantum)
+            if self.l3_agents_reschedule(l3_agents, routers, quantum):
+                failed_agents.update(routers.values())
             # new l3 node will not create a tunnel if don't restart ovs process
 
         if len(dhcp_agents) > 0:
-            self.dhcp_agents_reschedule(dhcp_agents, networks, quantum)
+            if self.dhcp_agents_reschedule(dhcp_agents, networks, quantum):
+                failed_agents.update(networks.values())
+
+        if not failed_agents:
+            # e.g. not the node that reschedules, keep the cached hosting
+            # of the failed agents and when they were first seen down.
+            return
+        LOG.info('Failover complete: %s routers and %s networks in %.3fs' %
+                 (len(routers), len(networks), time.time() - failover_start))
+
+        # Only the node that rescheduled, the first crm node, gets here, so
+        # the metric is exported once per failover.
+        detected = min(self._down_since.get(a, failover_start)
+                       for a in failed_agents)
+        self.export_failover_metric(time.time() - detected, routers,
+                                    networks)
+
+        # Hosting of the failed agents has changed, look it up again on the
+        # next iteration to pick up anything that could not be moved.
+        for agent_id in failed_agents:
+            self._hosting_cache.pop(agent_id, None)
+            self._down_since.pop(agent_id, None)
+
+    def export_failover_metric(self, latency, routers, networks):
+        """Record detection to reschedule latency of the last failover."""
+        LOG.info('Failover detection to reschedule latency: %.3fs' % latency)
+        metric = {
+            'failover_latency_seconds': round(latency, 3),
+            'failover_time': time.time(),
+            'routers': len(routers),
+            'networks': len(networks),
+        }
+        tmp = METRICS_FILE + '.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(metric, f)
+            os.rename(tmp, METRICS_FILE)
+        except (IOError, OSError) as e:
+            LOG.warning('Unable to write metrics to %s: %s' %
+                        (METRICS_FILE, e))
 
     def check_ovs_tunnel(self, quantum=None):
         '''
@@ -354,75 +944,82 @@ class MonitorNeutronAgentsDaemon(Daemon):
             LOG.error('Failed to get quantum client.')
             return
 
-        try:
-            OVS_AGENT = 'Open vSwitch agent'
-            agents = quantum.list_agents(agent_type=OVS_AGENT)
-        except exceptions.NeutronException as e:
-            LOG.error('No ovs agent found on localhost, error:%s.' % e)
-            return
+        OVS_AGENT = 'Open vSwitch agent'
+        if self._agents is not None:
+            # reuse the agent survey of this loop iteration
+            agents = [a for a in self._agents
+                      if a['agent_type'] == OVS_AGENT]
+        else:
+            try:
+                agents = quantum.list_agents(agent_type=OVS_AGENT)['agents']
+            except ClientException as e:
+                LOG.error('No ovs agent found on localhost, error:%s.' % e)
+                return
 
-        for agent in agents['agents']:
+        for agent in agents:
             if self.is_same_host(agent['host']) and agent['alive']:
-                conf = agent['configurations']
-                if 'gre' in conf['tunnel_types'] and conf['l2_population'] \
-                        and conf['devices']:
-                    LOG.debug('local ovs agent:%s' % agent)
-                    ovs_output = subprocess.check_output(['ovs-vsctl',
-                                                          'list-ports',
-                                                          'br-tun'])
-                    ports = ovs_output.strip().split('\n')
-                    look_up_gre_port = False
-                    for port in ports:
-                        if port.startswith('gre-'):
-                            look_up_gre_port = True
-                            break
-                    if not look_up_gre_port:
-                        try:
-                            LOG.error('Local agent has devices, but no ovs '
-                                      'tunnel is created, restart ovs agent.')
-                            cmd = ['sudo', 'service',
-                                   'neutron-plugin-openvswitch-agent',
-                                   'restart']
-                            subprocess.call(cmd)
-                        except subprocess.CalledProcessError:
-                            LOG.error('Failed to restart '
-                                      'neutron-plugin-openvswitch-agent.')
+                try:
+                    restart = self.tunnels.needs_restart(
+                        agent['configurations'])
+                except (OSError, ValueError,
+                        subprocess.CalledProcessError) as e:
+                    LOG.error('Failed to check ovs tunnels: %s' % e)
+                    return
+                if restart:
+                    LOG.error('Local agent has devices, but no ovs '
+                              'tunnel is created, restart ovs agent.')
+                    self.supervisor.restart(
+                        'neutron-plugin-openvswitch-agent')
 
     def check_local_agents(self):
-        services = ['openvswitch-switch', 'neutron-dhcp-agent',
-                    'neutron-metadata-agent', 'neutron-vpn-agent']
-        for s in services:
-            status = ['sudo', 'service', s, 'status']
-            restart = ['sudo', 'service', s, 'restart']
-            start = ['sudo', 'service', s, 'start']
-            stop = '%s stop/waiting' % s
-            try:
-                output = subprocess.check_output(status)
-                if output.strip() == stop:
-                    subprocess.check_output(start)
-                    LOG.error('Restart service: %s' % s)
-                    if s == 'neutron-metadata-agent':
-                        subprocess.check_output(['sudo', 'service',
-                                                 'neutron-vpn-agent',
-                                                 'restart'])
-                        LOG.error('Restart neutron-vpn-agent')
-            except subprocess.CalledProcessError:
-                LOG.error('Restart service: %s' % s)
-                subprocess.check_output(restart)
-                if s == 'neutron-metadata-agent':
-                    subprocess.check_output(['sudo', 'service',
-                                             'neutron-vpn-agent',
-                                             'restart'])
+        self.supervisor.refresh()
+        self.supervisor.supervise()
+
+    def heartbeat_age(self, agent):
+        """Return seconds since the agent last reported, None if unknown."""
+        try:
+            heartbeat = datetime.datetime.strptime(
+                agent['heartbeat_timestamp'].split('.')[0], HEARTBEAT_FORMAT)
+        except (KeyError, AttributeError, ValueError):
+            return None
+        return (datetime.datetime.utcnow() - heartbeat).total_seconds()
+
+    def next_interval(self):
+        """Poll quickly while any agent looks unhealthy, slowly otherwise.
+
+        An agent is unhealthy if it is down or its heartbeat is older than
+        heartbeat_threshold, which happens well before neutron declares the
+        agent down.
+        """
+        check_interval = float(cfg.CONF.check_interval)
+        if self._agents is None:
+            return check_interval
+        threshold = float(cfg.CONF.heartbeat_threshold)
+        for agent in self._agents:
+            if not agent['alive']:
+                return check_interval
+            age = self.heartbeat_age(agent)
+            if age is not None and age > threshold:
+                LOG.info('Agent %s heartbeat is %.0fs old' %
+                         (agent['id'], age))
+                return check_interval
+        return max(check_interval, float(cfg.CONF.healthy_check_interval))
 
     def run(self):
+        if cfg.CONF.notification_url:
+            AgentStateListener(cfg.CONF.notification_url,
+                               cfg.CONF.notification_event_types,
+                               self._wakeup).start()
         while True:
+            self._wakeup.clear()
             LOG.info('Monitor Neutron HA Agent Loop Start')
             quantum = self.get_quantum_client()
             self.reassign_agent_resources(quantum=quantum)
             self.check_ovs_tunnel(quantum=quantum)
             self.check_local_agents()
-            LOG.info('sleep %s' % cfg.CONF.check_interval)
-            time.sleep(float(cfg.CONF.check_interval))
+            interval = self.next_interval()
+            LOG.info('sleep %s' % interval)
+            self._wakeup.wait(interval)
 
 
 if __name__ == '__main__':
@@ -430,6 +1027,51 @@ if __name__ == '__main__':
         cfg.StrOpt('check_interval',
                    default=8,
                    help='Check Neutron Agents interval.'),
+        cfg.IntOpt('reschedule_concurrency',
+                   default=8,
+                   help='Maximum number of routers and networks moved '
+                        'concurrently when rescheduling.'),
+        cfg.IntOpt('healthy_check_interval',
+                   default=60,
+                   help='Check Neutron Agents interval while all agents '
+                        'are healthy, check_interval is used otherwise.'),
+        cfg.IntOpt('heartbeat_threshold',
+                   default=45,
+                   help='Age in seconds of an agent heartbeat after which '
+                        'agents are checked every check_interval.'),
+        cfg.StrOpt('notification_url',
+                   default=None,
+                   help='Transport URL to listen on for the agent '
+                        'notifications neutron-server sends when agents '
+                        'are updated or deleted through the API, which '
+                        'trigger an immediate check.'),
+        cfg.ListOpt('notification_event_types',
+                    default=['agent.*'],
+                    help='Notification event types which trigger an '
+                         'immediate check.'),
+        cfg.IntOpt('tunnel_debounce',
+                   default=30,
+                   help='Seconds a missing ovs tunnel must persist before '
+                        'the ovs agent is restarted.'),
+        cfg.IntOpt('service_restart_burst',
+                   default=3,
+                   help='Maximum restarts of a local service per '
+                        'service_restart_window.'),
+        cfg.IntOpt('service_restart_window',
+                   default=300,
+                   help='Window in seconds for service_restart_burst.'),
+        cfg.IntOpt('cleanup_concurrency',
+                   default=8,
+                   help='Maximum number of network namespaces torn down '
+                        'concurrently.'),
+        cfg.IntOpt('reschedule_retries',
+                   default=3,
+                   help='Number of times a failed reschedule API call is '
+                        'retried.'),
+        cfg.FloatOpt('reschedule_backoff',
+                     default=0.5,
+                     help='Initial delay in seconds between retries of a '
+                          'reschedule API call, doubled on each retry.'),
     ]
 
     cfg.CONF.register_cli_opts(opts)
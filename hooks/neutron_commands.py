@@ -0,0 +1,314 @@
+# vim: set ts=4:et
+'''
+Accounting and de-duplication of the commands the charm runs.
+
+The charm runs commands through check_output(), check_call() and call(),
+which behave like their subprocess namesakes. Commands registered as
+read-only (see READ_ONLY_COMMANDS) have their result kept for the rest of
+the hook, so asking the same question twice forks once. Every other
+command invalidates the results of the groups its tool may change (see
+MUTATING_COMMANDS), or of all groups if its tool is not registered.
+
+Results are memoized only for commands that did not raise and were run
+with a list argv and without env, cwd, input, stdin, stdout or shell.
+
+route_charmhelpers() sends the commands of the charmhelpers modules,
+whether imported before it or on first use later in the hook, e.g.
+is-leader, `ip a` and `ovs-vsctl list-br`, through the runner as well.
+Commands charmhelpers runs through Popen, or with positional arguments
+besides argv, still run directly, so callers that change state with
+charmhelpers, e.g. restarting services or adding OVS bridges, call
+invalidate() for the groups affected.
+
+Per command counters and timings are available from runner().
+'''
+import importlib.machinery
+import subprocess
+import sys
+import time
+
+import neutron_profiling
+
+# (argv prefix, group) of commands that only read state
+READ_ONLY_COMMANDS = [
+    (('ovs-vsctl', '-f', 'json', '--', 'list'), 'ovs'),
+    (('ovs-vsctl', 'list-br'), 'ovs'),
+    (('ovs-vsctl', '--', 'list-ports'), 'ovs'),
+    (('ip', 'a'), 'ip'),
+    (('ip', 'addr', 'show'), 'ip'),
+    (('systemctl', 'show'), 'service'),
+    (('systemctl', 'is-active'), 'service'),
+    (('lsb_release',), 'host'),
+    (('config-get',), 'juju'),
+    (('is-leader',), 'juju'),
+]
+
+# tool -> groups of read-only commands its other invocations may change;
+# tools not listed here invalidate every group.
+MUTATING_COMMANDS = {
+    'ovs-vsctl': ('ovs',),
+    'ip': ('ip',),
+    'systemctl': ('ovs', 'service'),
+    'service': ('ovs', 'service'),
+    'apt-get': ('ovs', 'service'),
+    'dpkg': ('ovs', 'service'),
+    'pgrep': (),
+    'kill': ('service',),
+    # hook tools that do not change what the read-only commands report
+    'juju-log': (),
+    'status-set': (),
+    'application-version-set': (),
+    'relation-ids': (),
+    'relation-list': (),
+    'relation-get': (),
+    'relation-set': (),
+    'leader-get': (),
+    'leader-set': (),
+}
+
+# keyword arguments that make a command's result depend on more than argv
+UNCACHEABLE_KWARGS = ('env', 'cwd', 'input', 'stdin', 'stdout', 'shell')
+
+
+class CommandStats(object):
+    '''Counters for one command (read-only prefix or tool name).'''
+
+    __slots__ = ('calls', 'forks', 'hits', 'seconds')
+
+    def __init__(self):
+        self.calls = 0
+        self.forks = 0
+        self.hits = 0
+        self.seconds = 0.0
+
+    def __repr__(self):
+        return ('CommandStats(calls={}, forks={}, hits={}, seconds={:.3f})'
+                .format(self.calls, self.forks, self.hits, self.seconds))
+
+
+class CommandRunner(object):
+    '''
+    Run commands, memoizing read-only ones until a mutation.
+
+    :param read_only: (argv prefix, group) of read-only commands
+    :type read_only: List[Tuple[Tuple[str, ...], str]]
+    :param mutating: tool -> groups its invocations invalidate
+    :type mutating: Dict[str, Tuple[str, ...]]
+    '''
+
+    def __init__(self, read_only=None, mutating=None):
+        if read_only is None:
+            read_only = READ_ONLY_COMMANDS
+        if mutating is None:
+            mutating = MUTATING_COMMANDS
+        # longest prefix first so the most specific registration wins
+        self.read_only = sorted(((tuple(p), g) for p, g in read_only),
+                                key=lambda r: len(r[0]), reverse=True)
+        self.mutating = dict(mutating)
+        self.stats = {}
+        self._results = {}
+
+    def _argv(self, cmd):
+        if isinstance(cmd, (list, tuple)):
+            argv = tuple(cmd)
+        else:
+            argv = tuple(str(cmd).split())
+        if argv and argv[0] == 'sudo':
+            argv = argv[1:]
+        return argv
+
+    def _classify(self, cmd):
+        '''Return (stats name, read-only group or None) for cmd.'''
+        argv = self._argv(cmd)
+        if isinstance(cmd, (list, tuple)):
+            for prefix, group in self.read_only:
+                if argv[:len(prefix)] == prefix:
+                    return ' '.join(prefix), group
+        return (argv[0] if argv else ''), None
+
+    def invalidate(self, *groups):
+        '''Drop memoized results of groups, or of all groups if none given.'''
+        if not groups:
+            self._results.clear()
+            return
+        for key in [k for k in self._results if k[0] in groups]:
+            del self._results[key]
+
+    def _run(self, method, func, cmd, kwargs):
+        name, group = self._classify(cmd)
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = CommandStats()
+        stats.calls += 1
+
+        key = None
+        if group is not None:
+            if not any(k in kwargs for k in UNCACHEABLE_KWARGS):
+                key = (group, method, tuple(cmd),
+                       tuple(sorted((k, repr(v))
+                                    for k, v in kwargs.items())))
+                if key in self._results:
+                    stats.hits += 1
+                    return self._results[key]
+        elif name in self.mutating:
+            groups = self.mutating[name]
+            if groups:
+                self.invalidate(*groups)
+        else:
+            self.invalidate()
+
+        start = time.time()
+        stats.forks += 1
+        try:
+            result = func(cmd, **kwargs)
+        finally:
+            stats.seconds += time.time() - start
+        if key is not None:
+            self._results[key] = result
+        return result
+
+    def check_output(self, cmd, **kwargs):
+        return self._run('check_output', neutron_profiling.check_output,
+                         cmd, kwargs)
+
+    def check_call(self, cmd, **kwargs):
+        return self._run('check_call', neutron_profiling.check_call, cmd,
+                         kwargs)
+
+    def call(self, cmd, **kwargs):
+        return self._run('call', neutron_profiling.call, cmd, kwargs)
+
+    def summary(self):
+        '''Return a one line summary of the commands run so far.'''
+        stats = list(self.stats.values())
+        return 'Ran {} commands ({} forks, {} memoized) in {:.3f}s'.format(
+            sum(s.calls for s in stats),
+            sum(s.forks for s in stats),
+            sum(s.hits for s in stats),
+            sum(s.seconds for s in stats))
+
+
+_runner = None
+
+
+def runner():
+    '''Return the CommandRunner for this hook execution.'''
+    global _runner
+    if _runner is None:
+        _runner = CommandRunner()
+    return _runner
+
+
+def check_output(cmd, **kwargs):
+    '''subprocess.check_output through the hook's CommandRunner.'''
+    return runner().check_output(cmd, **kwargs)
+
+
+def check_call(cmd, **kwargs):
+    '''subprocess.check_call through the hook's CommandRunner.'''
+    return runner().check_call(cmd, **kwargs)
+
+
+def call(cmd, **kwargs):
+    '''subprocess.call through the hook's CommandRunner.'''
+    return runner().call(cmd, **kwargs)
+
+
+def invalidate(*groups):
+    '''Drop memoized results of groups, or of all groups if none given.'''
+    runner().invalidate(*groups)
+
+
+class SubprocessProxy(object):
+    '''
+    Stand-in for the subprocess module whose check_output(), check_call()
+    and call() go through the hook's CommandRunner. Everything else,
+    e.g. Popen and CalledProcessError, is subprocess's own.
+    '''
+
+    def __getattr__(self, name):
+        return getattr(subprocess, name)
+
+    def check_output(self, cmd, *args, **kwargs):
+        if args:
+            return subprocess.check_output(cmd, *args, **kwargs)
+        return check_output(cmd, **kwargs)
+
+    def check_call(self, cmd, *args, **kwargs):
+        if args:
+            return subprocess.check_call(cmd, *args, **kwargs)
+        return check_call(cmd, **kwargs)
+
+    def call(self, cmd, *args, **kwargs):
+        if args:
+            return subprocess.call(cmd, *args, **kwargs)
+        return call(cmd, **kwargs)
+
+
+class _RoutingLoader(object):
+    '''
+    Wraps the loader of a charmhelpers module so that the module is routed
+    once it has been executed.
+    '''
+
+    def __init__(self, loader, proxy):
+        self.loader = loader
+        self.proxy = proxy
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        self.loader.exec_module(module)
+        _route(module, self.proxy)
+
+
+class _RoutingFinder(object):
+    '''
+    Meta path finder routing the charmhelpers modules imported after
+    route_charmhelpers().
+    '''
+
+    def __init__(self, proxy):
+        self.proxy = proxy
+
+    def find_spec(self, fullname, path, target=None):
+        if not fullname.startswith('charmhelpers.'):
+            return None
+        spec = importlib.machinery.PathFinder.find_spec(fullname, path,
+                                                        target)
+        if spec is None or not hasattr(spec.loader, 'exec_module'):
+            return spec
+        spec.loader = _RoutingLoader(spec.loader, self.proxy)
+        return spec
+
+
+def _route(module, proxy):
+    '''Replace the subprocess module of module with proxy, if it has one.'''
+    if getattr(module, 'subprocess', None) is subprocess:
+        module.subprocess = proxy
+        return True
+    return False
+
+
+def route_charmhelpers():
+    '''
+    Run the commands of the charmhelpers modules imported so far through
+    the hook's CommandRunner by replacing their subprocess module, and do
+    the same for charmhelpers modules imported from now on.
+
+    :returns: the modules routed so far
+    '''
+    proxy = SubprocessProxy()
+    if not any(isinstance(f, _RoutingFinder) for f in sys.meta_path):
+        sys.meta_path.insert(0, _RoutingFinder(proxy))
+    routed = []
+    for name, module in list(sys.modules.items()):
+        if module is None or not name.startswith('charmhelpers'):
+            continue
+        if _route(module, proxy):
+            routed.append(module)
+    return routed
@@ -1,25 +1,21 @@
 # vim: set ts=4:et
 import os
+import re
 import uuid
 from charmhelpers.core.hookenv import (
+    DEBUG,
     config,
-    relation_get,
-    relation_ids,
-    related_units,
     unit_get,
     network_get_primary_address,
-    log,
 )
 from charmhelpers.contrib.openstack.context import (
     OSContextGenerator,
-    NeutronAPIContext,
     NovaVendorMetadataContext,
     NovaVendorMetadataJSONContext,
 )
-from charmhelpers.contrib.openstack.utils import (
-    os_release,
-    CompareOpenStackReleases,
-)
+from charmhelpers.contrib.openstack import context as ch_context
+from charmhelpers.contrib.openstack.neutron import parse_data_port_mappings
+from charmhelpers.contrib.openstack.utils import CompareOpenStackReleases
 from charmhelpers.contrib.hahelpers.cluster import (
     eligible_leader
 )
@@ -28,6 +24,15 @@ from charmhelpers.contrib.network.ip import (
     get_address_in_network,
     get_host_ip,
 )
+from neutron_log import log
+from neutron_nics import nic_inventory
+from neutron_release import os_release
+from neutron_relations import (
+    relation_get,
+    relation_ids,
+    related_units,
+    snapshot_relations,
+)
 
 NEUTRON_ML2_PLUGIN = "ml2"
 NEUTRON_N1KV_PLUGIN = \
@@ -80,6 +85,22 @@ def get_local_ip():
     return local_ip
 
 
+class NeutronAPIContext(ch_context.NeutronAPIContext):
+    '''ch_context.NeutronAPIContext reading the relation snapshot.'''
+
+    def __call__(self):
+        with snapshot_relations(ch_context):
+            return super(NeutronAPIContext, self).__call__()
+
+
+class NetworkServiceContext(ch_context.NetworkServiceContext):
+    '''ch_context.NetworkServiceContext reading the relation snapshot.'''
+
+    def __call__(self):
+        with snapshot_relations(ch_context):
+            return super(NetworkServiceContext, self).__call__()
+
+
 class L3AgentContext(OSContextGenerator):
 
     def __call__(self):
@@ -262,6 +283,111 @@ class NovaMetadataJSONContext(NovaVendorMetadataJSONContext):
             return {'vendor_data_json': '{}'}
 
 
+class NeutronPortContext(ch_context.NeutronPortContext):
+    '''
+    NeutronPortContext resolving ports from the hook's NicInventory rather
+    than forking ip for every NIC on the host.
+    '''
+
+    def resolve_ports(self, ports):
+        if not ports:
+            return None
+
+        inventory = nic_inventory()
+        hwaddr_to_nic = {}
+        for nic in inventory.names:
+            # Ignore virtual interfaces (bond masters will be identified from
+            # their slaves)
+            if not inventory.is_physical(nic):
+                continue
+
+            _nic = inventory.bond_master(nic)
+            if _nic:
+                log("Replacing iface '%s' with bond master '%s'" % (nic, _nic),
+                    level=DEBUG)
+                nic = _nic
+
+            hwaddr_to_nic[inventory.hwaddr(nic)] = nic
+
+        resolved = []
+        mac_regex = re.compile(r'([0-9A-F]{2}[:-]){5}([0-9A-F]{2})', re.I)
+        for entry in ports:
+            if re.match(mac_regex, entry):
+                nic = hwaddr_to_nic.get(entry)
+                # NIC is in known NICs and does NOT have an IP address
+                if nic and not inventory.addresses(nic):
+                    # If the nic is part of a bridge then don't use it
+                    if inventory.is_bridge_member(nic):
+                        continue
+
+                    resolved.append(nic)
+            elif entry in inventory:
+                # An existing interface given by name is trusted to be the
+                # one the user meant.
+                resolved.append(entry)
+
+        # Ensure no duplicates
+        return list(set(resolved))
+
+
+class ExternalPortContext(NeutronPortContext,
+                          ch_context.ExternalPortContext):
+
+    def __call__(self):
+        # NOTE: ch_context.NeutronAPIContext reads neutron-plugin-api.
+        with snapshot_relations(ch_context):
+            return super(ExternalPortContext, self).__call__()
+
+
+class DataPortContext(NeutronPortContext):
+
+    def __call__(self):
+        ports = config('data-port')
+        if ports:
+            # Map of {bridge:port/mac}
+            portmap = parse_data_port_mappings(ports)
+            ports = portmap.keys()
+            # Resolve provided ports or mac addresses and filter out those
+            # already attached to a bridge.
+            resolved = self.resolve_ports(ports)
+            # Rebuild port index using resolved and filtered ports.
+            inventory = nic_inventory()
+            normalized = {inventory.hwaddr(port): port for port in resolved
+                          if port not in ports}
+            normalized.update({port: port for port in resolved
+                               if port in ports})
+            if resolved:
+                return {normalized[port]: bridge for port, bridge in
+                        portmap.items() if port in normalized}
+
+        return None
+
+
+class PhyNICMTUContext(DataPortContext):
+
+    def __call__(self):
+        ctxt = {}
+        mappings = super(PhyNICMTUContext, self).__call__()
+        if mappings:
+            ports = sorted(mappings.keys())
+            napi_settings = NeutronAPIContext()()
+            mtu = napi_settings.get('network_device_mtu')
+            # If any of ports is a vlan device, its underlying device must have
+            # mtu applied first.
+            inventory = nic_inventory()
+            all_ports = set()
+            for port in ports:
+                all_ports.update(inventory.lower(port))
+
+            all_ports = list(all_ports)
+            all_ports.extend(ports)
+            if mtu:
+                ctxt["devs"] = '\\n'.join(all_ports)
+                ctxt['mtu'] = mtu
+
+        return ctxt
+
+
 SHARED_SECRET = "/etc/{}/secret.txt"
 
 
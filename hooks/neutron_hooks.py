@@ -1,25 +1,19 @@
 #!/usr/bin/env python3
 
 from base64 import b64decode
+import functools
+import hashlib
+import json
 
 from charmhelpers.core.hookenv import (
-    log, ERROR, WARNING,
+    DEBUG, ERROR, WARNING, INFO,
     config,
-    relation_get,
-    relation_set,
-    relation_ids,
     Hooks,
     UnregisteredHookError,
     status_set,
+    hook_name,
 )
 from charmhelpers.core.host import service_restart
-from charmhelpers.core.unitdata import kv
-from charmhelpers.fetch import (
-    apt_update,
-    apt_install,
-    filter_installed_packages,
-    apt_purge,
-)
 from charmhelpers.core.host import (
     is_container,
     lsb_release,
@@ -30,57 +24,85 @@ from charmhelpers.contrib.hahelpers.cluster import(
 from charmhelpers.contrib.hahelpers.apache import(
     install_ca_cert
 )
-from charmhelpers.contrib.openstack.utils import (
-    configure_installation_source,
-    openstack_upgrade_available,
-    pausable_restart_on_change as restart_on_change,
-    is_unit_paused_set,
-    series_upgrade_prepare,
-    series_upgrade_complete,
-)
 from charmhelpers.payload.execd import execd_preinstall
 from charmhelpers.core.sysctl import create as create_sysctl
 
-from charmhelpers.contrib.charmsupport import nrpe
-from charmhelpers.contrib.hardening.harden import harden
-
 import sys
-from neutron_utils import (
-    L3HA_PACKAGES,
-    register_configs,
-    restart_map,
-    services,
-    do_openstack_upgrade,
-    get_packages,
-    get_early_packages,
-    valid_plugin,
-    configure_ovs,
-    stop_services,
-    cache_env_data,
-    update_legacy_ha_files,
-    remove_legacy_ha_files,
-    install_legacy_ha_files,
-    cleanup_ovs_netns,
-    stop_neutron_ha_monitor_daemon,
-    use_l3ha,
-    NEUTRON_COMMON,
-    assess_status,
-    install_systemd_override,
-    configure_apparmor,
-    pause_unit_helper,
-    resume_unit_helper,
-    remove_legacy_nova_metadata,
-    disable_nova_metadata,
-    remove_old_packages,
-    deprecated_services,
+from neutron_log import (
+    enable_log_buffer,
+    log,
+)
+from neutron_packages import (
+    apt_install,
+    apt_purge,
+    filter_installed_packages,
+)
+import neutron_commands
+import neutron_profiling
+from neutron_restart import (
+    is_unit_paused_set,
+    restart_on_change,
+)
+from neutron_unitdata import kv
+from neutron_relations import (
+    relation_get,
+    relation_set,
+    relation_ids,
+    relation_snapshot,
 )
 
 hooks = Hooks()
+UPDATE_STATUS_HARDEN_KEY = 'update_status_hardened_config'
+
+# NOTE: neutron_utils, and the contexts, templating, OVS, network and fetch
+#       helpers it pulls in, are imported by the hooks that use them rather
+#       than when this module loads.
+
+# What is done around a hook, by hook name; hooks that are not listed get
+# DEFAULT_HOOK_SETUP. The amqp -joined hooks only pass config values to the
+# remote side and the -changed hook that follows renders the config files
+# and assesses status, so they neither register the config files nor assess
+# status, and never import neutron_utils.
+RESOLVE_CONFIGS = 'resolve-configs'
+ASSESS_STATUS = 'assess-status'
+DEFAULT_HOOK_SETUP = (RESOLVE_CONFIGS, ASSESS_STATUS)
+HOOK_SETUP = {
+    'amqp-relation-joined': (),
+    'amqp-nova-relation-joined': (),
+}
 # Note that CONFIGS is now set up via resolve_CONFIGS so that it is not a
 # module load time constraint.
 CONFIGS = None
 
 
+def harden(overrides=None):
+    """charmhelpers' hardening decorator, imported on first use.
+
+    The hardening checks, and the audits and templating they depend on, are
+    only imported when a decorated hook runs with hardening enabled.
+
+    Once the hook has run, the digest of the config it was hardened for is
+    stored under UPDATE_STATUS_HARDEN_KEY, so update-status does not audit
+    again until config changes.
+
+    :param overrides: hardening modules to run regardless of config
+    :type overrides: list
+    """
+    def _harden_inner1(f):
+        @functools.wraps(f)
+        def _harden_inner2(*args, **kwargs):
+            digest = config_digest()
+            if not (overrides or config('harden')):
+                result = f(*args, **kwargs)
+            else:
+                from charmhelpers.contrib.hardening import harden as ch_harden
+                result = ch_harden.harden(overrides)(f)(*args, **kwargs)
+            kv().set(UPDATE_STATUS_HARDEN_KEY, digest)
+            return result
+        return _harden_inner2
+    return _harden_inner1
+
+
 def resolve_CONFIGS():
     """lazy function to resolve the CONFIGS so that it doesn't have to evaluate
     at module load time.  Note that it also returns the CONFIGS so that it can
@@ -91,13 +113,31 @@ def resolve_CONFIGS():
     """
     global CONFIGS
     if CONFIGS is None:
+        from neutron_utils import register_configs
         CONFIGS = register_configs()
     return CONFIGS
 
 
+def restart_map():
+    """neutron_utils.restart_map(), imported when a hook needs it."""
+    import neutron_utils
+    return neutron_utils.restart_map()
+
+
 @hooks.hook('install')
 @harden()
 def install():
+    from charmhelpers.contrib.openstack.utils import (
+        configure_installation_source,
+    )
+    from charmhelpers.fetch import apt_update
+    from neutron_utils import (
+        get_early_packages,
+        get_packages,
+        install_systemd_override,
+        update_legacy_ha_files,
+        valid_plugin,
+    )
     status_set('maintenance', 'Executing pre-install')
     execd_preinstall()
     src = config('openstack-origin')
@@ -128,9 +168,22 @@ def install():
 
 
 @hooks.hook('config-changed')
-@restart_on_change(restart_map)
+@restart_on_change(restart_map, resolve_CONFIGS)
 @harden()
 def config_changed():
+    from charmhelpers.contrib.openstack.utils import (
+        openstack_upgrade_available,
+    )
+    from neutron_utils import (
+        NEUTRON_COMMON,
+        configure_apparmor,
+        configure_ovs,
+        disable_nova_metadata,
+        do_openstack_upgrade,
+        remove_legacy_nova_metadata,
+        update_legacy_ha_files,
+        valid_plugin,
+    )
     if not config('action-managed-upgrade'):
         if openstack_upgrade_available(NEUTRON_COMMON):
             status_set('maintenance', 'Running openstack upgrade')
@@ -177,12 +230,19 @@ def config_changed():
 @hooks.hook('upgrade-charm')
 @harden()
 def upgrade_charm():
+    from neutron_utils import (
+        install_systemd_override,
+        remove_old_packages,
+        services,
+        update_legacy_ha_files,
+    )
     install()
     packages_removed = remove_old_packages()
     if packages_removed and not is_unit_paused_set():
         log("Package purge detected, restarting services", "INFO")
         for s in services():
             service_restart(s)
+        neutron_commands.invalidate('ovs', 'service')
     config_changed()
     update_legacy_ha_files(force=True)
 
@@ -207,7 +267,7 @@ def amqp_joined(relation_id=None):
 
 @hooks.hook('amqp-nova-relation-departed')
 @hooks.hook('amqp-nova-relation-changed')
-@restart_on_change(restart_map)
+@restart_on_change(restart_map, resolve_CONFIGS)
 def amqp_nova_changed():
     if 'amqp-nova' not in CONFIGS.complete_contexts():
         log('amqp relation incomplete. Peer not ready?')
@@ -216,7 +276,7 @@ def amqp_nova_changed():
 
 
 @hooks.hook('amqp-relation-departed')
-@restart_on_change(restart_map)
+@restart_on_change(restart_map, resolve_CONFIGS)
 def amqp_departed():
     if 'amqp' not in CONFIGS.complete_contexts():
         log('amqp relation incomplete. Peer not ready?')
@@ -227,14 +287,16 @@ def amqp_departed():
 @hooks.hook('amqp-relation-changed',
             'cluster-relation-changed',
             'cluster-relation-joined')
-@restart_on_change(restart_map)
+@restart_on_change(restart_map, resolve_CONFIGS)
 def amqp_changed():
     CONFIGS.write_all()
 
 
 @hooks.hook('neutron-plugin-api-relation-changed')
-@restart_on_change(restart_map)
+@restart_on_change(restart_map, resolve_CONFIGS)
 def neutron_plugin_api_changed():
+    from charmhelpers.fetch import apt_update
+    from neutron_utils import L3HA_PACKAGES, use_l3ha
     if use_l3ha():
         apt_update()
         apt_install(L3HA_PACKAGES, fatal=True)
@@ -242,8 +304,13 @@ def neutron_plugin_api_changed():
 
 
 @hooks.hook('quantum-network-service-relation-changed')
-@restart_on_change(restart_map)
+@restart_on_change(restart_map, resolve_CONFIGS)
 def nm_changed():
+    from neutron_utils import (
+        cache_env_data,
+        disable_nova_metadata,
+        remove_legacy_nova_metadata,
+    )
     CONFIGS.write_all()
     if relation_get('ca_cert'):
         ca_crt = b64decode(relation_get('ca_cert'))
@@ -271,7 +338,7 @@ def nm_changed():
 
 
 @hooks.hook("cluster-relation-departed")
-@restart_on_change(restart_map)
+@restart_on_change(restart_map, resolve_CONFIGS)
 def cluster_departed():
     if config('plugin') in ['nvp', 'nsx']:
         log('Unable to re-assign agent resources for'
@@ -287,6 +354,7 @@ def cluster_departed():
 @hooks.hook('cluster-relation-broken')
 @hooks.hook('stop')
 def stop():
+    from neutron_utils import cleanup_ovs_netns, stop_services
     stop_services()
     if config('ha-legacy-mode'):
         # Cleanup ovs and netns for destroyed units.
@@ -296,6 +364,9 @@ def stop():
 @hooks.hook('nrpe-external-master-relation-joined',
             'nrpe-external-master-relation-changed')
 def update_nrpe_config():
+    # NOTE: only imported by the hooks that manage nrpe checks.
+    from charmhelpers.contrib.charmsupport import nrpe
+    from neutron_utils import deprecated_services, services
     # python-dbus is used by check_upstart_job
     apt_install('python-dbus')
     hostname = nrpe.get_nagios_hostname()
@@ -324,6 +395,7 @@ def update_nrpe_config():
 @hooks.hook('ha-relation-changed')
 def ha_relation_joined():
     if config('ha-legacy-mode'):
+        from neutron_utils import cache_env_data, install_legacy_ha_files
         log('ha-relation-changed update_legacy_ha_files')
         install_legacy_ha_files()
         cache_env_data()
@@ -350,18 +422,39 @@ def ha_relation_destroyed():
     # If e.g. we want to upgrade to Juno and use native Neutron HA support then
     # we need to un-corosync-cluster to enable the transition.
     if config('ha-legacy-mode'):
+        from neutron_utils import (
+            remove_legacy_ha_files,
+            stop_neutron_ha_monitor_daemon,
+        )
         stop_neutron_ha_monitor_daemon()
         remove_legacy_ha_files()
 
 
-@hooks.hook('update-status')
 @harden()
+def harden_update_status():
+    """Run the hardening audits for update-status."""
+    pass
+
+
+def config_digest():
+    """Return a digest of the current charm config."""
+    return hashlib.sha256(
+        json.dumps(config(), sort_keys=True).encode('UTF-8')).hexdigest()
+
+
+@hooks.hook('update-status')
 def update_status():
     log('Updating status.')
+    # NOTE: hardening is applied by the hooks that change config; only
+    #       audit again from update-status if config changed since.
+    if kv().get(UPDATE_STATUS_HARDEN_KEY) != config_digest():
+        harden_update_status()
 
 
 @hooks.hook('pre-series-upgrade')
 def pre_series_upgrade():
+    from charmhelpers.contrib.openstack.utils import series_upgrade_prepare
+    from neutron_utils import pause_unit_helper
     log("Running prepare series upgrade hook", "INFO")
     series_upgrade_prepare(
         pause_unit_helper, CONFIGS)
@@ -369,19 +462,57 @@ def pre_series_upgrade():
 
 @hooks.hook('post-series-upgrade')
 def post_series_upgrade():
+    from charmhelpers.contrib.openstack.utils import series_upgrade_complete
+    from neutron_utils import resume_unit_helper
     log("Running complete series upgrade hook", "INFO")
     series_upgrade_complete(
         resume_unit_helper, CONFIGS)
 
 
+def hook_setup(name):
+    """Return what is done around hook name, see HOOK_SETUP.
+
+    :param name: name of the hook
+    :type name: str
+    :returns: RESOLVE_CONFIGS and/or ASSESS_STATUS
+    :rtype: tuple
+    """
+    return HOOK_SETUP.get(name, DEFAULT_HOOK_SETUP)
+
+
 def main():
+    setup = hook_setup(hook_name())
     try:
-        hooks.execute(sys.argv)
-    except UnregisteredHookError as e:
-        log('Unknown hook {} - skipping.'.format(e))
-    assess_status(CONFIGS)
+        try:
+            with neutron_profiling.span('hook', hook_name()):
+                hooks.execute(sys.argv)
+        except UnregisteredHookError as e:
+            log('Unknown hook {} - skipping.'.format(e))
+        if ASSESS_STATUS in setup:
+            from neutron_utils import assess_status
+            with neutron_profiling.span('assess-status', 'assess_status'):
+                assess_status(CONFIGS)
+        # NOTE: assess_status() runs after the hook's atexit callbacks have
+        #       flushed unitdata, so persist what it recorded.
+        kv().flush()
+    finally:
+        neutron_profiling.finish()
+    log(neutron_commands.runner().summary(), level=DEBUG)
+    snapshot = relation_snapshot()
+    log('Relation snapshot served {} lookups using {} hook tool calls '
+        '({} calls saved)'.format(snapshot.hits + snapshot.tool_calls,
+                                  snapshot.tool_calls,
+                                  snapshot.calls_saved),
+        level=DEBUG)
 
 
 if __name__ == '__main__':
-    resolve_CONFIGS()
+    # NOTE: batch juju-log calls for the duration of the hook, dropping
+    #       DEBUG messages unless debug logging has been requested.
+    enable_log_buffer(threshold=None if config('debug') else INFO)
+    neutron_commands.route_charmhelpers()
+    if config('profile-hooks'):
+        neutron_profiling.enable(hook_name())
+    if RESOLVE_CONFIGS in hook_setup(hook_name()):
+        resolve_CONFIGS()
     main()
@@ -0,0 +1,132 @@
+# vim: set ts=4:et
+'''
+Buffered juju-log for the charm and charmhelpers.
+
+charmhelpers.core.hookenv.log() runs juju-log for every message. Once
+enable_log_buffer() has been called, log() here keeps messages in memory
+and writes them out with one juju-log call per run of consecutive messages
+of the same level. Messages logged by charmhelpers go into the same buffer,
+so all messages stay in order.
+'''
+import atexit
+import itertools
+import sys
+
+from charmhelpers.core import hookenv
+from charmhelpers.core.hookenv import (
+    TRACE,
+    DEBUG,
+    INFO,
+    WARNING,
+    ERROR,
+    CRITICAL,
+)
+
+# Severity ordering used by the threshold; unknown levels are never dropped
+# and no level means INFO, as for juju-log.
+LOG_LEVELS = {TRACE: 0, DEBUG: 1, INFO: 2, WARNING: 3, ERROR: 4, CRITICAL: 5}
+# Messages at these levels are written out immediately, with any buffered
+# before them.
+FLUSH_LEVELS = (ERROR, CRITICAL)
+LOG_BUFFER_SIZE = 100
+
+
+class LogBuffer(object):
+    '''
+    Log messages waiting to be written to the juju log.
+
+    :param threshold: drop messages of lower severity than this level
+    :param size: number of messages after which the buffer is written out
+    '''
+
+    def __init__(self, threshold=None, size=LOG_BUFFER_SIZE):
+        self.threshold = threshold
+        self.size = size
+        self._messages = []
+        # hookenv.log() is replaced by append() once the buffer is enabled
+        self.juju_log = hookenv.log
+
+    def log(self, message, level=None):
+        if self.threshold is not None:
+            severity = LOG_LEVELS.get(level or INFO, LOG_LEVELS[CRITICAL])
+            if severity < LOG_LEVELS[self.threshold]:
+                return
+        self.append(message, level)
+
+    def append(self, message, level=None):
+        '''Buffer a message regardless of the threshold.'''
+        if not isinstance(message, str):
+            message = repr(message)
+        self._messages.append((level, message[:hookenv.SH_MAX_ARG]))
+        if level in FLUSH_LEVELS or len(self._messages) >= self.size:
+            self.flush()
+
+    def flush(self):
+        '''
+        Write out the buffered messages, joining consecutive messages of the
+        same level into as few juju-log calls as SH_MAX_ARG allows.
+        '''
+        messages, self._messages = self._messages, []
+        for level, run in itertools.groupby(messages, key=lambda m: m[0]):
+            batch = None
+            for _, message in run:
+                if batch is None:
+                    batch = message
+                elif len(batch) + len(message) < hookenv.SH_MAX_ARG:
+                    batch = '{}\n{}'.format(batch, message)
+                else:
+                    self.juju_log(batch, level=level)
+                    batch = message
+            self.juju_log(batch, level=level)
+
+
+_log_buffer = None
+
+
+def enable_log_buffer(threshold=None):
+    '''
+    Buffer log() and charmhelpers' log messages for the rest of the hook.
+
+    The buffer is written out when ERROR or CRITICAL is logged, when it
+    holds LOG_BUFFER_SIZE messages and when the interpreter exits, which
+    includes exiting on an unhandled exception.
+
+    :param threshold: drop log() messages of lower severity than this level,
+                      charmhelpers' messages are all kept
+    '''
+    global _log_buffer
+    if _log_buffer is None:
+        _log_buffer = LogBuffer(threshold)
+        atexit.register(_log_buffer.flush)
+        _redirect_log(_log_buffer.juju_log, _charmhelpers_log)
+    else:
+        _log_buffer.threshold = threshold
+
+
+def _redirect_log(original, replacement):
+    '''
+    Replace every reference to the original log function held by a
+    charmhelpers module.
+
+    This covers hookenv.log itself, so modules imported later get
+    replacement, and names bound by `from charmhelpers.core.hookenv import
+    log` in modules that are already imported.
+    '''
+    for name, module in list(sys.modules.items()):
+        if module is None or not name.startswith('charmhelpers'):
+            continue
+        for attr, value in list(vars(module).items()):
+            if value is original:
+                setattr(module, attr, replacement)
+
+
+def _charmhelpers_log(message, level=None):
+    _log_buffer.append(message, level)
+
+
+def log(message, level=None):
+    '''Write a message to the juju log, see hookenv.log().'''
+    if _log_buffer is None:
+        hookenv.log(message, level=level)
+    else:
+        _log_buffer.log(message, level)
@@ -0,0 +1,147 @@
+# vim: set ts=4:et
+'''
+Network interface inventory for the charm's hooks.
+
+charmhelpers resolves the ext-port and data-port NICs by forking ip and
+globbing sysfs once per NIC on the host. NicInventory reads what those
+lookups need in a single pass over /sys/class/net and is kept for the rest
+of the hook, see nic_inventory().
+'''
+import glob
+import os
+
+from charmhelpers.core import host
+from charmhelpers.contrib.network.ip import (
+    get_ipv4_addr,
+    get_ipv6_addr,
+)
+
+SYS_CLASS_NET = '/sys/class/net'
+# ARPHRD_ETHER, see include/uapi/linux/if_arp.h
+ARPHRD_ETHER = '1'
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def _ifindex(sys_net, nic):
+    try:
+        return int(_read(os.path.join(sys_net, nic, 'ifindex')))
+    except (TypeError, ValueError):
+        return 0
+
+
+def list_nics(sys_net=SYS_CLASS_NET):
+    '''
+    Return the names of the network interfaces on this host in ifindex
+    order, as `ip a` lists them.
+
+    Names are read from sysfs where it is available. Only entries with an
+    ifindex are interfaces; /sys/class/net also holds files such as
+    bonding_masters.
+    '''
+    if not os.path.isdir(sys_net):
+        return host.list_nics()
+    nics = [nic for nic in os.listdir(sys_net)
+            if os.path.isfile(os.path.join(sys_net, nic, 'ifindex'))]
+    return sorted(nics, key=lambda nic: _ifindex(sys_net, nic))
+
+
+class NicInventory(object):
+    '''
+    Snapshot of the network interfaces on this host.
+
+    Holds the physical/virtual flag, bond master, bridge, hardware address,
+    MTU and lower devices of every NIC. Addresses are looked up when first
+    asked for, once per NIC.
+
+    :param sys_net: sysfs directory to read the interfaces from
+    '''
+
+    def __init__(self, sys_net=SYS_CLASS_NET):
+        self.sys_net = sys_net
+        self.names = list_nics(sys_net)
+        self.nics = {nic: self._read_nic(nic) for nic in self.names}
+        self._addresses = {}
+
+    def _read_nic(self, nic):
+        path = os.path.join(self.sys_net, nic)
+        info = {
+            'physical': '/virtual/' not in os.path.realpath(path),
+            'hwaddr': '',
+            'mtu': _read(os.path.join(path, 'mtu')),
+            'bond_master': None,
+            'bridge': None,
+            'lower': sorted(os.path.basename(lower).split('_', 1)[1]
+                            for lower in glob.glob(
+                                os.path.join(path, 'lower_*'))),
+        }
+        if _read(os.path.join(path, 'type')) == ARPHRD_ETHER:
+            info['hwaddr'] = _read(os.path.join(path, 'address')) or ''
+        master = os.path.join(path, 'master')
+        if os.path.exists(master):
+            master = os.path.realpath(master)
+            if os.path.exists(os.path.join(master, 'bonding')):
+                info['bond_master'] = os.path.basename(master)
+            elif os.path.exists(os.path.join(master, 'bridge')):
+                info['bridge'] = os.path.basename(master)
+        return info
+
+    def __contains__(self, nic):
+        return nic in self.nics
+
+    def is_physical(self, nic):
+        '''Return True if nic exists and is not virtual.'''
+        return nic in self.nics and self.nics[nic]['physical']
+
+    def bond_master(self, nic):
+        '''Return the bond master of a physical nic, otherwise None.'''
+        if not self.is_physical(nic):
+            return None
+        return self.nics[nic]['bond_master']
+
+    def is_bridge_member(self, nic):
+        '''Return True if nic is enslaved to a Linux bridge.'''
+        return nic in self.nics and self.nics[nic]['bridge'] is not None
+
+    def hwaddr(self, nic):
+        '''Return the Ethernet hardware address of nic, or an empty string.'''
+        return self.nics[nic]['hwaddr'] if nic in self.nics else ''
+
+    def mtu(self, nic):
+        '''Return the MTU of nic as reported by sysfs.'''
+        return self.nics[nic]['mtu'] if nic in self.nics else None
+
+    def lower(self, nic):
+        '''Return the devices nic is stacked on, e.g. a VLAN's parent.'''
+        return self.nics[nic]['lower'] if nic in self.nics else []
+
+    def addresses(self, nic):
+        '''Return the IPv4 and IPv6 addresses assigned to nic.'''
+        if nic not in self._addresses:
+            addresses = get_ipv4_addr(nic, fatal=False)
+            addresses += get_ipv6_addr(iface=nic, fatal=False)
+            self._addresses[nic] = addresses
+        return self._addresses[nic]
+
+
+_nic_inventory = None
+
+
+def nic_inventory():
+    '''Return the NicInventory for this hook, building it on first use.'''
+    global _nic_inventory
+    if _nic_inventory is None:
+        _nic_inventory = NicInventory()
+    return _nic_inventory
+
+
+def reset_nic_inventory():
+    '''Discard the cached NicInventory, e.g. after reconfiguring NICs.'''
+    global _nic_inventory
+    _nic_inventory = None
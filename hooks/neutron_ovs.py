@@ -0,0 +1,246 @@
+# vim: set ts=4:et
+'''
+Batched configuration of the local Open vSwitch.
+
+configure_ovs() gathers the bridges, ports and IPFIX settings the unit
+needs in an OVSTransaction, which applies only what differs from the
+current OVSDB and kernel link state, with one ovs-vsctl and one ip call.
+'''
+import collections
+import json
+
+from charmhelpers.core.hookenv import DEBUG
+from charmhelpers.contrib.network.ovs import _dict_to_vsctl_set
+
+import neutron_commands
+from neutron_log import log
+
+
+IFF_UP = 0x1
+IFF_PROMISC = 0x100
+
+
+def _decode_ovsdb_value(value):
+    '''Decode a RFC 7047 5.1 JSON value as output by ``ovs-vsctl -f json``.
+
+    :param value: Value to decode
+    :type value: any
+    :returns: uuid and atoms as str/int, sets as list and maps as dict
+    :rtype: any
+    '''
+    if isinstance(value, list) and len(value) == 2:
+        if value[0] in ('uuid', 'named-uuid'):
+            return value[1]
+        if value[0] == 'set':
+            return [_decode_ovsdb_value(v) for v in value[1]]
+        if value[0] == 'map':
+            return {_decode_ovsdb_value(k): _decode_ovsdb_value(v)
+                    for k, v in value[1]}
+    return value
+
+
+def _as_set(value):
+    '''Normalise an OVSDB column value that may be a single atom or a set.'''
+    if isinstance(value, list):
+        return value
+    return [value]
+
+
+def get_ovsdb_state():
+    '''Return the bridge, port and IPFIX configuration of the local OVSDB.
+
+    All three tables are read in a single ``ovs-vsctl`` invocation.
+
+    :returns: {bridge: {'ports': set of port names,
+                        'ipfix': Optional[Dict[str, any]]}}
+    :rtype: Dict[str, Dict[str, any]]
+    :raises: subprocess.CalledProcessError
+    '''
+    output = neutron_commands.check_output(
+        ['ovs-vsctl', '-f', 'json',
+         '--', 'list', 'Bridge',
+         '--', 'list', 'Port',
+         '--', 'list', 'IPFIX']).decode('UTF-8')
+    tables = []
+    decoder = json.JSONDecoder()
+    idx = 0
+    while idx < len(output):
+        if output[idx].isspace():
+            idx += 1
+            continue
+        data, idx = decoder.raw_decode(output, idx)
+        tables.append([
+            {k: _decode_ovsdb_value(v)
+             for k, v in zip(data['headings'], row)}
+            for row in data['data']])
+    bridges, ports, ipfixes = tables
+    port_names = {p['_uuid']: p['name'] for p in ports}
+    ipfix_rows = {i['_uuid']: i for i in ipfixes}
+    state = {}
+    for bridge in bridges:
+        ipfix = _as_set(bridge.get('ipfix', []))
+        state[bridge['name']] = {
+            'ports': set(port_names.get(p)
+                         for p in _as_set(bridge.get('ports', []))),
+            'ipfix': ipfix_rows.get(ipfix[0]) if ipfix else None,
+        }
+    return state
+
+
+def _get_link_flags(port):
+    '''Return the kernel interface flags for port, or None if unknown.'''
+    try:
+        with open('/sys/class/net/{}/flags'.format(port)) as flags:
+            return int(flags.read().strip(), 16)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+class OVSTransaction(object):
+    '''Gather bridge, port and IPFIX changes and apply them in one go.
+
+    Changes are diffed against the current OVSDB state and the ones that
+    would be no-ops are dropped; the remainder is applied in a single
+    ``ovs-vsctl -- ... -- ...`` invocation, which OVSDB executes as one
+    transaction. Link state and promiscuous mode for ports are compared
+    against the kernel interface flags and any required changes are applied
+    with a single ``ip -batch`` invocation.
+
+    Example::
+
+        txn = OVSTransaction()
+        txn.add_bridge('br-ex')
+        txn.add_bridge_port('br-ex', 'eth1', promisc=True)
+        txn.enable_ipfix('br-ex', '10.0.0.1:4739')
+        txn.commit()
+    '''
+
+    def __init__(self):
+        self._bridges = collections.OrderedDict()
+        self._ports = collections.OrderedDict()
+        self._ipfix = collections.OrderedDict()
+
+    def add_bridge(self, name, brdata=None):
+        '''Ensure bridge exists, see ovs.add_bridge() for parameters.'''
+        self._bridges[name] = brdata
+
+    def add_bridge_port(self, name, port, promisc=False, ifdata=None,
+                        linkup=True, portdata=None):
+        '''Ensure port is on bridge, see ovs.add_bridge_port().'''
+        self._ports[(name, port)] = {
+            'promisc': promisc,
+            'ifdata': ifdata,
+            'linkup': linkup,
+            'portdata': portdata,
+        }
+
+    def enable_ipfix(self, bridge, target, cache_active_timeout=60,
+                     cache_max_flows=128, sampling=64):
+        '''Ensure IPFIX is enabled on bridge, see ovs.enable_ipfix().'''
+        self._ipfix[bridge] = {
+            'targets': [target],
+            'sampling': sampling,
+            'cache_active_timeout': cache_active_timeout,
+            'cache_max_flows': cache_max_flows,
+        }
+
+    def disable_ipfix(self, bridge):
+        '''Ensure IPFIX is disabled on bridge.'''
+        self._ipfix[bridge] = None
+
+    @staticmethod
+    def _ipfix_matches(current, desired):
+        if current is None or desired is None:
+            return current is desired
+        for key, value in desired.items():
+            current_value = current.get(key)
+            if key == 'targets':
+                current_value = sorted(_as_set(current_value))
+            if current_value != value:
+                return False
+        return True
+
+    def vsctl_commands(self, state):
+        '''Return the ``ovs-vsctl`` arguments needed to reach desired state.
+
+        :param state: Current OVSDB state as returned by get_ovsdb_state()
+        :type state: Dict[str, Dict[str, any]]
+        :returns: ``--`` separated ovs-vsctl arguments, empty if no-op
+        :rtype: List[str]
+        '''
+        cmd = []
+        for name, brdata in self._bridges.items():
+            if name not in state:
+                log('Creating bridge {}'.format(name))
+                cmd.extend(('--', '--may-exist', 'add-br', name))
+            if brdata:
+                for setcmd in _dict_to_vsctl_set(brdata, 'bridge', name):
+                    cmd.extend(setcmd)
+        for (name, port), opts in self._ports.items():
+            if port not in state.get(name, {}).get('ports', ()):
+                log('Adding port {} to bridge {}'.format(port, name))
+                cmd.extend(('--', '--may-exist', 'add-port', name, port))
+            for ovs_table, data in (('Interface', opts['ifdata']),
+                                    ('Port', opts['portdata'])):
+                if data:
+                    for setcmd in _dict_to_vsctl_set(data, ovs_table, port):
+                        cmd.extend(setcmd)
+        for i, (bridge, ipfix) in enumerate(self._ipfix.items()):
+            current = state.get(bridge, {}).get('ipfix')
+            if self._ipfix_matches(current, ipfix):
+                continue
+            if ipfix is None:
+                cmd.extend(('--', 'clear', 'Bridge', bridge, 'ipfix'))
+                continue
+            log('Enabling IPfix on {}.'.format(bridge))
+            ref = '@i{}'.format(i)
+            cmd.extend((
+                '--', 'set', 'Bridge', bridge, 'ipfix={}'.format(ref),
+                '--', '--id={}'.format(ref), 'create', 'IPFIX',
+                'targets="{}"'.format(','.join(ipfix['targets'])),
+                'sampling={}'.format(ipfix['sampling']),
+                'cache_active_timeout={}'.format(
+                    ipfix['cache_active_timeout']),
+                'cache_max_flows={}'.format(ipfix['cache_max_flows']),
+            ))
+        return cmd
+
+    def link_commands(self):
+        '''Return ``ip -batch`` lines to set link state for added ports.
+
+        :returns: List of ``link set`` commands, empty if no-op
+        :rtype: List[str]
+        '''
+        lines = []
+        for (_, port), opts in self._ports.items():
+            flags = _get_link_flags(port)
+            args = []
+            if opts['linkup'] and (flags is None or not flags & IFF_UP):
+                args.append('up')
+            promisc = opts['promisc']
+            if promisc is not None:
+                is_promisc = flags is not None and bool(flags & IFF_PROMISC)
+                if flags is None or promisc != is_promisc:
+                    args.extend(('promisc', 'on' if promisc else 'off'))
+            if args:
+                lines.append(' '.join(['link', 'set', 'dev', port] + args))
+        return lines
+
+    def commit(self):
+        '''Apply all gathered changes.
+
+        :returns: True if any change was applied
+        :rtype: bool
+        :raises: subprocess.CalledProcessError
+        '''
+        cmd = self.vsctl_commands(get_ovsdb_state())
+        if cmd:
+            neutron_commands.check_call(['ovs-vsctl'] + cmd)
+        lines = self.link_commands()
+        if lines:
+            neutron_commands.check_output(
+                ['ip', '-force', '-batch', '-'],
+                input=('\n'.join(lines) + '\n').encode('UTF-8'))
+        if not cmd and not lines:
+            log('OVS configuration unchanged', level=DEBUG)
+        return bool(cmd or lines)
@@ -0,0 +1,161 @@
+# vim: set ts=4:et
+'''
+Package lookups for the charm's hooks.
+
+charmhelpers.fetch.filter_installed_packages() runs apt-cache and dpkg-query
+for every package it is given. The lookups here read the dpkg status
+database into an index instead, which is only read again when the file is
+replaced or after the charm installs, upgrades or purges packages.
+
+charmhelpers.fetch is only imported when a lookup falls back to it or a
+package is installed, upgraded or purged.
+'''
+import io
+import itertools
+import os
+
+import neutron_commands
+from neutron_profiling import span
+
+DPKG_STATUS = '/var/lib/dpkg/status'
+
+
+def _parse_dpkg_status(fd):
+    '''
+    Parse the installed packages from a dpkg status file.
+
+    Only packages whose status is "install ok installed" are included, the
+    "ii" packages of dpkg-query --list. Multi-Arch: same packages are
+    indexed by both name and name:arch.
+
+    :param fd: open dpkg status file
+    :returns: {package: {'version': ..., 'architecture': ...}}
+    :rtype: dict
+    '''
+    packages = {}
+    fields = {}
+    for line in itertools.chain(fd, ['']):
+        line = line.rstrip('\n')
+        if line.startswith((' ', '\t')):
+            continue
+        if line:
+            key, _, value = line.partition(':')
+            fields[key.lower()] = value.strip()
+            continue
+        if fields.get('status', '').split()[::2] == ['install', 'installed']:
+            package = {
+                'version': fields.get('version'),
+                'architecture': fields.get('architecture'),
+            }
+            packages[fields['package']] = package
+            if fields.get('multi-arch') == 'same':
+                packages['{}:{}'.format(fields['package'],
+                                        package['architecture'])] = package
+        fields = {}
+    return packages
+
+
+class DpkgStatusIndex(object):
+    '''
+    Installed packages from the dpkg status database.
+
+    The file is parsed when first needed and again whenever its stat
+    signature (mtime, inode and size) changes; dpkg replaces it by renaming
+    a new file into place. invalidate() forces it to be read again.
+    '''
+
+    def __init__(self, path=DPKG_STATUS):
+        self.path = path
+        self._signature = None
+        self._packages = None
+
+    def invalidate(self):
+        self._signature = None
+        self._packages = None
+
+    @property
+    def packages(self):
+        '''
+        Installed packages as returned by _parse_dpkg_status(), or None if
+        the status file cannot be read.
+        '''
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            self.invalidate()
+            return None
+        signature = (st.st_mtime, st.st_ino, st.st_size)
+        if self._packages is None or signature != self._signature:
+            with io.open(self.path, encoding='UTF-8', errors='replace') as fd:
+                self._packages = _parse_dpkg_status(fd)
+            self._signature = signature
+        return self._packages
+
+
+_dpkg_status_index = None
+
+
+def dpkg_status_index():
+    '''Return the DpkgStatusIndex shared by the current hook.'''
+    global _dpkg_status_index
+    if _dpkg_status_index is None:
+        _dpkg_status_index = DpkgStatusIndex()
+    return _dpkg_status_index
+
+
+def filter_installed_packages(packages):
+    '''Return a list of packages that require installation.'''
+    installed = dpkg_status_index().packages
+    if installed is None:
+        from charmhelpers import fetch
+        return fetch.filter_installed_packages(packages)
+    return [package for package in packages if package not in installed]
+
+
+def filter_missing_packages(packages):
+    '''Return a list of packages that are installed.'''
+    return list(set(packages) - set(filter_installed_packages(packages)))
+
+
+def installed_version(package):
+    '''
+    Return the installed version of package, or None if it is not
+    installed or the dpkg status database cannot be read.
+    '''
+    installed = dpkg_status_index().packages
+    if installed is None or package not in installed:
+        return None
+    return installed[package]['version']
+
+
+def apt_install(packages, options=None, fatal=False):
+    '''charmhelpers.fetch.apt_install(), then invalidate the caches.'''
+    from charmhelpers import fetch
+    try:
+        with span('apt', 'apt-get install', packages=packages):
+            fetch.apt_install(packages, options=options, fatal=fatal)
+    finally:
+        dpkg_status_index().invalidate()
+        neutron_commands.invalidate('ovs', 'service')
+
+
+def apt_upgrade(options=None, fatal=False, dist=False):
+    '''charmhelpers.fetch.apt_upgrade(), then invalidate the caches.'''
+    from charmhelpers import fetch
+    try:
+        with span('apt', 'apt-get upgrade'):
+            fetch.apt_upgrade(options=options, fatal=fatal, dist=dist)
+    finally:
+        dpkg_status_index().invalidate()
+        neutron_commands.invalidate('ovs', 'service')
+
+
+def apt_purge(packages, fatal=False):
+    '''charmhelpers.fetch.apt_purge(), then invalidate the caches.'''
+    from charmhelpers import fetch
+    try:
+        with span('apt', 'apt-get purge', packages=packages):
+            fetch.apt_purge(packages, fatal=fatal)
+    finally:
+        dpkg_status_index().invalidate()
+        neutron_commands.invalidate('ovs', 'service')
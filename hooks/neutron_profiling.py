@@ -0,0 +1,236 @@
+# vim: set ts=4:et
+'''
+Opt-in wall time profiling of the charm's hooks.
+
+Once enable() has been called, spans are recorded for the hook itself,
+each context generator evaluation, each template render, apt operations,
+service restarts and the commands the charm runs through check_output(),
+check_call() and call() here. Commands are grouped by the tool they run, so
+OVS and service management show up as phases of their own. finish() writes
+everything to a JSON report under REPORT_DIR and logs a one line summary.
+
+Spans may nest (e.g. a context generator running a command) so phase
+totals can add up to more than the hook's wall time.
+'''
+import contextlib
+import json
+import os
+import subprocess
+import time
+
+from charmhelpers.core.hookenv import (
+    INFO,
+    WARNING,
+    local_unit,
+)
+
+from neutron_log import log
+
+# Reports are kept out of the charm directory, which upgrade-charm replaces.
+REPORT_DIR = '/var/lib/juju/hook-profiles'
+
+# Phase that commands are accounted under, keyed on the tool they run.
+SUBPROCESS_PHASES = {
+    'apt-get': 'apt',
+    'apt-cache': 'apt',
+    'apt-mark': 'apt',
+    'dpkg': 'apt',
+    'ovs-vsctl': 'ovs',
+    'ovs-ofctl': 'ovs',
+    'ovs-appctl': 'ovs',
+    'ovs-dpctl': 'ovs',
+    'service': 'service',
+    'systemctl': 'service',
+    'initctl': 'service',
+}
+
+SUMMARY_SLOWEST = 3
+
+
+def _argv(cmd):
+    if isinstance(cmd, (list, tuple)):
+        return [str(arg) for arg in cmd]
+    return str(cmd).split()
+
+
+def subprocess_phase(cmd):
+    '''Return the phase a command is accounted under.'''
+    argv = _argv(cmd)
+    if argv and argv[0] == 'sudo':
+        argv = argv[1:]
+    if not argv:
+        return 'subprocess'
+    return SUBPROCESS_PHASES.get(os.path.basename(argv[0]), 'subprocess')
+
+
+class HookProfiler(object):
+    '''
+    Wall time spans recorded during one hook execution.
+
+    :param hook_name: name of the hook being profiled
+    '''
+
+    def __init__(self, hook_name):
+        self.hook_name = hook_name
+        self.started = time.time()
+        self.spans = []
+
+    def record(self, phase, name, duration, **info):
+        entry = {
+            'phase': phase,
+            'name': name,
+            'offset': round(time.time() - duration - self.started, 6),
+            'duration': round(duration, 6),
+        }
+        entry.update(info)
+        self.spans.append(entry)
+
+    @contextlib.contextmanager
+    def span(self, phase, name, **info):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record(phase, name, time.time() - start, **info)
+
+    def phases(self):
+        '''Return {phase: {'count': n, 'duration': seconds}}.'''
+        totals = {}
+        for entry in self.spans:
+            total = totals.setdefault(entry['phase'],
+                                      {'count': 0, 'duration': 0.0})
+            total['count'] += 1
+            total['duration'] = round(total['duration'] + entry['duration'],
+                                      6)
+        return totals
+
+    def report(self):
+        return {
+            'hook': self.hook_name,
+            'unit': local_unit(),
+            'started': self.started,
+            'duration': round(time.time() - self.started, 6),
+            'phases': self.phases(),
+            'spans': self.spans,
+        }
+
+    def summary(self, report=None):
+        '''Return a one line summary of report for the juju log.'''
+        report = report or self.report()
+        phases = sorted(report['phases'].items(),
+                        key=lambda p: p[1]['duration'], reverse=True)
+        slowest = sorted((s for s in self.spans if s['phase'] != 'hook'),
+                         key=lambda s: s['duration'], reverse=True)
+        return 'Hook profile {}: {:.3f}s; {}; slowest: {}'.format(
+            self.hook_name, report['duration'],
+            ', '.join('{} {}x {:.3f}s'.format(phase, t['count'],
+                                              t['duration'])
+                      for phase, t in phases) or 'no spans',
+            ', '.join('{} {:.3f}s'.format(s['name'], s['duration'])
+                      for s in slowest[:SUMMARY_SLOWEST]) or 'none')
+
+
+_profiler = None
+
+
+def profiler():
+    '''Return the active HookProfiler, or None if profiling is disabled.'''
+    return _profiler
+
+
+def enable(hook_name):
+    '''Start profiling the execution of hook_name.'''
+    global _profiler
+    if _profiler is None:
+        _profiler = HookProfiler(hook_name)
+    return _profiler
+
+
+def disable():
+    '''Stop profiling, discarding anything recorded.'''
+    global _profiler
+    _profiler = None
+
+
+@contextlib.contextmanager
+def span(phase, name, **info):
+    '''Record the wall time of the enclosed block if profiling is enabled.'''
+    if _profiler is None:
+        yield
+    else:
+        with _profiler.span(phase, name, **info):
+            yield
+
+
+def _run(func, cmd, kwargs):
+    if _profiler is None:
+        return func(cmd, **kwargs)
+    argv = _argv(cmd)
+    start = time.time()
+    returncode = 0
+    try:
+        result = func(cmd, **kwargs)
+        # call() returns the exit status, check_output() the output
+        if isinstance(result, int):
+            returncode = result
+        return result
+    except subprocess.CalledProcessError as e:
+        returncode = e.returncode
+        raise
+    except OSError:
+        returncode = None
+        raise
+    finally:
+        if _profiler is not None:
+            _profiler.record(subprocess_phase(argv), ' '.join(argv),
+                             time.time() - start, argv=argv,
+                             returncode=returncode)
+
+
+def check_output(cmd, **kwargs):
+    '''subprocess.check_output, recorded as a span while profiling.'''
+    return _run(subprocess.check_output, cmd, kwargs)
+
+
+def check_call(cmd, **kwargs):
+    '''subprocess.check_call, recorded as a span while profiling.'''
+    return _run(subprocess.check_call, cmd, kwargs)
+
+
+def call(cmd, **kwargs):
+    '''subprocess.call, recorded as a span while profiling.'''
+    return _run(subprocess.call, cmd, kwargs)
+
+
+def report_path(hook_name, unit=None):
+    '''Return the path of the report for hook_name of this unit.'''
+    unit = (unit or local_unit() or 'unknown').replace('/', '-')
+    return os.path.join(REPORT_DIR, unit, '{}.json'.format(hook_name))
+
+
+def finish():
+    '''
+    Write the JSON report and log the summary, then stop profiling.
+
+    The report for each hook name replaces that of its previous run.
+
+    :returns: path of the report written, or None if profiling is disabled
+              or the report could not be written.
+    '''
+    profile = _profiler
+    if profile is None:
+        return None
+    disable()
+    report = profile.report()
+    path = report_path(profile.hook_name, report['unit'])
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    except (IOError, OSError) as e:
+        log('Unable to write hook profile {}: {}'.format(path, e),
+            level=WARNING)
+        path = None
+    log(profile.summary(report), level=INFO)
+    return path
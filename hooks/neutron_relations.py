@@ -0,0 +1,169 @@
+# vim: set ts=4:et
+'''
+Hook-scoped cache of the relation data read by the charm.
+
+relation_ids(), related_units() and relation_get() behave like their
+charmhelpers.core.hookenv namesakes but remember each answer for the rest of
+the hook, and relation_get() fetches all settings of a unit with a single
+relation-get call so that looking up several attributes of the same unit
+only forks the Juju hook tool once. Nothing is loaded until it is first
+asked for.
+
+relation_set() invalidates the cached settings of the local unit on the
+relation it changed.
+
+charmhelpers' context generators call the hookenv helpers directly;
+snapshot_relations() serves them from the snapshot while they run.
+'''
+import contextlib
+
+from charmhelpers.core import hookenv
+
+RELATION_HELPERS = ('relation_ids', 'related_units', 'relation_get')
+
+
+class RelationSnapshot(object):
+    '''
+    Relation ids, units and settings looked up during the current hook.
+
+    Every lookup that is not in the snapshot yet costs one hook tool call,
+    every later lookup of the same data is a hit served from memory.
+
+    hookenv memoizes each relation helper by its arguments, so a hit only
+    saves a tool call if the same question was not asked before in the
+    hook, e.g. a different attribute of settings already loaded.
+    '''
+
+    def __init__(self):
+        self._relation_ids = {}
+        self._related_units = {}
+        self._settings = {}
+        # (helper, args) of the hookenv calls the lookups stand in for
+        self._asked = set()
+        self.tool_calls = 0
+        self.hits = 0
+        self.calls_saved = 0
+
+    def _hit(self, question):
+        self.hits += 1
+        if question not in self._asked:
+            self._asked.add(question)
+            self.calls_saved += 1
+
+    def _miss(self, question):
+        self.tool_calls += 1
+        self._asked.add(question)
+
+    def relation_ids(self, reltype):
+        question = ('relation_ids', reltype)
+        if reltype in self._relation_ids:
+            self._hit(question)
+        else:
+            self._miss(question)
+            self._relation_ids[reltype] = hookenv.relation_ids(reltype)
+        return list(self._relation_ids[reltype])
+
+    def related_units(self, rid):
+        question = ('related_units', rid)
+        if rid in self._related_units:
+            self._hit(question)
+        else:
+            self._miss(question)
+            self._related_units[rid] = hookenv.related_units(rid)
+        return list(self._related_units[rid])
+
+    def settings(self, rid, unit, attribute=None):
+        '''
+        Return a copy of all settings of unit on relation rid, or None if
+        they could not be read (e.g. the unit has already departed).
+
+        :param attribute: the setting the caller is after, for accounting
+        '''
+        key = (rid, unit)
+        question = ('relation_get', attribute, rid, unit)
+        if key in self._settings:
+            self._hit(question)
+        else:
+            self._miss(question)
+            settings = hookenv.relation_get(rid=rid, unit=unit)
+            if settings is None:
+                return None
+            self._settings[key] = settings
+        return dict(self._settings[key])
+
+    def invalidate(self, rid=None, unit=None):
+        '''Forget the settings cached for rid and/or unit.'''
+        for _rid, _unit in list(self._settings):
+            if rid not in (None, _rid) or unit not in (None, _unit):
+                continue
+            del self._settings[(_rid, _unit)]
+        # hookenv.relation_set() flushes hookenv's memo of the local unit
+        if unit is not None:
+            self._asked = {q for q in self._asked if unit not in q}
+
+
+_snapshot = None
+
+
+def relation_snapshot():
+    '''Return the RelationSnapshot of the current hook.'''
+    global _snapshot
+    if _snapshot is None:
+        _snapshot = RelationSnapshot()
+    return _snapshot
+
+
+def relation_ids(reltype=None):
+    '''A list of relation ids, see hookenv.relation_ids()'''
+    reltype = reltype or hookenv.relation_type()
+    if reltype is None:
+        return []
+    return relation_snapshot().relation_ids(reltype)
+
+
+def related_units(relid=None):
+    '''A list of related units, see hookenv.related_units()'''
+    relid = relid or hookenv.relation_id()
+    if relid is None:
+        return hookenv.related_units()
+    return relation_snapshot().related_units(relid)
+
+
+def relation_get(attribute=None, unit=None, rid=None):
+    '''Get relation information, see hookenv.relation_get()'''
+    unit = unit or hookenv.remote_unit()
+    rid = rid or hookenv.relation_id()
+    if unit is None or rid is None:
+        return hookenv.relation_get(attribute=attribute, unit=unit, rid=rid)
+    settings = relation_snapshot().settings(rid, unit, attribute)
+    if attribute is None or settings is None:
+        return settings
+    return settings.get(attribute)
+
+
+def relation_set(relation_id=None, relation_settings=None, **kwargs):
+    '''Set relation information for the local unit, see
+    hookenv.relation_set()'''
+    hookenv.relation_set(relation_id=relation_id,
+                         relation_settings=relation_settings, **kwargs)
+    relation_snapshot().invalidate(
+        rid=relation_id or hookenv.relation_id(),
+        unit=hookenv.local_unit())
+
+
+@contextlib.contextmanager
+def snapshot_relations(module):
+    '''
+    Serve the relation helpers module imported from hookenv from the
+    snapshot while the block runs.
+
+    :param module: a charmhelpers module, e.g. contrib.openstack.context
+    '''
+    helpers = {name: getattr(module, name) for name in RELATION_HELPERS}
+    for name in RELATION_HELPERS:
+        setattr(module, name, globals()[name])
+    try:
+        yield
+    finally:
+        for name, helper in helpers.items():
+            setattr(module, name, helper)
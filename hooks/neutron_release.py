@@ -0,0 +1,98 @@
+# vim: set ts=4:et
+'''
+os_release() for the charm's hooks.
+
+charmhelpers only caches the OpenStack release codename for the life of
+the hook process, so every hook runs apt-cache and dpkg-query again to
+learn it. A codename determined from an installed package is kept in
+unitdata here, with the package's installed version, and later hooks reuse
+it for as long as that version is unchanged.
+'''
+import os
+
+from charmhelpers.contrib.openstack import utils as ch_utils
+
+from neutron_packages import (
+    DPKG_STATUS,
+    installed_version,
+)
+from neutron_unitdata import kv
+
+OS_RELEASE_KEY = 'os-release'
+
+
+def _dpkg_status_mtime():
+    try:
+        return os.stat(DPKG_STATUS).st_mtime
+    except OSError:
+        return None
+
+
+def _persist_os_release(package, release):
+    version = installed_version(package)
+    mtime = _dpkg_status_mtime()
+    if not version or mtime is None:
+        return
+    db = kv()
+    releases = db.get(OS_RELEASE_KEY) or {}
+    releases[package] = {
+        'mtime': mtime,
+        'version': version,
+        'release': release,
+    }
+    db.set(OS_RELEASE_KEY, releases)
+
+
+def _persisted_os_release(package):
+    '''
+    Return the codename persisted for package by a previous hook, or None
+    if the installed version of package changed since.
+
+    The installed version is only looked up if the dpkg status database
+    was modified since the codename was persisted.
+    '''
+    entry = (kv().get(OS_RELEASE_KEY) or {}).get(package)
+    if not entry:
+        return None
+    mtime = _dpkg_status_mtime()
+    if mtime is None:
+        return None
+    if entry['mtime'] != mtime:
+        if installed_version(package) != entry['version']:
+            return None
+        _persist_os_release(package, entry['release'])
+    return entry['release']
+
+
+def os_release(package, base=None, reset_cache=False, source_key=None):
+    '''
+    charmhelpers.contrib.openstack.utils.os_release(), reusing the codename
+    a previous hook determined from the installed package.
+
+    Codenames that come from the installation source or base, or from a
+    snap install, are not persisted.
+    '''
+    if reset_cache:
+        reset_os_release()
+    if ch_utils._os_rel:
+        return ch_utils._os_rel
+    if not ch_utils.snap_install_requested():
+        release = _persisted_os_release(package)
+        if not release:
+            release = ch_utils.get_os_codename_package(package, fatal=False)
+            if release:
+                _persist_os_release(package, release)
+        if release:
+            # NOTE: prime the charmhelpers cache so that os_release() calls
+            #       made by charmhelpers itself return the same codename.
+            ch_utils._os_rel = release
+            return release
+    return ch_utils.os_release(package, base=base, source_key=source_key)
+
+
+def reset_os_release():
+    '''Unset the cached os_release version, including the persisted one.'''
+    ch_utils.reset_os_release()
+    db = kv()
+    if db.get(OS_RELEASE_KEY) is not None:
+        db.unset(OS_RELEASE_KEY)
@@ -0,0 +1,191 @@
+# vim: set ts=4:et
+'''
+restart_on_change for the charm's hooks.
+
+The config files rendered by the charm's OSConfigRenderer are not hashed
+before and after the hook: the renderer knows which of them it rewrote.
+Only the other paths in the restart map are checked on disk, through a
+PathDigestIndex kept in unitdata which only reads files whose stat
+signature changed since they were last hashed.
+'''
+import functools
+import glob
+import itertools
+import os
+
+from collections import OrderedDict
+
+from charmhelpers.core.host import (
+    file_hash,
+    service,
+)
+
+import neutron_commands
+from neutron_profiling import span
+from neutron_unitdata import kv
+
+
+class PathDigestIndex(object):
+    '''
+    Index of file content digests stored in unitdata.
+
+    Each entry records the stat signature (mtime, ctime, size and inode) a
+    digest was computed for, so a file is only read and hashed again when
+    its signature changed since it was last seen, in this hook or a
+    previous one. The index is saved with the rest of the unit's state when
+    unitdata is flushed.
+    '''
+
+    KV_KEY = 'path-digests'
+
+    def __init__(self, hash_type='md5'):
+        self.hash_type = hash_type
+        self._index = None
+        self._dirty = False
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = kv().get(self.KV_KEY) or {}
+        return self._index
+
+    @staticmethod
+    def _signature(st):
+        return [st.st_mtime, st.st_ctime, st.st_size, st.st_ino]
+
+    def digest(self, path):
+        '''Return the digest of the file at path, or None if not found.'''
+        try:
+            st = os.stat(path)
+        except OSError:
+            if self.index.pop(path, None) is not None:
+                self._dirty = True
+            return None
+        signature = self._signature(st)
+        entry = self.index.get(path)
+        if entry and entry[0] == signature:
+            return entry[1]
+        digest = file_hash(path, self.hash_type)
+        self.index[path] = [signature, digest]
+        self._dirty = True
+        return digest
+
+    def path_hash(self, path):
+        '''Equivalent of charmhelpers.core.host.path_hash() served from the
+        index.'''
+        return {
+            filename: self.digest(filename)
+            for filename in glob.iglob(path)
+        }
+
+    def save(self):
+        '''Store the index in unitdata if it changed.'''
+        if not self._dirty:
+            return
+        kv().set(self.KV_KEY, self.index)
+        self._dirty = False
+
+
+_path_digest_index = None
+
+
+def path_digest_index():
+    '''Return the PathDigestIndex shared by the current hook.'''
+    global _path_digest_index
+    if _path_digest_index is None:
+        _path_digest_index = PathDigestIndex()
+    return _path_digest_index
+
+
+def is_unit_paused_set():
+    '''
+    charmhelpers' is_unit_paused_set(), importing the OpenStack utils (and
+    the fetch and network helpers they pull in) on first use.
+    '''
+    from charmhelpers.contrib.openstack.utils import is_unit_paused_set
+    return is_unit_paused_set()
+
+
+def restart_on_change_helper(lambda_f, restart_map, configs, stopstart=False,
+                             restart_functions=None):
+    '''
+    Call lambda_f() and restart the services of the files in restart_map
+    that changed.
+
+    Config files registered with configs count as changed if configs wrote
+    them while lambda_f() ran; any other path is compared against its
+    digest from before the call.
+
+    :param lambda_f: function to call
+    :param restart_map: {file: [service, ...]}
+    :param configs: the charm's OSConfigRenderer
+    :param stopstart: whether to stop and start or restart a service
+    :param restart_functions: nonstandard functions to use to restart
+                              services {svc: func, ...}
+    :returns: result of lambda_f()
+    '''
+    if restart_functions is None:
+        restart_functions = {}
+    index = path_digest_index()
+    checksums = {path: index.path_hash(path) for path in restart_map
+                 if path not in configs.templates}
+    start = len(configs.written)
+    r = lambda_f()
+    written = set(configs.written[start:])
+    # create a list of lists of the services to restart
+    restarts = [restart_map[path]
+                for path in restart_map
+                if (path in written if path not in checksums
+                    else index.path_hash(path) != checksums[path])]
+    index.save()
+    # create a flat list of ordered services without duplicates from lists
+    services_list = list(OrderedDict.fromkeys(itertools.chain(*restarts)))
+    if services_list:
+        actions = ('stop', 'start') if stopstart else ('restart',)
+        for service_name in services_list:
+            if service_name in restart_functions:
+                with span('service', 'restart {}'.format(service_name)):
+                    restart_functions[service_name](service_name)
+            else:
+                for action in actions:
+                    with span('service',
+                              '{} {}'.format(action, service_name)):
+                        service(action, service_name)
+        # NOTE: charmhelpers may run the service commands directly.
+        neutron_commands.invalidate('ovs', 'service')
+    return r
+
+
+def restart_on_change(restart_map, configs, stopstart=False,
+                      restart_functions=None):
+    '''
+    Restart services based on configuration files changing, unless the
+    unit is paused, see
+    charmhelpers.contrib.openstack.utils.pausable_restart_on_change().
+
+    restart_map and configs may be callables, which are only evaluated when
+    the decorated function is first called.
+
+    :param restart_map: {file: [service, ...]}, or a callable returning it
+    :param configs: the charm's OSConfigRenderer, or a callable returning it
+    :param stopstart: whether to stop and start or restart a service
+    :param restart_functions: nonstandard functions to use to restart
+                              services {svc: func, ...}
+    '''
+    def wrap(f):
+        cache = {}
+
+        @functools.wraps(f)
+        def wrapped_f(*args, **kwargs):
+            if is_unit_paused_set():
+                return f(*args, **kwargs)
+            if not cache:
+                cache['restart_map'] = restart_map() \
+                    if callable(restart_map) else restart_map
+                cache['configs'] = configs() \
+                    if callable(configs) else configs
+            return restart_on_change_helper(
+                (lambda: f(*args, **kwargs)), cache['restart_map'],
+                cache['configs'], stopstart, restart_functions)
+        return wrapped_f
+    return wrap
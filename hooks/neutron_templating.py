@@ -0,0 +1,249 @@
+# vim: set ts=4:et
+'''
+OSConfigRenderer used for the charm's config files.
+
+Most context generators are registered against several config files. While
+write_all() or complete_contexts() runs, equivalent generators are only
+evaluated once and share their result, see ContextCache.
+
+Config files are only rewritten, atomically, when their rendered content
+changed. write_all() returns the files that did, and the renderer keeps a
+list of every file it wrote for neutron_restart.restart_on_change().
+'''
+import hashlib
+import os
+import tempfile
+
+from charmhelpers.core.hookenv import (
+    DEBUG,
+    ERROR,
+    INFO,
+)
+from charmhelpers.core.host import file_hash
+from charmhelpers.contrib.openstack import templating
+
+from neutron_log import log
+from neutron_profiling import span
+
+# Attributes a context generator sets on itself while it is evaluated and
+# which are read back when assessing the workload status.
+CONTEXT_STATE_ATTRS = ('complete', 'missing_data', 'related')
+
+
+def context_cache_key(context, shared_contexts):
+    '''
+    Return the key under which the result of context is shared, or None if
+    it must be evaluated every time.
+
+    :param context: context generator
+    :param shared_contexts: constructor arguments that tell instances of a
+                            context generator class apart, by class
+    :type shared_contexts: Dict[type, Tuple[str, ...]]
+    :returns: (class, argument values...) or None
+    :rtype: Optional[tuple]
+    '''
+    attrs = shared_contexts.get(type(context))
+    if attrs is None:
+        return None
+    return (type(context),) + tuple(getattr(context, attr) for attr in attrs)
+
+
+def _evaluate(context):
+    with span('context', type(context).__name__):
+        return context()
+
+
+class ContextCache(object):
+    '''
+    Results of the context generators evaluated during one write_all() or
+    complete_contexts() call.
+
+    Only instances of the classes in shared_contexts are cached. The
+    instance that was evaluated provides the result for all equivalent
+    ones, which also take on its CONTEXT_STATE_ATTRS so that status
+    assessment sees the same outcome whichever instance it looks at.
+    '''
+
+    def __init__(self, shared_contexts):
+        self.shared_contexts = shared_contexts
+        self._results = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, context):
+        key = context_cache_key(context, self.shared_contexts)
+        if key is None:
+            return _evaluate(context)
+        if key not in self._results:
+            self.misses += 1
+            self._results[key] = (context, _evaluate(context))
+            return self._results[key][1]
+        self.hits += 1
+        source, result = self._results[key]
+        if source is not context:
+            for attr in CONTEXT_STATE_ATTRS:
+                if hasattr(source, attr):
+                    setattr(context, attr, getattr(source, attr))
+        return result
+
+
+def _write_atomic(path, data):
+    '''
+    Write data to a temporary file alongside path and rename it into place,
+    preserving the ownership and mode of any existing file.
+    '''
+    try:
+        st = os.stat(path)
+    except OSError:
+        st = None
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path),
+        prefix='.{}.'.format(os.path.basename(path)))
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            out.write(data)
+            out.flush()
+            os.fsync(out.fileno())
+        if st is not None:
+            os.chmod(tmp_path, st.st_mode & 0o7777)
+            if (st.st_uid, st.st_gid) != (os.geteuid(), os.getegid()):
+                os.chown(tmp_path, st.st_uid, st.st_gid)
+        else:
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(tmp_path, 0o666 & ~umask)
+        os.rename(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+class OSConfigTemplate(templating.OSConfigTemplate):
+    '''
+    OSConfigTemplate evaluating its context generators through the
+    renderer's ContextCache while one is active.
+    '''
+
+    cache = None
+
+    def context(self):
+        ctxt = {}
+        for context in self.contexts:
+            if self.cache is not None:
+                _ctxt = self.cache(context)
+            else:
+                _ctxt = _evaluate(context)
+            if _ctxt:
+                ctxt.update(_ctxt)
+                # track interfaces for every complete context.
+                [self._complete_contexts.append(interface)
+                 for interface in context.interfaces
+                 if interface not in self._complete_contexts]
+        return ctxt
+
+
+class OSConfigRenderer(templating.OSConfigRenderer):
+    '''
+    OSConfigRenderer sharing the results of equivalent context generators
+    between config files.
+
+    :param shared_contexts: constructor arguments that tell instances of a
+                            context generator class apart, by class; see
+                            context_cache_key()
+    :type shared_contexts: Dict[type, Tuple[str, ...]]
+    '''
+
+    def __init__(self, templates_dir, openstack_release,
+                 shared_contexts=None):
+        super(OSConfigRenderer, self).__init__(templates_dir,
+                                               openstack_release)
+        self.shared_contexts = shared_contexts or {}
+        self._context_cache = None
+        # config files written, in order, since the renderer was created
+        self.written = []
+
+    def register(self, config_file, contexts, config_template=None):
+        self.templates[config_file] = OSConfigTemplate(
+            config_file=config_file,
+            contexts=contexts,
+            config_template=config_template
+        )
+        log('Registered config file: {}'.format(config_file),
+            level=INFO)
+
+    def _start_context_cache(self):
+        '''
+        Start sharing context generator results, returning False if a
+        cache is already active.
+        '''
+        if self._context_cache is not None:
+            return False
+        self._context_cache = ContextCache(self.shared_contexts)
+        for ostmpl in self.templates.values():
+            ostmpl.cache = self._context_cache
+        return True
+
+    def _stop_context_cache(self):
+        cache = self._context_cache
+        self._context_cache = None
+        for ostmpl in self.templates.values():
+            ostmpl.cache = None
+        log('Context cache: {} hits, {} misses'
+            ''.format(cache.hits, cache.misses), level=DEBUG)
+
+    def render(self, config_file):
+        with span('render', config_file):
+            return super(OSConfigRenderer, self).render(config_file)
+
+    def write(self, config_file):
+        '''
+        Write a single config file, raises if config file is not registered.
+
+        The file is left alone if the rendered content matches what is on
+        disk. Otherwise the file, or the file a symlink points at, is
+        replaced atomically.
+
+        :returns: True if the file was written, False if it was unchanged.
+        '''
+        if config_file not in self.templates:
+            log('Config not registered: %s' % config_file, level=ERROR)
+            raise templating.OSConfigException
+
+        _out = self.render(config_file).encode('UTF-8')
+        if file_hash(config_file) == hashlib.md5(_out).hexdigest():
+            log('Template %s unchanged, not writing.' % config_file,
+                level=DEBUG)
+            return False
+
+        _write_atomic(os.path.realpath(config_file), _out)
+        self.written.append(config_file)
+        log('Wrote template %s.' % config_file, level=INFO)
+        return True
+
+    def write_all(self):
+        '''
+        Write out all registered config files, evaluating each distinct
+        context generator once.
+
+        :returns: set of config files whose content changed.
+        '''
+        started = self._start_context_cache()
+        try:
+            return set(config_file for config_file in self.templates
+                       if self.write(config_file))
+        finally:
+            if started:
+                self._stop_context_cache()
+
+    def complete_contexts(self):
+        '''
+        Returns a list of context interfaces that yield a complete context,
+        evaluating each distinct context generator once.
+        '''
+        started = self._start_context_cache()
+        try:
+            return super(OSConfigRenderer, self).complete_contexts()
+        finally:
+            if started:
+                self._stop_context_cache()
@@ -0,0 +1,154 @@
+# vim: set ts=4:et
+'''
+Write-back unit state storage for the charm's hooks.
+
+charmhelpers.core.unitdata.Storage runs several queries for every set() and
+a LIKE scan for every getrange(). Storage here reads all keys into memory
+on first access and holds writes back until flush(), where they are applied
+with one batch of statements per table in a single transaction.
+
+kv() installs it as the unit's storage, so charmhelpers shares the same
+instance, and flushes it when the hook completes successfully.
+'''
+import json
+import sys
+
+from charmhelpers.core import hookenv
+from charmhelpers.core import unitdata
+
+
+class Storage(unitdata.Storage):
+    '''unitdata.Storage serving reads from memory and batching writes.'''
+
+    def __init__(self, path=None):
+        # key -> serialized value, loaded on first access.
+        self._cache = None
+        # key -> serialized value, or None if deleted, since last write.
+        self._pending = {}
+        # (key, revision) -> serialized value since last write.
+        self._pending_revisions = {}
+        super(Storage, self).__init__(path)
+
+    def _data(self):
+        if self._cache is None:
+            self.cursor.execute('select key, data from kv')
+            self._cache = dict(self.cursor.fetchall())
+        return self._cache
+
+    def _record_revision(self, key, serialized):
+        if self.revision:
+            self._pending_revisions[(key, self.revision)] = serialized
+
+    def _write_pending(self):
+        '''Apply held back writes to the current transaction.'''
+        deleted = [(k,) for k, v in self._pending.items() if v is None]
+        if deleted:
+            self.cursor.executemany('delete from kv where key=?', deleted)
+        updated = [(k, v) for k, v in self._pending.items() if v is not None]
+        if updated:
+            self.cursor.executemany(
+                'insert or replace into kv (key, data) values (?, ?)',
+                updated)
+        if self._pending_revisions:
+            self.cursor.executemany(
+                '''insert or replace into kv_revisions (
+                key, revision, data) values (?, ?, ?)''',
+                [(k, r, v) for (k, r), v in self._pending_revisions.items()])
+        self._pending = {}
+        self._pending_revisions = {}
+
+    def get(self, key, default=None, record=False):
+        result = self._data().get(key)
+        if result is None:
+            return default
+        if record:
+            return unitdata.Record(json.loads(result))
+        return json.loads(result)
+
+    def getrange(self, key_prefix, strip=False):
+        result = {}
+        for key, value in self._data().items():
+            if key.startswith(key_prefix):
+                if strip:
+                    key = key[len(key_prefix):]
+                result[key] = json.loads(value)
+        return result
+
+    def unset(self, key):
+        data = self._data()
+        if key in data:
+            del data[key]
+            self._pending[key] = None
+            self._record_revision(key, json.dumps('DELETED'))
+
+    def unsetrange(self, keys=None, prefix=""):
+        data = self._data()
+        if keys is not None:
+            keys = ['%s%s' % (prefix, key) for key in keys]
+            if any(key in data for key in keys):
+                for key in keys:
+                    if data.pop(key, None) is not None:
+                        self._pending[key] = None
+                    self._record_revision(key, json.dumps('DELETED'))
+        else:
+            keys = [key for key in data if key.startswith(prefix)]
+            for key in keys:
+                del data[key]
+                self._pending[key] = None
+            if keys:
+                self._record_revision('%s%%' % prefix, json.dumps('DELETED'))
+
+    def set(self, key, value):
+        serialized = json.dumps(value)
+        data = self._data()
+        # Skip mutations to the same value
+        if data.get(key) == serialized:
+            return value
+        data[key] = serialized
+        self._pending[key] = serialized
+        self._record_revision(key, serialized)
+        return value
+
+    def flush(self, save=True):
+        if save:
+            self._write_pending()
+        elif not self._closed:
+            self._pending = {}
+            self._pending_revisions = {}
+            self._cache = None
+        super(Storage, self).flush(save)
+
+    def _init(self):
+        if self.db_path != ':memory:':
+            # NOTE: readers (e.g. juju-run while a hook holds a
+            #       transaction) do not block writers in WAL mode.
+            self.cursor.execute('pragma journal_mode=wal')
+        super(Storage, self)._init()
+
+    def gethistory(self, key, deserialize=False):
+        self._write_pending()
+        return super(Storage, self).gethistory(key, deserialize)
+
+    def debug(self, fh=sys.stderr):
+        self._write_pending()
+        super(Storage, self).debug(fh)
+
+
+def kv():
+    '''
+    Return the unit's Storage, installing it as charmhelpers' unitdata
+    storage on first use.
+
+    The storage is flushed when the hook completes successfully, so writes
+    made during a failed hook are discarded as they are by charmhelpers.
+    '''
+    db = unitdata._KV
+    if not isinstance(db, Storage):
+        if db is not None:
+            db.flush()
+            db.close()
+        # NOTE: replace charmhelpers' storage so unitdata.kv() callers in
+        #       charmhelpers read and write through the same cache.
+        db = unitdata._KV = Storage()
+        hookenv.atexit(db.flush)
+    return db
@@ -1,11 +1,14 @@
 import os
 import shutil
 import subprocess
+from collections import OrderedDict
 from shutil import copy2
 from charmhelpers.core.host import (
     lsb_release,
     mkdir,
     service,
+    service_pause,
+    service_resume,
     service_running,
     service_stop,
     service_restart,
@@ -13,32 +16,22 @@ from charmhelpers.core.host import (
     CompareHostReleases,
 )
 from charmhelpers.core.hookenv import (
-    log,
     DEBUG,
     INFO,
     ERROR,
     config,
     is_relation_made,
-    relation_ids,
-    related_units,
-    relation_get,
+    hook_name,
+    status_set,
 )
 from charmhelpers.fetch import (
-    apt_upgrade,
     apt_update,
-    apt_install,
     apt_autoremove,
-    apt_purge,
-    filter_missing_packages,
 )
 from charmhelpers.contrib.network.ovs import (
-    add_bridge,
-    add_bridge_port,
     is_linuxbridge_interface,
     add_ovsbridge_linuxbridge,
     full_restart,
-    enable_ipfix,
-    disable_ipfix,
 )
 from charmhelpers.contrib.hahelpers.cluster import (
     get_hacluster_config,
@@ -46,10 +39,10 @@ from charmhelpers.contrib.hahelpers.cluster import (
 from charmhelpers.contrib.openstack.utils import (
     configure_installation_source,
     get_os_codename_install_source,
+    is_unit_paused_set,
+    is_unit_upgrading_set,
     make_assess_status_func,
-    os_release,
     pause_unit,
-    reset_os_release,
     resume_unit,
     os_application_version_set,
     CompareOpenStackReleases,
@@ -62,23 +55,45 @@ from charmhelpers.contrib.openstack.neutron import (
 import charmhelpers.contrib.openstack.context as context
 from charmhelpers.contrib.openstack.context import (
     SyslogContext,
-    NeutronAPIContext,
-    NetworkServiceContext,
-    ExternalPortContext,
-    PhyNICMTUContext,
-    DataPortContext,
     validate_ovs_use_veth,
     DHCPAgentContext,
 )
-import charmhelpers.contrib.openstack.templating as templating
+import neutron_commands
+import neutron_templating
+from neutron_log import log
+from neutron_packages import (
+    apt_upgrade,
+    apt_install,
+    apt_purge,
+    filter_missing_packages,
+    installed_version,
+)
+from neutron_release import (
+    os_release,
+    reset_os_release as _reset_os_release,
+)
+from neutron_restart import path_digest_index
+from neutron_unitdata import kv
+from neutron_ovs import OVSTransaction
 from charmhelpers.contrib.openstack.neutron import headers_package
+from neutron_relations import (
+    relation_ids,
+    related_units,
+    relation_get,
+)
 from neutron_contexts import (
     CORE_PLUGIN, OVS, NSX, N1KV, OVS_ODL,
+    NeutronAPIContext,
+    NetworkServiceContext,
     NeutronGatewayContext,
     L3AgentContext,
     NovaMetadataContext,
     NovaMetadataJSONContext,
+    ExternalPortContext,
+    PhyNICMTUContext,
+    DataPortContext,
 )
+from neutron_nics import reset_nic_inventory
 from charmhelpers.contrib.openstack.neutron import (
     parse_bridge_mappings,
 )
@@ -358,6 +373,27 @@ VENDORDATA_FILE = '%s/vendor_data.json' % NOVA_CONF_DIR
 
 __NOVA_CONFIG_FILES = None
 __CONFIG_FILES = None
+# Resolved config file maps keyed on the inputs that determine them, see
+# resolve_config_files().
+_RESOLVED_CONFIG_FILES = {}
+
+# Context generators whose result is shared by all equivalent instances
+# registered against different config files, with the constructor arguments
+# that tell their instances apart; see neutron_templating.
+SHARED_CONTEXTS = {
+    context.AMQPContext: ('ssl_dir', 'rel_name', 'relation_prefix',
+                          'relation_id'),
+    context.NotificationDriverContext: ('zmq_relation', 'amqp_relation'),
+    context.WorkerConfigContext: (),
+    context.ZeroMQContext: (),
+    DHCPAgentContext: (),
+    NetworkServiceContext: ('rel_name',),
+    SyslogContext: (),
+    L3AgentContext: (),
+    NeutronGatewayContext: (),
+    NovaMetadataContext: ('rel_name',),
+    NovaMetadataJSONContext: ('os_release_pkg',),
+}
 
 
 def get_nova_config_files():
@@ -365,7 +401,7 @@ def get_nova_config_files():
     if __NOVA_CONFIG_FILES is not None:
         return __NOVA_CONFIG_FILES
 
-    NOVA_CONFIG_FILES = {
+    __NOVA_CONFIG_FILES = {
         NOVA_CONF: {
             'hook_contexts': [NetworkServiceContext(),
                               NeutronGatewayContext(),
@@ -388,7 +424,7 @@ def get_nova_config_files():
         },
     }
 
-    return NOVA_CONFIG_FILES
+    return __NOVA_CONFIG_FILES
 
 
 def get_config_files():
@@ -635,7 +671,7 @@ def install_systemd_override():
         shutil.copy(os.path.join('files',
                                  os.path.basename(SYSTEMD_NOVA_OVERRIDE)),
                     SYSTEMD_NOVA_OVERRIDE)
-        subprocess.check_call(['systemctl', 'daemon-reload'])
+        neutron_commands.check_call(['systemctl', 'daemon-reload'])
 
 
 def remap_service(service_name):
@@ -658,14 +694,24 @@ def resolve_config_files(plugin, release):
     '''
     Resolve configuration files and contexts
 
+    The result is memoized on the plugin, release, host series and the
+    state of the nova metadata service; callers must treat it as read-only.
+
     :param plugin: shortname of plugin e.g. ovs
     :param release: openstack release codename
     :returns: dict of configuration files, contexts
               and associated services
     '''
-    config_files = deepcopy(get_config_files())
-    drop_config = []
     cmp_os_release = CompareOpenStackReleases(release)
+    series = lsb_release()['DISTRIB_CODENAME']
+    nova_metadata_disabled = disable_nova_metadata(cmp_os_release)
+    amqp_nova = (not nova_metadata_disabled and
+                 bool(is_relation_made('amqp-nova')))
+    key = (plugin, release, series, nova_metadata_disabled, amqp_nova)
+    if key in _RESOLVED_CONFIG_FILES:
+        return _RESOLVED_CONFIG_FILES[key]
+
+    drop_config = []
     if plugin == OVS:
         # NOTE: deal with switch to ML2 plugin for >= icehouse
         drop_config = [NEUTRON_OVS_AGENT_CONF]
@@ -674,7 +720,7 @@ def resolve_config_files(plugin, release):
             drop_config = [NEUTRON_ML2_PLUGIN_CONF]
 
     # Use MAAS1.9 for MTU and external port config on xenial and above
-    if CompareHostReleases(lsb_release()['DISTRIB_CODENAME']) >= 'xenial':
+    if CompareHostReleases(series) >= 'xenial':
         drop_config.extend([EXT_PORT_CONF, PHY_NIC_MTU_CONF])
 
     # Rename to lbaasv2 in newton
@@ -690,10 +736,22 @@ def resolve_config_files(plugin, release):
             NEUTRON_LBAAS_AGENT_CONF,
         ])
 
-    if disable_nova_metadata(cmp_os_release):
+    if nova_metadata_disabled:
         drop_config.extend(get_nova_config_files().keys())
-    else:
-        if is_relation_made('amqp-nova'):
+
+    # NOTE: copy the per-file entries rather than deepcopy'ing the whole map
+    #       so that context instances are shared and never duplicated.
+    plugin_files = {}
+    for _config, entry in get_config_files()[plugin].items():
+        if _config in drop_config:
+            continue
+        plugin_files[_config] = {
+            'hook_contexts': list(entry['hook_contexts']),
+            'services': list(entry['services']),
+        }
+
+    if not nova_metadata_disabled:
+        if amqp_nova:
             amqp_nova_ctxt = context.AMQPContext(
                 ssl_dir=NOVA_CONF_DIR,
                 rel_name='amqp-nova',
@@ -702,15 +760,22 @@ def resolve_config_files(plugin, release):
             amqp_nova_ctxt = context.AMQPContext(
                 ssl_dir=NOVA_CONF_DIR,
                 rel_name='amqp')
-        config_files[plugin][NOVA_CONF][
-            'hook_contexts'].append(amqp_nova_ctxt)
+        plugin_files[NOVA_CONF]['hook_contexts'].append(amqp_nova_ctxt)
 
-    for _config in drop_config:
-        if _config in config_files[plugin]:
-            config_files[plugin].pop(_config)
+    config_files = {plugin: plugin_files}
+    _RESOLVED_CONFIG_FILES[key] = config_files
     return config_files
 
 
+def reset_os_release():
+    '''
+    Unset the cached os_release version along with any config file maps
+    resolved for it.
+    '''
+    _reset_os_release()
+    _RESOLVED_CONFIG_FILES.clear()
+
+
 def register_configs(release=None):
     '''
     Register config files with their respective contexts.
@@ -721,8 +786,10 @@ def register_configs(release=None):
     release = release or os_release('neutron-common')
     plugin = config('plugin')
     config_files = resolve_config_files(plugin, release)
-    configs = templating.OSConfigRenderer(templates_dir=TEMPLATES,
-                                          openstack_release=release)
+    configs = neutron_templating.OSConfigRenderer(
+        templates_dir=TEMPLATES,
+        openstack_release=release,
+        shared_contexts=SHARED_CONTEXTS)
     for conf in config_files[plugin]:
         configs.register(conf,
                          config_files[plugin][conf]['hook_contexts'])
@@ -739,6 +806,7 @@ def stop_services():
             svcs.add(remap_service(svc))
     for svc in svcs:
         service_stop(svc)
+    neutron_commands.invalidate('ovs', 'service')
 
 
 def restart_map(release=None):
@@ -802,8 +870,11 @@ def do_openstack_upgrade(configs):
     # NOTE(jamespage):
     # Write-out new openstack release configuration files prior to upgrading
     # to avoid having to restart services immediately after upgrade.
-    configs = register_configs(new_os_rel)
-    configs.write_all()
+    new_configs = register_configs(new_os_rel)
+    new_configs.write_all()
+    # NOTE: restart_on_change only sees files written through the hook's
+    #       renderer, so record the upgrade's writes there too.
+    configs.written.extend(new_configs.written)
 
     dpkg_opts = [
         '--option', 'Dpkg::Options::=--force-confnew',
@@ -832,39 +903,50 @@ def configure_ovs():
     if config('plugin') in [OVS, OVS_ODL]:
         if not service_running('openvswitch-switch'):
             full_restart()
-        add_bridge(INT_BRIDGE)
-        add_bridge(EXT_BRIDGE)
+            neutron_commands.invalidate('ovs', 'service')
+        # NOTE: gather all bridge, port and IPFIX changes so they are diffed
+        #       against OVSDB and applied in a single ovs-vsctl transaction.
+        txn = OVSTransaction()
+        txn.add_bridge(INT_BRIDGE)
+        txn.add_bridge(EXT_BRIDGE)
         ext_port_ctx = ExternalPortContext()()
         if ext_port_ctx and ext_port_ctx['ext_port']:
-            add_bridge_port(EXT_BRIDGE, ext_port_ctx['ext_port'])
+            txn.add_bridge_port(EXT_BRIDGE, ext_port_ctx['ext_port'])
 
         portmaps = DataPortContext()()
         bridgemaps = parse_bridge_mappings(config('bridge-mappings'))
+        linuxbridges = []
         for br in bridgemaps.values():
-            add_bridge(br)
+            txn.add_bridge(br)
             if not portmaps:
                 continue
 
             for port, _br in portmaps.items():
                 if _br == br:
                     if not is_linuxbridge_interface(port):
-                        add_bridge_port(br, port, promisc=True)
+                        txn.add_bridge_port(br, port, promisc=True)
                     else:
-                        add_ovsbridge_linuxbridge(br, port)
+                        linuxbridges.append((br, port))
 
         target = config('ipfix-target')
         bridges = [INT_BRIDGE, EXT_BRIDGE]
         bridges.extend(bridgemaps.values())
 
-        if target:
-            for bridge in bridges:
-                disable_ipfix(bridge)
-                enable_ipfix(bridge, target)
-        else:
-            # NOTE: removing ipfix setting from a bridge is idempotent and
-            #       will pass regardless of the existence of the setting
-            for bridge in bridges:
-                disable_ipfix(bridge)
+        for bridge in bridges:
+            if target:
+                txn.enable_ipfix(bridge, target)
+            else:
+                txn.disable_ipfix(bridge)
+        txn.commit()
+
+        # NOTE: linuxbridge ports need the ovs bridge to exist first.
+        for br, port in linuxbridges:
+            add_ovsbridge_linuxbridge(br, port)
+        if linuxbridges:
+            neutron_commands.invalidate('ovs', 'ip')
+            # NOTE: bridge membership changed so later contexts in this hook
+            #       must not resolve ports from the cached NIC inventory.
+            reset_nic_inventory()
 
         # Ensure this runs so that mtu is applied to data-port interfaces if
         # provided.
@@ -983,18 +1065,18 @@ def cache_env_data():
 def stop_neutron_ha_monitor_daemon():
     try:
         cmd = ['pgrep', '-f', 'neutron-ha-monitor.py']
-        res = subprocess.check_output(cmd).decode('UTF-8')
+        res = neutron_commands.check_output(cmd).decode('UTF-8')
         pid = res.strip()
         if pid:
-            subprocess.call(['sudo', 'kill', '-9', pid])
+            neutron_commands.call(['sudo', 'kill', '-9', pid])
     except subprocess.CalledProcessError as e:
         log('Faild to kill neutron-ha-monitor daemon, %s' % e, level=ERROR)
 
 
 def cleanup_ovs_netns():
     try:
-        subprocess.call('neutron-ovs-cleanup')
-        subprocess.call('neutron-netns-cleanup')
+        neutron_commands.call('neutron-ovs-cleanup')
+        neutron_commands.call('neutron-netns-cleanup')
     except subprocess.CalledProcessError as e:
         log('Faild to cleanup ovs and netns, %s' % e, level=ERROR)
 
@@ -1032,6 +1114,49 @@ def check_optional_relations(configs):
     return validate_ovs_use_veth()
 
 
+COMPLETE_CONTEXTS_KEY = 'complete_contexts'
+APPLICATION_VERSION_KEY = 'application_version'
+
+
+class CompleteContextsCache(object):
+    """Wrap an OSConfigRenderer to share complete_contexts() across hooks.
+
+    Hooks which may change relation data or config record the list of
+    complete contexts in unitdata. The update-status hook reuses the last
+    recorded list rather than evaluating every context again.
+    """
+
+    def __init__(self, configs, use_cached=False):
+        self._configs = configs
+        self._use_cached = use_cached
+
+    def __getattr__(self, attr):
+        return getattr(self._configs, attr)
+
+    def complete_contexts(self):
+        db = kv()
+        if self._use_cached:
+            complete = db.get(COMPLETE_CONTEXTS_KEY)
+            if complete is not None:
+                return complete
+        complete = self._configs.complete_contexts()
+        db.set(COMPLETE_CONTEXTS_KEY, complete)
+        return complete
+
+
+def set_application_version():
+    """Set the application version if the installed version of
+    VERSION_PACKAGE has changed since it was last set.
+    """
+    version = installed_version(VERSION_PACKAGE)
+    db = kv()
+    if version and db.get(APPLICATION_VERSION_KEY) == version:
+        return
+    os_application_version_set(VERSION_PACKAGE)
+    if version:
+        db.set(APPLICATION_VERSION_KEY, version)
+
+
 def assess_status(configs):
     """Assess status of current unit
     Decides what the state of the unit should be based on the current
@@ -1039,11 +1164,15 @@ def assess_status(configs):
     SIDE EFFECT: calls set_os_workload_status(...) which sets the workload
     status of the unit.
     Also calls status_set(...) directly if paused state isn't complete.
+
+    NOTE: update-status can not change relation data or config, so it reuses
+    the complete contexts recorded by the last hook that evaluated them.
     @param configs: a templating.OSConfigRenderer() object
     @returns None - this function is executed for its side-effect
     """
-    assess_status_func(configs)()
-    os_application_version_set(VERSION_PACKAGE)
+    use_cached = hook_name() == 'update-status'
+    assess_status_func(CompleteContextsCache(configs, use_cached))()
+    set_application_version()
 
 
 def assess_status_func(configs):
@@ -1061,16 +1190,168 @@ def assess_status_func(configs):
     NOTE(ajkavanagh) ports are not checked due to race hazards with services
     that don't behave sychronously w.r.t their service scripts.  e.g.
     apache2.
+
+    NOTE: the services are checked with a single query, by
+    check_services_paused() while the unit is paused and by
+    check_services_running() otherwise, rather than by
+    make_assess_status_func(), which checks them one at a time.
     @param configs: a templating.OSConfigRenderer() object
     @return f() -> None : a function that assesses the unit's workload status
     """
     required_interfaces = REQUIRED_INTERFACES.copy()
     required_interfaces.update(get_optional_interfaces())
     active_services = [s for s in services() if s not in STOPPED_SERVICES]
-    return make_assess_status_func(
-        configs, required_interfaces,
-        charm_func=check_optional_relations,
-        services=active_services, ports=None)
+
+    def _assess_status_func():
+        if is_unit_paused_set() or is_unit_upgrading_set():
+            state, message = check_services_paused(active_services)
+            if state is not None:
+                status_set(state, message)
+                return message
+            f = make_assess_status_func(
+                configs, required_interfaces,
+                charm_func=check_optional_relations,
+                services=None, ports=None)
+        else:
+            f = make_assess_status_func(
+                configs, required_interfaces,
+                charm_func=lambda configs: check_services_running(
+                    configs, active_services),
+                services=None, ports=None)
+        return f()
+    return _assess_status_func
+
+
+# systemd ActiveState values for which `systemctl is-active` succeeds
+SYSTEMD_ACTIVE_STATES = ('active', 'reloading')
+
+
+def _systemd_active_states(service_names):
+    """Query the ActiveState of several systemd units in one call.
+
+    `systemctl show` prints one block of properties per unit, separated by a
+    blank line, in the order the units were given.
+
+    @param service_names: names of the services
+    @returns {service: ActiveState}
+    @raises ValueError if the output does not match the services
+    """
+    cmd = ['systemctl', 'show', '--property=ActiveState']
+    cmd.extend(service_names)
+    output = neutron_commands.check_output(cmd).decode('UTF-8')
+    blocks = output.strip().split('\n\n')
+    if len(blocks) != len(service_names):
+        raise ValueError('Unexpected systemctl show output: {}'
+                         .format(output))
+    states = {}
+    for name, block in zip(service_names, blocks):
+        props = dict(line.split('=', 1)
+                     for line in block.splitlines() if '=' in line)
+        states[name] = props.get('ActiveState', 'unknown')
+    return states
+
+
+def services_running(service_names):
+    """Determine which of several system services are running.
+
+    On systemd hosts the state of all services is fetched with a single
+    `systemctl show` call, otherwise service_running() is called for each
+    service.
+
+    @param service_names: names of the services
+    @returns {service: True if running}
+    """
+    service_names = list(service_names)
+    if service_names and init_is_systemd():
+        try:
+            states = _systemd_active_states(service_names)
+        except (subprocess.CalledProcessError, ValueError) as e:
+            log('Unable to query service states in bulk: {}'.format(e),
+                level=DEBUG)
+        else:
+            return {name: states[name] in SYSTEMD_ACTIVE_STATES
+                    for name in service_names}
+    return {name: service_running(name) for name in service_names}
+
+
+def check_services_running(configs, active_services):
+    """Check the optional relations and then that active_services are
+    running.
+
+    This is the charm_func of assess_status_func() while the unit is not
+    paused and returns the same status make_assess_status_func() would for
+    services that are not running.
+
+    @param configs: an OSConfigRender() instance.
+    @param active_services: services that should be running
+    @return 2-tuple: (string, string) = (status, message)
+    """
+    state, message = check_optional_relations(configs)
+    if state not in (None, 'unknown', 'active'):
+        return state, message
+    running = services_running(active_services)
+    stopped = [s for s in active_services if not running[s]]
+    if stopped:
+        return ('blocked',
+                'Services not running that should be: {}'
+                .format(', '.join(stopped)))
+    return state, message
+
+
+def check_services_paused(active_services):
+    """Check that none of active_services is running while the unit is
+    paused.
+
+    Returns the same status check_actually_paused() would for services that
+    are still running.
+
+    @param active_services: services that should have been stopped
+    @return 2-tuple: (string, string) = (status, message), (None, None) if
+            all services are stopped
+    """
+    running = services_running(active_services)
+    still_running = [s for s in active_services if running[s]]
+    if still_running:
+        return ('blocked',
+                'Services should be paused but these services running: {}'
+                .format(', '.join(still_running)))
+    return None, None
+
+
+def pause_resume_services(action, service_names):
+    """Pause or resume several system services.
+
+    Does what service_pause() or service_resume() do for each service, but
+    on systemd hosts the state of all services is queried once, and they are
+    disabled and masked (or unmasked and enabled) with one systemctl call.
+
+    @param action: 'pause' or 'resume'
+    @param service_names: names of the services
+    @returns message naming the services that did not pause or resume
+             cleanly, None if all did
+    """
+    service_names = list(service_names)
+    if not service_names:
+        return None
+    if not init_is_systemd():
+        manage = service_pause if action == 'pause' else service_resume
+        failed = [s for s in service_names if not manage(s)]
+    elif action == 'pause':
+        running = services_running(service_names)
+        failed = [s for s in service_names if running[s]
+                  if neutron_commands.call(['systemctl', 'stop', s])]
+        neutron_commands.call(['systemctl', 'disable'] + service_names)
+        neutron_commands.call(['systemctl', 'mask'] + service_names)
+    else:
+        neutron_commands.call(['systemctl', 'unmask'] + service_names)
+        neutron_commands.call(['systemctl', 'enable'] + service_names)
+        running = services_running(service_names)
+        failed = [s for s in service_names if not running[s]
+                  if neutron_commands.call(['systemctl', 'start', s])]
+    if failed:
+        return '; '.join("{} didn't {} cleanly.".format(s, action)
+                         for s in failed)
+    return None
 
 
 def pause_unit_helper(configs):
@@ -1080,7 +1361,7 @@ def pause_unit_helper(configs):
     @param configs: a templating.OSConfigRenderer() object
     @returns None - this function is executed for its side-effect
     """
-    _pause_resume_helper(pause_unit, configs)
+    _pause_resume_helper(pause_unit, 'pause', configs)
 
 
 def resume_unit_helper(configs):
@@ -1090,22 +1371,31 @@ def resume_unit_helper(configs):
     @param configs: a templating.OSConfigRenderer() object
     @returns None - this function is executed for its side-effect
     """
-    _pause_resume_helper(resume_unit, configs)
+    _pause_resume_helper(resume_unit, 'resume', configs)
 
 
-def _pause_resume_helper(f, configs):
+def _pause_resume_helper(f, action, configs):
     """Helper function that uses the make_assess_status_func(...) from
     charmhelpers.contrib.openstack.utils to create an assess_status(...)
     function that can be used with the pause/resume of the unit
+
+    NOTE: the services are paused or resumed by pause_resume_services(),
+    passed as charm_func, rather than by f, which queries each service.
     @param f: the function to be used with the assess_status(...) function
+    @param action: 'pause' or 'resume'
     @returns None - this function is executed for its side-effect
     """
     active_services = [s for s in services() if s not in STOPPED_SERVICES]
     # TODO(ajkavanagh) - ports= has been left off because of the race hazard
     # that exists due to service_start()
     f(assess_status_func(configs),
-      services=active_services,
-      ports=None)
+      services=None,
+      ports=None,
+      charm_func=lambda: pause_resume_services(action, active_services))
+
+
+APPARMOR_PROFILE_DIR = '/etc/apparmor.d'
+APPARMOR_PROFILES_KEY = 'apparmor_profiles'
 
 
 def configure_apparmor():
@@ -1117,8 +1407,46 @@ def configure_apparmor():
         profiles.append(NEUTRON_LBAASV2_AA_PROFILE)
     if cmp_os_source >= 'train':
         profiles.remove(NEUTRON_LBAASV2_AA_PROFILE)
+
+    # NOTE: only profiles whose content or mode changed since they were last
+    #       applied are set up, all of them with a single aa-<mode> call.
+    db = kv()
+    applied = db.get(APPARMOR_PROFILES_KEY) or {}
+    index = path_digest_index()
+    pending = OrderedDict()
     for profile in profiles:
-        context.AppArmorContext(profile).setup_aa_profile()
+        aa_context = context.AppArmorContext(profile)
+        if not aa_context():
+            aa_context.setup_aa_profile()
+            continue
+        digest = index.digest(os.path.join(APPARMOR_PROFILE_DIR, profile))
+        if applied.get(profile) == [digest,
+                                    aa_context.ctxt['aa_profile_mode']]:
+            continue
+        pending[profile] = aa_context
+    if not pending:
+        return
+
+    names = list(pending)
+    mode = pending[names[0]].ctxt['aa_profile_mode']
+    pending[names[0]].install_aa_utils()
+    log("Setting up the apparmor profiles for {} in {} mode."
+        "".format(', '.join(names), mode))
+    cmd = ['aa-{}'.format(mode)]
+    cmd.extend(names)
+    try:
+        neutron_commands.check_call(cmd)
+    except subprocess.CalledProcessError:
+        # set up each profile on its own, which knows how to recover
+        for aa_context in pending.values():
+            aa_context.setup_aa_profile()
+    for profile in names:
+        # the aa tools may have rewritten the profile flags
+        applied[profile] = [
+            index.digest(os.path.join(APPARMOR_PROFILE_DIR, profile)),
+            mode]
+    db.set(APPARMOR_PROFILES_KEY, applied)
+    index.save()
 
 
 def deprecated_services():
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+#
+# Copyright 2021 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measure the cold-start time of each hook entry point.
+
+For every hook symlink under hooks/ a fresh interpreter is started, as Juju
+does, which imports the module the hook points at without executing the
+hook itself. The wall time of the whole process, the time spent importing
+and the number of modules loaded are reported per hook name, along with
+whether any of the modules that should only load on first use did so.
+
+    tox -e venv -- python tools/coldstart.py --runs 10 --json coldstart.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+CHARM_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HOOKS_DIR = os.path.join(CHARM_DIR, 'hooks')
+
+# Modules that must only be imported by the hooks that use them.
+LAZY_MODULES = (
+    'charmhelpers.contrib.charmsupport.nrpe',
+    'charmhelpers.contrib.hardening.harden',
+    'charmhelpers.contrib.hardening.host.checks',
+    'charmhelpers.contrib.network.ip',
+    'charmhelpers.contrib.network.ovs',
+    'charmhelpers.contrib.openstack.context',
+    'charmhelpers.contrib.openstack.templating',
+    'charmhelpers.contrib.openstack.utils',
+    'charmhelpers.fetch',
+    'jinja2',
+    'neutron_contexts',
+    'neutron_utils',
+)
+
+PROBE = """
+import json, sys, time
+sys.argv = [{hook!r}]
+sys.path.insert(0, {hooks_dir!r})
+start = time.time()
+import {module}
+elapsed = time.time() - start
+print(json.dumps({{
+    'import': elapsed,
+    'modules': len(sys.modules),
+    'lazy_loaded': [m for m in {lazy!r} if m in sys.modules],
+}}))
+"""
+
+
+def hook_names():
+    """Return {hook name: module} for the hook symlinks in HOOKS_DIR."""
+    hooks = {}
+    for name in sorted(os.listdir(HOOKS_DIR)):
+        path = os.path.join(HOOKS_DIR, name)
+        if os.path.islink(path):
+            target = os.path.basename(os.readlink(path))
+            hooks[name] = os.path.splitext(target)[0]
+    return hooks
+
+
+def measure(hook, module, runs):
+    """Start runs cold interpreters for hook and return the timings."""
+    probe = PROBE.format(hook=os.path.join(HOOKS_DIR, hook),
+                         hooks_dir=HOOKS_DIR, module=module,
+                         lazy=LAZY_MODULES)
+    wall, imports, result = [], [], None
+    env = dict(os.environ, CHARM_DIR=CHARM_DIR, JUJU_HOOK_NAME=hook)
+    for _ in range(runs):
+        start = time.time()
+        output = subprocess.check_output([sys.executable, '-c', probe],
+                                         env=env, cwd=CHARM_DIR)
+        wall.append(time.time() - start)
+        result = json.loads(output.decode('UTF-8').splitlines()[-1])
+        imports.append(result['import'])
+    return {
+        'module': module,
+        'runs': runs,
+        'wall_median': statistics.median(wall),
+        'wall_min': min(wall),
+        'import_median': statistics.median(imports),
+        'modules': result['modules'],
+        'lazy_loaded': result['lazy_loaded'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5,
+                        help='interpreters started per hook')
+    parser.add_argument('--json', metavar='FILE',
+                        help='also write the results to FILE')
+    parser.add_argument('hooks', nargs='*',
+                        help='hook names to measure (default: all)')
+    args = parser.parse_args()
+
+    hooks = hook_names()
+    names = args.hooks or list(hooks)
+    results = {}
+    print('{:45} {:>9} {:>9} {:>10} {:>8}'.format(
+        'hook', 'wall ms', 'min ms', 'import ms', 'modules'))
+    for name in names:
+        res = results[name] = measure(name, hooks[name], args.runs)
+        print('{:45} {:9.1f} {:9.1f} {:10.1f} {:8d}{}'.format(
+            name, res['wall_median'] * 1000, res['wall_min'] * 1000,
+            res['import_median'] * 1000, res['modules'],
+            '  lazy: ' + ', '.join(res['lazy_loaded'])
+            if res['lazy_loaded'] else ''))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'python': sys.version.split()[0],
+                       'hooks': results}, f, indent=2, sort_keys=True)
+    return 1 if any(r['lazy_loaded'] for r in results.values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
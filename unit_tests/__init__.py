@@ -6,6 +6,7 @@ _path = os.path.dirname(os.path.realpath(__file__))
 _hooks = os.path.abspath(os.path.join(_path, '../hooks'))
 _actions = os.path.abspath(os.path.join(_path, '../actions'))
 _unit_tests = os.path.abspath(os.path.join(_path, '../unit_tests'))
+_tools = os.path.abspath(os.path.join(_path, '../tools'))
 
 
 def _add_path(path):
@@ -16,3 +17,4 @@ def _add_path(path):
 _add_path(_hooks)
 _add_path(_actions)
 _add_path(_unit_tests)
+_add_path(_tools)
@@ -0,0 +1,244 @@
+import importlib
+import subprocess
+import sys
+
+from mock import call, patch
+
+from charmhelpers.contrib.network import ovs
+from charmhelpers.core import hookenv, host
+
+import neutron_commands
+import neutron_profiling
+
+from test_utils import CharmTestCase
+
+TO_PATCH = []
+
+LIST_BRIDGE = ['ovs-vsctl', '-f', 'json', '--', 'list', 'Bridge']
+
+
+class TestCommandRunner(CharmTestCase):
+
+    def setUp(self):
+        super(TestCommandRunner, self).setUp(neutron_commands, TO_PATCH)
+        for name in ('check_output', 'check_call', 'call'):
+            self.patch_object(neutron_profiling, name)
+        self.check_output.side_effect = lambda cmd, **kw: ' '.join(cmd)
+        self.patch_object(neutron_commands, '_runner', new=None)
+        self.runner = neutron_commands.runner()
+
+    def test_runner(self):
+        self.assertIsInstance(self.runner, neutron_commands.CommandRunner)
+        self.assertIs(neutron_commands.runner(), self.runner)
+
+    def test_read_only_memoized(self):
+        self.assertEqual(neutron_commands.check_output(LIST_BRIDGE),
+                         'ovs-vsctl -f json -- list Bridge')
+        self.assertEqual(neutron_commands.check_output(LIST_BRIDGE),
+                         'ovs-vsctl -f json -- list Bridge')
+        self.check_output.assert_called_once_with(LIST_BRIDGE)
+        # a different question forks again
+        neutron_commands.check_output(LIST_BRIDGE + ['br-ex'])
+        self.assertEqual(self.check_output.call_count, 2)
+        stats = self.runner.stats['ovs-vsctl -f json -- list']
+        self.assertEqual((stats.calls, stats.forks, stats.hits), (3, 2, 1))
+
+    def test_read_only_failure_not_memoized(self):
+        self.check_output.side_effect = subprocess.CalledProcessError(
+            1, LIST_BRIDGE)
+        for _ in range(2):
+            self.assertRaises(subprocess.CalledProcessError,
+                              neutron_commands.check_output, LIST_BRIDGE)
+        self.assertEqual(self.check_output.call_count, 2)
+
+    def test_uncacheable_kwargs(self):
+        for kwargs in ({'env': {}}, {'cwd': '/'}, {'input': b''},
+                       {'stdin': None}, {'shell': False}):
+            neutron_commands.check_output(LIST_BRIDGE, **kwargs)
+            neutron_commands.check_output(LIST_BRIDGE, **kwargs)
+        self.assertEqual(self.check_output.call_count, 10)
+
+    def test_string_command_not_memoized(self):
+        neutron_commands.check_output(' '.join(LIST_BRIDGE))
+        neutron_commands.check_output(' '.join(LIST_BRIDGE))
+        self.assertEqual(self.check_output.call_count, 2)
+
+    def test_mutating_invalidates(self):
+        for cmd in (['ovs-vsctl', 'add-br', 'br-ex'],
+                    ['systemctl', 'restart', 'openvswitch-switch'],
+                    ['service', 'openvswitch-switch', 'restart'],
+                    ['apt-get', 'install', 'openvswitch-switch'],
+                    ['dpkg', '--configure', '-a'],
+                    ['sudo', 'ovs-vsctl', 'del-br', 'br-ex']):
+            neutron_commands.check_output(LIST_BRIDGE)
+            neutron_commands.check_call(cmd)
+            neutron_commands.check_output(LIST_BRIDGE)
+        # only the first read and each read after a mutation fork
+        self.assertEqual(self.check_output.call_count, 7)
+        self.assertIn('ovs-vsctl', self.runner.stats)
+        self.assertNotIn('sudo', self.runner.stats)
+
+    def test_registered_read_only(self):
+        for cmd in (['ovs-vsctl', 'list-br'],
+                    ['ovs-vsctl', '--', 'list-ports', 'br-ex'],
+                    ['ip', 'a'],
+                    ['ip', 'addr', 'show', 'label', 'bond*'],
+                    ['systemctl', 'show', '--property=ActiveState', 'ovs'],
+                    ['systemctl', 'is-active', 'neutron-l3-agent'],
+                    ['lsb_release', '-cs'],
+                    ['config-get', '--all', '--format=json'],
+                    ['is-leader', '--format=json']):
+            neutron_commands.check_output(cmd)
+            neutron_commands.check_output(cmd)
+            neutron_commands.call(cmd)
+            neutron_commands.call(cmd)
+        self.assertEqual(self.check_output.call_count, 9)
+        self.assertEqual(self.call.call_count, 9)
+
+    def test_service_state_invalidated(self):
+        show = ['systemctl', 'show', '--property=ActiveState', 'ovs']
+        neutron_commands.check_output(show)
+        neutron_commands.check_output(LIST_BRIDGE)
+        # reading service state leaves other results alone
+        neutron_commands.check_output(show)
+        neutron_commands.check_output(LIST_BRIDGE)
+        self.assertEqual(self.check_output.call_count, 2)
+        for cmd in (['systemctl', 'restart', 'openvswitch-switch'],
+                    ['service', 'neutron-l3-agent', 'stop'],
+                    ['apt-get', 'install', 'neutron-l3-agent'],
+                    ['kill', '-9', '42']):
+            neutron_commands.call(cmd)
+            neutron_commands.check_output(show)
+        self.assertEqual(self.check_output.call_count, 6)
+
+    def test_hook_tools_keep_results(self):
+        neutron_commands.check_output(LIST_BRIDGE)
+        for cmd in (['juju-log', '-l', 'DEBUG', 'message'],
+                    ['status-set', 'active', 'Unit is ready'],
+                    ['relation-set', '-r', 'amqp:1', 'username=neutron'],
+                    ['leader-get', '--format=json']):
+            neutron_commands.call(cmd)
+        neutron_commands.check_output(LIST_BRIDGE)
+        self.check_output.assert_called_once_with(LIST_BRIDGE)
+
+    def test_non_ovs_commands_keep_results(self):
+        neutron_commands.check_output(LIST_BRIDGE)
+        neutron_commands.check_output(['ip', '-force', '-batch', '-'],
+                                      input=b'link set dev eth0 up\n')
+        neutron_commands.check_output(['pgrep', '-f', 'neutron-ha-monitor'])
+        neutron_commands.call(['sudo', 'kill', '-9', '42'])
+        neutron_commands.check_output(LIST_BRIDGE)
+        self.assertEqual(self.check_output.call_args_list.count(
+            call(LIST_BRIDGE)), 1)
+
+    def test_unknown_tool_invalidates_all(self):
+        runner = neutron_commands.CommandRunner(
+            read_only=[(('ovs-vsctl', 'list'), 'ovs'),
+                       (('ip', 'link', 'show'), 'ip')],
+            mutating={})
+        runner.check_output(['ovs-vsctl', 'list', 'Bridge'])
+        runner.check_output(['ip', 'link', 'show'])
+        runner.call('neutron-ovs-cleanup')
+        runner.check_output(['ovs-vsctl', 'list', 'Bridge'])
+        runner.check_output(['ip', 'link', 'show'])
+        self.assertEqual(self.check_output.call_count, 4)
+        self.assertEqual(runner.stats['neutron-ovs-cleanup'].forks, 1)
+
+    def test_invalidate(self):
+        runner = neutron_commands.CommandRunner(
+            read_only=[(('ovs-vsctl', 'list'), 'ovs'),
+                       (('ip', 'link', 'show'), 'ip')])
+        runner.check_output(['ovs-vsctl', 'list', 'Bridge'])
+        runner.check_output(['ip', 'link', 'show'])
+        runner.invalidate('ip')
+        runner.check_output(['ovs-vsctl', 'list', 'Bridge'])
+        runner.check_output(['ip', 'link', 'show'])
+        self.assertEqual(self.check_output.call_count, 3)
+        runner.invalidate()
+        runner.check_output(['ovs-vsctl', 'list', 'Bridge'])
+        self.assertEqual(self.check_output.call_count, 4)
+
+    def test_invalidate_module(self):
+        neutron_commands.check_output(LIST_BRIDGE)
+        neutron_commands.invalidate('ovs')
+        neutron_commands.check_output(LIST_BRIDGE)
+        self.assertEqual(self.check_output.call_count, 2)
+
+    def test_exec_helpers(self):
+        self.check_call.return_value = 0
+        self.call.return_value = 1
+        self.assertEqual(
+            neutron_commands.check_call(['systemctl', 'daemon-reload']), 0)
+        self.check_call.assert_called_once_with(
+            ['systemctl', 'daemon-reload'])
+        self.assertEqual(
+            neutron_commands.call('neutron-netns-cleanup', stderr=None), 1)
+        self.call.assert_called_once_with('neutron-netns-cleanup',
+                                          stderr=None)
+
+    def test_summary(self):
+        neutron_commands.check_output(LIST_BRIDGE)
+        neutron_commands.check_output(LIST_BRIDGE)
+        neutron_commands.check_call(['ovs-vsctl', 'add-br', 'br-ex'])
+        self.assertTrue(self.runner.summary().startswith(
+            'Ran 3 commands (2 forks, 1 memoized) in '))
+
+
+class TestRouteCharmhelpers(CharmTestCase):
+
+    def setUp(self):
+        super(TestRouteCharmhelpers, self).setUp(neutron_commands, TO_PATCH)
+        for name in ('check_output', 'check_call', 'call'):
+            self.patch_object(neutron_profiling, name)
+        self.patch_object(neutron_commands, '_runner', new=None)
+        routed = neutron_commands.route_charmhelpers()
+        for module in routed:
+            self.addCleanup(setattr, module, 'subprocess', subprocess)
+        self.addCleanup(self.remove_finders)
+        self.routed = routed
+
+    def remove_finders(self):
+        sys.meta_path[:] = [
+            f for f in sys.meta_path
+            if not isinstance(f, neutron_commands._RoutingFinder)]
+
+    def test_routed(self):
+        for module in (hookenv, host, ovs):
+            self.assertIn(module, self.routed)
+            self.assertIsInstance(module.subprocess,
+                                  neutron_commands.SubprocessProxy)
+        self.assertIs(hookenv.subprocess.CalledProcessError,
+                      subprocess.CalledProcessError)
+        self.assertIs(hookenv.subprocess.Popen, subprocess.Popen)
+        self.assertFalse(any(m.__name__.startswith('neutron_')
+                             for m in self.routed))
+
+    def test_charmhelpers_commands_memoized(self):
+        self.check_output.return_value = b'br-ex\nbr-int\n'
+        self.assertEqual(ovs.get_bridges(), ['br-ex', 'br-int'])
+        self.assertEqual(ovs.get_bridges(), ['br-ex', 'br-int'])
+        self.check_output.assert_called_once_with(['ovs-vsctl', 'list-br'])
+        ovs.add_bridge('br-data')
+        self.assertEqual(ovs.get_bridges(), ['br-ex', 'br-int'])
+        self.assertEqual(self.check_output.call_count, 2)
+
+    def test_positional_arguments_not_routed(self):
+        proxy = neutron_commands.SubprocessProxy()
+        with patch.object(subprocess, 'call') as _call:
+            proxy.call(['true'], -1)
+            _call.assert_called_once_with(['true'], -1)
+        self.assertFalse(self.call.called)
+
+    def test_routed_on_import(self):
+        name = 'charmhelpers.contrib.openstack.alternatives'
+        with patch.dict(sys.modules):
+            sys.modules.pop(name, None)
+            module = importlib.import_module(name)
+            self.assertIsInstance(module.subprocess,
+                                  neutron_commands.SubprocessProxy)
+            self.assertIsInstance(module.__loader__,
+                                  neutron_commands._RoutingLoader)
+        neutron_commands.route_charmhelpers()
+        self.assertEqual(len([
+            f for f in sys.meta_path
+            if isinstance(f, neutron_commands._RoutingFinder)]), 1)
@@ -1,4 +1,8 @@
 import io
+import os
+import shutil
+import subprocess
+import tempfile
 
 from contextlib import contextmanager
 
@@ -6,8 +10,16 @@ from mock import (
     MagicMock,
     patch
 )
+from charmhelpers.contrib.hahelpers import cluster
+from charmhelpers.contrib.openstack import context as ch_context
+
+import neutron_commands
 import neutron_contexts
+import neutron_nics
+import neutron_profiling
+import neutron_relations
 
+from test_neutron_nics import FakeSysClassNet
 from test_utils import (
     CharmTestCase
 )
@@ -80,6 +92,34 @@ class TestL3AgentContext(CharmTestCase):
                           'l3_extension_plugins': 'fwaas_v2',
                           })
 
+    @patch('neutron_contexts.NeutronAPIContext')
+    def test_leader_asked_once(self, _NeutronAPIContext):
+        # The context is evaluated for every config file rendered with it
+        # and each time asks juju whether this unit is the leader.
+        self.os_release.return_value = 'stein'
+        _NeutronAPIContext.return_value = \
+            DummyNeutronAPIContext(return_value={'enable_dvr': False,
+                                                 'report_interval': 30,
+                                                 'rpc_response_timeout': 60,
+                                                 'enable_l3ha': True,
+                                                 })
+        self.test_config.set('run-internal-router', 'leader')
+        self.patch_object(neutron_contexts, 'eligible_leader',
+                          new=cluster.eligible_leader)
+        self.patch_object(neutron_commands, '_runner', new=None)
+        self.patch_object(neutron_profiling, 'call')
+        self.patch_object(neutron_profiling, 'check_output')
+        self.check_output.return_value = b'true'
+        for module in neutron_commands.route_charmhelpers():
+            self.addCleanup(setattr, module, 'subprocess', subprocess)
+        for _ in range(3):
+            ctxt = neutron_contexts.L3AgentContext()()
+            self.assertTrue(ctxt['handle_internal_only_router'])
+        self.check_output.assert_called_once_with(
+            ['is-leader', '--format=json'])
+        stats = neutron_commands.runner().stats['is-leader']
+        self.assertEqual((stats.calls, stats.forks), (3, 1))
+
     @patch('neutron_contexts.NeutronAPIContext')
     def test_old_ext_network(self, _NeutronAPIContext):
         self.os_release.return_value = 'rocky'
@@ -167,13 +207,14 @@ class TestNeutronGatewayContext(CharmTestCase):
     def setUp(self):
         super(TestNeutronGatewayContext, self).setUp(neutron_contexts,
                                                      TO_PATCH)
+        self.patch_object(neutron_relations, '_snapshot', new=None)
         self.config.side_effect = self.test_config.get
         self.maxDiff = None
 
     @patch.object(neutron_contexts, 'validate_nfg_log_path', lambda x: x)
-    @patch('charmhelpers.contrib.openstack.context.relation_get')
-    @patch('charmhelpers.contrib.openstack.context.related_units')
-    @patch('charmhelpers.contrib.openstack.context.relation_ids')
+    @patch('charmhelpers.core.hookenv.relation_get')
+    @patch('charmhelpers.core.hookenv.related_units')
+    @patch('charmhelpers.core.hookenv.relation_ids')
     @patch.object(neutron_contexts, 'get_shared_secret')
     def test_all(self, _secret, _rids, _runits, _rget):
         rdata = {'l2-population': 'True',
@@ -240,9 +281,9 @@ class TestNeutronGatewayContext(CharmTestCase):
         })
 
     @patch.object(neutron_contexts, 'validate_nfg_log_path', lambda x: x)
-    @patch('charmhelpers.contrib.openstack.context.relation_get')
-    @patch('charmhelpers.contrib.openstack.context.related_units')
-    @patch('charmhelpers.contrib.openstack.context.relation_ids')
+    @patch('charmhelpers.core.hookenv.relation_get')
+    @patch('charmhelpers.core.hookenv.related_units')
+    @patch('charmhelpers.core.hookenv.relation_ids')
     @patch.object(neutron_contexts, 'get_shared_secret')
     def test_all_network_spaces(self, _secret, _rids, _runits, _rget):
         rdata = {'l2-population': 'True',
@@ -302,9 +343,9 @@ class TestNeutronGatewayContext(CharmTestCase):
         })
 
     @patch('os.environ.get')
-    @patch('charmhelpers.contrib.openstack.context.relation_get')
-    @patch('charmhelpers.contrib.openstack.context.related_units')
-    @patch('charmhelpers.contrib.openstack.context.relation_ids')
+    @patch('charmhelpers.core.hookenv.relation_get')
+    @patch('charmhelpers.core.hookenv.related_units')
+    @patch('charmhelpers.core.hookenv.relation_ids')
     @patch.object(neutron_contexts, 'get_shared_secret')
     def test_availability_zone_no_juju_with_env(self, _secret, _rids,
                                                 _runits, _rget,
@@ -327,9 +368,9 @@ class TestNeutronGatewayContext(CharmTestCase):
 
     @patch('neutron_utils.config')
     @patch('os.environ.get')
-    @patch('charmhelpers.contrib.openstack.context.relation_get')
-    @patch('charmhelpers.contrib.openstack.context.related_units')
-    @patch('charmhelpers.contrib.openstack.context.relation_ids')
+    @patch('charmhelpers.core.hookenv.relation_get')
+    @patch('charmhelpers.core.hookenv.related_units')
+    @patch('charmhelpers.core.hookenv.relation_ids')
     @patch.object(neutron_contexts, 'get_shared_secret')
     def test_availability_zone_no_juju_no_env(self, _secret, _rids,
                                               _runits, _rget,
@@ -357,9 +398,9 @@ class TestNeutronGatewayContext(CharmTestCase):
 
     @patch('neutron_utils.config')
     @patch('os.environ.get')
-    @patch('charmhelpers.contrib.openstack.context.relation_get')
-    @patch('charmhelpers.contrib.openstack.context.related_units')
-    @patch('charmhelpers.contrib.openstack.context.relation_ids')
+    @patch('charmhelpers.core.hookenv.relation_get')
+    @patch('charmhelpers.core.hookenv.related_units')
+    @patch('charmhelpers.core.hookenv.relation_ids')
     @patch.object(neutron_contexts, 'get_shared_secret')
     def test_availability_zone_juju(self, _secret, _rids,
                                     _runits, _rget,
@@ -379,9 +420,9 @@ class TestNeutronGatewayContext(CharmTestCase):
         self.assertEqual(
             'az1', context()['availability_zone'])
 
-    @patch('charmhelpers.contrib.openstack.context.relation_get')
-    @patch('charmhelpers.contrib.openstack.context.related_units')
-    @patch('charmhelpers.contrib.openstack.context.relation_ids')
+    @patch('charmhelpers.core.hookenv.relation_get')
+    @patch('charmhelpers.core.hookenv.related_units')
+    @patch('charmhelpers.core.hookenv.relation_ids')
     @patch.object(neutron_contexts, 'get_shared_secret')
     def test_nfg_min_settings(self, _secret, _rids, _runits, _rget):
         self.os_release.return_value = 'icehouse'
@@ -438,6 +479,40 @@ class TestMisc(CharmTestCase):
                          neutron_contexts.NEUTRON_ML2_PLUGIN)
 
 
+class TestRelationContexts(CharmTestCase):
+
+    def setUp(self):
+        super(TestRelationContexts, self).setUp(neutron_contexts, TO_PATCH)
+        self.patch_object(neutron_relations, '_snapshot', new=None)
+        self.patch_object(neutron_relations, 'hookenv')
+        self.rdata = {
+            'keystone_host': '10.0.0.10', 'service_port': '5000',
+            'auth_port': '35357', 'service_tenant': 'services',
+            'service_username': 'neutron', 'service_password': 'secret',
+            'quantum_host': '10.0.0.11', 'quantum_port': '9696',
+            'quantum_url': 'http://10.0.0.11:9696', 'region': 'RegionOne',
+            'l2-population': 'True', 'enable-dvr': 'True',
+        }
+        self.hookenv.relation_ids.side_effect = \
+            lambda reltype: ['{}:1'.format(reltype)]
+        self.hookenv.related_units.side_effect = lambda rid: ['unit/0']
+        self.hookenv.relation_get.side_effect = \
+            lambda rid, unit: dict(self.rdata)
+
+    def test_contexts_share_snapshot(self):
+        helpers = (ch_context.relation_ids, ch_context.related_units,
+                   ch_context.relation_get)
+        for _ in range(2):
+            ctxt = neutron_contexts.NetworkServiceContext()()
+            self.assertEqual(ctxt['quantum_url'], 'http://10.0.0.11:9696')
+            self.assertTrue(neutron_contexts.NeutronAPIContext()()[
+                'enable_dvr'])
+        self.assertEqual(self.hookenv.relation_get.call_count, 2)
+        self.assertEqual(neutron_relations.relation_snapshot().tool_calls, 6)
+        self.assertEqual((ch_context.relation_ids, ch_context.related_units,
+                          ch_context.relation_get), helpers)
+
+
 class TestNovaMetadataContext(CharmTestCase):
 
     def setUp(self):
@@ -619,3 +694,78 @@ class TestGetAvailabilityZone(CharmTestCase):
         os_environ_get_mock.side_effect = os_environ_get_side_effect
         az = neutron_contexts.get_availability_zone()
         self.assertEqual('nova', az)
+
+
+class TestPortContexts(CharmTestCase):
+
+    def setUp(self):
+        super(TestPortContexts, self).setUp(neutron_contexts, TO_PATCH)
+        self.config.side_effect = self.test_config.get
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        sysfs = FakeSysClassNet(self.tmpdir)
+        sysfs.add('eth0', 2, address='fa:16:3e:00:00:01')
+        sysfs.add('eth1', 3, address='fa:16:3e:00:00:02')
+        sysfs.add('eth2', 4, address='fa:16:3e:00:00:03')
+        sysfs.add('eth3', 5, address='fa:16:3e:00:00:04')
+        bond0 = sysfs.add('bond0', 10, physical=False,
+                          address='fa:16:3e:00:00:02')
+        os.mkdir(os.path.join(bond0, 'bonding'))
+        sysfs.link('eth1', 'master', 'bond0')
+        br0 = sysfs.add('br0', 11, physical=False,
+                        address='fa:16:3e:00:00:03')
+        os.mkdir(os.path.join(br0, 'bridge'))
+        sysfs.link('eth2', 'master', 'br0')
+        sysfs.add('eth3.100', 12, physical=False,
+                  address='fa:16:3e:00:00:04')
+        sysfs.link('eth3.100', 'lower_eth3', 'eth3')
+        self.addresses = {'eth0': ['10.0.0.10']}
+        self.patch_object(neutron_nics, 'get_ipv4_addr',
+                          side_effect=lambda nic, fatal: self.addresses.get(
+                              nic, []))
+        self.patch_object(neutron_nics, 'get_ipv6_addr', return_value=[])
+        self.inventory = neutron_nics.NicInventory(sysfs.sys_net)
+        self.patch_object(neutron_contexts, 'nic_inventory',
+                          return_value=self.inventory)
+
+    def test_resolve_ports(self):
+        ctxt = neutron_contexts.NeutronPortContext()
+        self.assertIsNone(ctxt.resolve_ports([]))
+        self.assertEqual(
+            sorted(ctxt.resolve_ports([
+                # has an IP address
+                'fa:16:3e:00:00:01',
+                # enslaved to bond0
+                'fa:16:3e:00:00:02',
+                # enslaved to br0
+                'fa:16:3e:00:00:03',
+                # unknown
+                'fa:16:3e:00:00:ff',
+                'eth0',
+                'eth9',
+            ])),
+            ['bond0', 'eth0'])
+
+    @patch('charmhelpers.contrib.openstack.context.NeutronAPIContext')
+    @patch('charmhelpers.contrib.openstack.context.config')
+    def test_external_port(self, _config, _NeutronAPIContext):
+        _config.side_effect = self.test_config.get
+        _NeutronAPIContext.return_value = DummyNeutronAPIContext(
+            return_value={'network_device_mtu': 9000})
+        self.test_config.set('ext-port', 'fa:16:3e:00:00:04')
+        self.assertEqual(neutron_contexts.ExternalPortContext()(),
+                         {'ext_port': 'eth3', 'ext_port_mtu': 9000})
+
+    def test_data_port(self):
+        self.test_config.set('data-port',
+                             'br-data:fa:16:3e:00:00:02 br-ex:eth3.100')
+        self.assertEqual(neutron_contexts.DataPortContext()(),
+                         {'bond0': 'br-data', 'eth3.100': 'br-ex'})
+
+    @patch('neutron_contexts.NeutronAPIContext')
+    def test_phy_nic_mtu(self, _NeutronAPIContext):
+        _NeutronAPIContext.return_value = DummyNeutronAPIContext(
+            return_value={'network_device_mtu': 9000})
+        self.test_config.set('data-port', 'br-data:eth3.100')
+        self.assertEqual(neutron_contexts.PhyNICMTUContext()(),
+                         {'devs': 'eth3\\neth3.100', 'mtu': 9000})
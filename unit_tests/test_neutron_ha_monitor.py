@@ -0,0 +1,801 @@
+import datetime
+import importlib.util
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import types
+import unittest
+
+from mock import MagicMock, patch, call
+
+MONITOR = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                       'files', 'neutron-ha-monitor.py')
+
+
+class NeutronClientException(Exception):
+    status_code = 0
+
+
+class NotFound(NeutronClientException):
+    status_code = 404
+
+
+class ServiceUnavailable(NeutronClientException):
+    status_code = 503
+
+
+def load_monitor():
+    # The monitor runs on the gateway next to neutron and neutronclient,
+    # none of which is installed for the unit tests.
+    exceptions = types.ModuleType('neutronclient.common.exceptions')
+    exceptions.NeutronClientException = NeutronClientException
+    exceptions.NotFound = NotFound
+    modules = {
+        'oslo': MagicMock(),
+        'oslo.config': MagicMock(),
+        'neutron': MagicMock(),
+        'neutron.agent': MagicMock(),
+        'neutron.agent.linux': MagicMock(),
+        'neutronclient': MagicMock(),
+        'neutronclient.common': MagicMock(exceptions=exceptions),
+        'neutronclient.common.exceptions': exceptions,
+        'neutron.openstack': MagicMock(),
+        'neutron.openstack.common': MagicMock(),
+    }
+    spec = importlib.util.spec_from_file_location('neutron_ha_monitor',
+                                                  MONITOR)
+    module = importlib.util.module_from_spec(spec)
+    with patch.dict(sys.modules, modules):
+        spec.loader.exec_module(module)
+    return module
+
+
+monitor = load_monitor()
+
+
+class MonitorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(MonitorTestCase, self).setUp()
+        self.conf = MagicMock(
+            check_interval='8',
+            healthy_check_interval=60,
+            heartbeat_threshold=45,
+            notification_url=None,
+            notification_event_types=['agent.*'],
+            tunnel_debounce=30,
+            service_restart_burst=3,
+            service_restart_window=300,
+            cleanup_concurrency=4,
+            reschedule_concurrency=4,
+            reschedule_retries=2,
+            reschedule_backoff=0.5)
+        self.patch(monitor.cfg, 'CONF', self.conf)
+        self.patch(monitor, 'LOG')
+        self.sleep = self.patch(monitor.time, 'sleep')
+        self.daemon = monitor.MonitorNeutronAgentsDaemon()
+        self.daemon.hostname = 'gateway-0'
+
+    def patch(self, obj, attr, new=None):
+        patcher = patch.object(obj, attr, new) if new is not None \
+            else patch.object(obj, attr)
+        mocked = patcher.start()
+        self.addCleanup(patcher.stop)
+        return mocked
+
+
+class TestRunBounded(unittest.TestCase):
+
+    def test_runs_all_tasks(self):
+        done = []
+        monitor.run_bounded([lambda i=i: done.append(i) for i in range(10)],
+                            3)
+        self.assertEqual(sorted(done), list(range(10)))
+
+    def test_failing_task_does_not_stop_others(self):
+        done = []
+
+        def fail():
+            raise Exception('boom')
+
+        with patch.object(monitor, 'LOG'):
+            monitor.run_bounded([fail, lambda: done.append(1)], 1)
+        self.assertEqual(done, [1])
+
+
+class TestReschedule(MonitorTestCase):
+
+    def setUp(self):
+        super(TestReschedule, self).setUp()
+        self.validate = self.patch(self.daemon, 'validate_reschedule')
+        self.validate.return_value = True
+        self.quantum = MagicMock()
+        # workers build their own clients, hand them all the same mock
+        self.patch(self.daemon, 'get_env')
+        self.new_client = self.patch(self.daemon, '_new_quantum_client')
+        self.new_client.return_value = self.quantum
+
+    def test_call_with_retry(self):
+        func = MagicMock(__name__='add_router_to_l3_agent')
+        func.side_effect = [ServiceUnavailable('503'),
+                            ServiceUnavailable('503'), 'ok']
+        self.assertEqual(self.daemon._call_with_retry(func, l3_agent='a1'),
+                         'ok')
+        self.assertEqual(func.call_count, 3)
+        self.sleep.assert_has_calls([call(0.5), call(1.0)])
+
+    def test_call_with_retry_gives_up(self):
+        func = MagicMock(__name__='add_router_to_l3_agent')
+        func.side_effect = ServiceUnavailable('503')
+        self.assertRaises(ServiceUnavailable, self.daemon._call_with_retry,
+                          func, l3_agent='a1')
+        self.assertEqual(func.call_count, 3)
+
+    def test_call_with_retry_not_found(self):
+        func = MagicMock(__name__='remove_router_from_l3_agent')
+        func.side_effect = NotFound('gone')
+        self.assertRaises(NotFound, self.daemon._call_with_retry, func)
+        self.assertEqual(func.call_count, 1)
+        self.assertFalse(self.sleep.called)
+
+    def test_l3_agents_reschedule(self):
+        routers = {'r1': 'dead', 'r2': 'dead', 'r3': 'dead'}
+        self.assertTrue(self.daemon.l3_agents_reschedule(
+            ['l3-a', 'l3-b'], routers, self.quantum))
+        self.quantum.remove_router_from_l3_agent.assert_has_calls([
+            call(l3_agent='dead', router_id='r1'),
+            call(l3_agent='dead', router_id='r2'),
+            call(l3_agent='dead', router_id='r3'),
+        ], any_order=True)
+        self.quantum.add_router_to_l3_agent.assert_has_calls([
+            call(l3_agent='l3-a', body={'router_id': 'r1'}),
+            call(l3_agent='l3-b', body={'router_id': 'r2'}),
+            call(l3_agent='l3-a', body={'router_id': 'r3'}),
+        ], any_order=True)
+
+    def test_dhcp_agents_reschedule(self):
+        self.assertTrue(self.daemon.dhcp_agents_reschedule(
+            ['dhcp-a'], {'n1': 'dead'}, self.quantum))
+        self.quantum.remove_network_from_dhcp_agent.assert_called_once_with(
+            dhcp_agent='dead', network_id='n1')
+        self.quantum.add_network_to_dhcp_agent.assert_called_once_with(
+            dhcp_agent='dhcp-a', body={'network_id': 'n1'})
+
+    def test_reschedule_failed_call_still_moves_others(self):
+        self.quantum.add_router_to_l3_agent.side_effect = [
+            NotFound('gone'), None]
+        self.conf.reschedule_concurrency = 1
+        self.assertTrue(self.daemon.l3_agents_reschedule(
+            ['l3-a'], {'r1': 'dead', 'r2': 'dead'}, self.quantum))
+        self.assertEqual(self.quantum.add_router_to_l3_agent.call_count, 2)
+
+    def test_workers_own_clients(self):
+        new_client = self.new_client
+        clients = {}
+        started = threading.Barrier(4)
+
+        def build(env):
+            started.wait(timeout=5)
+            client = MagicMock()
+            clients[threading.current_thread()] = client
+            return client
+
+        new_client.side_effect = build
+        self.daemon.l3_agents_reschedule(
+            ['l3-a'], {'r%d' % i: 'dead' for i in range(8)}, self.quantum)
+        # one client per worker thread, never the shared one
+        self.assertEqual(new_client.call_count, 4)
+        self.assertEqual(len(set(map(id, clients.values()))), 4)
+        self.assertEqual(
+            sum(c.add_router_to_l3_agent.call_count
+                for c in clients.values()), 8)
+        self.assertFalse(self.quantum.add_router_to_l3_agent.called)
+
+    def test_single_worker_uses_shared_client(self):
+        new_client = self.new_client
+        self.conf.reschedule_concurrency = 1
+        self.daemon.l3_agents_reschedule(
+            ['l3-a'], {'r1': 'dead', 'r2': 'dead'}, self.quantum)
+        self.assertEqual(self.quantum.add_router_to_l3_agent.call_count, 2)
+        self.assertFalse(new_client.called)
+
+    def test_reschedule_not_leader(self):
+        self.validate.return_value = False
+        self.assertFalse(self.daemon.l3_agents_reschedule(
+            ['l3-a'], {'r1': 'dead'}, self.quantum))
+        self.assertFalse(self.daemon.dhcp_agents_reschedule(
+            ['dhcp-a'], {'n1': 'dead'}, self.quantum))
+        self.assertFalse(self.quantum.add_router_to_l3_agent.called)
+        self.assertFalse(self.quantum.add_network_to_dhcp_agent.called)
+
+    def test_reschedule_nothing_to_move(self):
+        self.assertFalse(self.daemon.l3_agents_reschedule(
+            ['l3-a'], {}, self.quantum))
+        self.assertFalse(self.validate.called)
+
+
+def agent(agent_id, agent_type, host, alive=True, heartbeat='hb1'):
+    return {'id': agent_id, 'agent_type': agent_type, 'host': host,
+            'alive': alive, 'heartbeat_timestamp': heartbeat,
+            'configurations': {}}
+
+
+class TestReassignAgentResources(MonitorTestCase):
+
+    def setUp(self):
+        super(TestReassignAgentResources, self).setUp()
+        self.quantum = MagicMock()
+        self.agents = [
+            agent('dhcp-0', 'DHCP Agent', 'gateway-0'),
+            agent('dhcp-1', 'DHCP Agent', 'gateway-1'),
+            agent('l3-0', 'L3 Agent', 'gateway-0'),
+            agent('l3-1', 'L3 Agent', 'gateway-1'),
+        ]
+        self.quantum.list_agents.side_effect = \
+            lambda: {'agents': self.agents}
+        self.quantum.list_networks_on_dhcp_agent.side_effect = \
+            lambda agent_id: {'networks': [{'id': 'n-' + agent_id}]}
+        self.quantum.list_routers_on_l3_agent.side_effect = \
+            lambda agent_id: {'routers': [{'id': 'r-' + agent_id}]}
+        self.patch(self.daemon, 'cleanup_dhcp')
+        self.patch(self.daemon, 'cleanup_router')
+        self.patch(self.daemon, 'export_failover_metric')
+        self.validate = self.patch(self.daemon, 'validate_reschedule')
+        self.validate.return_value = True
+
+    def fail_gateway_1(self):
+        self.agents[1] = agent('dhcp-1', 'DHCP Agent', 'gateway-1',
+                               alive=False)
+        self.agents[3] = agent('l3-1', 'L3 Agent', 'gateway-1',
+                               alive=False)
+
+    def failover_logged(self):
+        return any(c[0][0].startswith('Failover complete')
+                   for c in monitor.LOG.info.call_args_list)
+
+    def test_all_alive_queries_local_agents_only(self):
+        self.daemon.reassign_agent_resources(self.quantum)
+        self.quantum.list_agents.assert_called_once_with()
+        self.quantum.list_networks_on_dhcp_agent.assert_called_once_with(
+            'dhcp-0')
+        self.quantum.list_routers_on_l3_agent.assert_called_once_with(
+            'l3-0')
+        self.assertFalse(self.validate.called)
+        self.assertFalse(self.failover_logged())
+
+    def test_local_hosting_not_cached(self):
+        self.daemon.reassign_agent_resources(self.quantum)
+        self.daemon.reassign_agent_resources(self.quantum)
+        self.assertEqual(
+            self.quantum.list_networks_on_dhcp_agent.call_count, 2)
+        self.assertEqual(self.daemon._hosting_cache, {})
+
+    def test_failed_hosting_cached_by_heartbeat(self):
+        self.validate.return_value = False
+        self.fail_gateway_1()
+        self.daemon.reassign_agent_resources(self.quantum)
+        self.daemon.reassign_agent_resources(self.quantum)
+        self.assertEqual(
+            self.quantum.list_networks_on_dhcp_agent.call_args_list,
+            [call('dhcp-0'), call('dhcp-1'), call('dhcp-0')])
+        self.agents[1] = agent('dhcp-1', 'DHCP Agent', 'gateway-1',
+                               alive=False, heartbeat='hb2')
+        self.daemon.reassign_agent_resources(self.quantum)
+        self.assertEqual(
+            self.quantum.list_networks_on_dhcp_agent.call_args_list[-1],
+            call('dhcp-1'))
+
+    def test_reschedule_onto_local_agent(self):
+        hosting = {'dhcp-0': [], 'dhcp-1': ['n1'],
+                   'l3-0': [], 'l3-1': ['r1']}
+
+        def hosted(key):
+            return lambda agent_id: {key: [{'id': res_id}
+                                           for res_id in hosting[agent_id]]}
+
+        def move(agent_key, res_key):
+            def add(body, **kwargs):
+                for resources in hosting.values():
+                    if body[res_key] in resources:
+                        resources.remove(body[res_key])
+                hosting[kwargs[agent_key]].append(body[res_key])
+            return add
+
+        self.quantum.list_networks_on_dhcp_agent.side_effect = \
+            hosted('networks')
+        self.quantum.list_routers_on_l3_agent.side_effect = hosted('routers')
+        self.quantum.add_network_to_dhcp_agent.side_effect = \
+            move('dhcp_agent', 'network_id')
+        self.quantum.add_router_to_l3_agent.side_effect = \
+            move('l3_agent', 'router_id')
+        # nothing hosted locally yet, stale namespaces are cleaned up
+        self.daemon.reassign_agent_resources(self.quantum)
+        self.daemon.cleanup_dhcp.assert_called_once_with(None)
+        self.daemon.cleanup_router.assert_called_once_with(None)
+        self.fail_gateway_1()
+        self.daemon.reassign_agent_resources(self.quantum)
+        self.assertEqual(hosting['l3-0'], ['r1'])
+        self.assertEqual(hosting['dhcp-0'], ['n1'])
+        self.daemon.cleanup_dhcp.reset_mock()
+        self.daemon.cleanup_router.reset_mock()
+        # the rescheduled router and network must survive the next loop
+        self.daemon.reassign_agent_resources(self.quantum)
+        self.assertNotIn(call(None), self.daemon.cleanup_dhcp.call_args_list)
+        self.assertNotIn(call(None),
+                         self.daemon.cleanup_router.call_args_list)
+
+    def test_failover(self):
+        self.fail_gateway_1()
+        self.daemon.reassign_agent_resources(self.quantum)
+        self.quantum.add_router_to_l3_agent.assert_called_once_with(
+            l3_agent='l3-0', body={'router_id': 'r-l3-1'})
+        self.quantum.add_network_to_dhcp_agent.assert_called_once_with(
+            dhcp_agent='dhcp-0', body={'network_id': 'n-dhcp-1'})
+        self.assertTrue(self.failover_logged())
+        self.assertEqual(self.daemon.export_failover_metric.call_count, 1)
+        latency, routers, networks = \
+            self.daemon.export_failover_metric.call_args[0]
+        self.assertEqual(routers, {'r-l3-1': 'l3-1'})
+        self.assertEqual(networks, {'n-dhcp-1': 'dhcp-1'})
+        self.assertNotIn('l3-1', self.daemon._hosting_cache)
+        self.assertNotIn('dhcp-1', self.daemon._hosting_cache)
+        self.assertEqual(self.daemon._down_since, {})
+
+    def test_failover_not_leader(self):
+        self.validate.return_value = False
+        self.fail_gateway_1()
+        self.daemon.reassign_agent_resources(self.quantum)
+        self.assertFalse(self.quantum.add_router_to_l3_agent.called)
+        self.assertFalse(self.failover_logged())
+        self.assertFalse(self.daemon.export_failover_metric.called)
+        # hosting of the failed agents stays cached
+        self.assertIn('l3-1', self.daemon._hosting_cache)
+        self.assertIn('dhcp-1', self.daemon._hosting_cache)
+        self.assertEqual(set(self.daemon._down_since), {'l3-1', 'dhcp-1'})
+        self.daemon.reassign_agent_resources(self.quantum)
+        # only the live local agent is asked again
+        self.assertEqual(self.quantum.list_routers_on_l3_agent.call_args_list,
+                         [call('l3-0'), call('l3-1'), call('l3-0')])
+
+    def test_list_agents_failure(self):
+        self.quantum.list_agents.side_effect = ServiceUnavailable('503')
+        self.daemon.reassign_agent_resources(self.quantum)
+        self.assertIsNone(self.daemon._agents)
+        self.assertFalse(self.quantum.list_networks_on_dhcp_agent.called)
+
+
+IP_ALL_NETNS_LINKS = '''\
+netns: qrouter-r1
+1: lo: <LOOPBACK,UP,LOWER_UP> mtu 65536 qdisc noqueue state UNKNOWN
+2: qr-1@if12: <BROADCAST,MULTICAST,UP,LOWER_UP> mtu 1450 qdisc noqueue
+3: qg-2: <BROADCAST,MULTICAST,UP,LOWER_UP> mtu 1500 qdisc noqueue
+netns: qdhcp-n1
+1: lo: <LOOPBACK,UP,LOWER_UP> mtu 65536 qdisc noqueue state UNKNOWN
+2: tap3: <BROADCAST,MULTICAST,UP,LOWER_UP> mtu 1450 qdisc noqueue
+netns: other
+1: lo: <LOOPBACK,UP,LOWER_UP> mtu 65536 qdisc noqueue state UNKNOWN
+2: eth0: <BROADCAST,MULTICAST,UP,LOWER_UP> mtu 1500 qdisc noqueue
+'''
+
+
+class TestNamespaceCleanup(MonitorTestCase):
+
+    def setUp(self):
+        super(TestNamespaceCleanup, self).setUp()
+        self.check_output = self.patch(monitor.subprocess, 'check_output')
+        self.ip_lib = self.patch(monitor, 'ip_lib')
+
+    def test_list_namespaces(self):
+        listdir = self.patch(monitor.os, 'listdir')
+        listdir.return_value = ['qrouter-r1', 'qdhcp-n1']
+        self.assertEqual(self.daemon.list_namespaces(),
+                         ['qrouter-r1', 'qdhcp-n1'])
+        listdir.assert_called_once_with(monitor.NETNS_DIR)
+        self.assertFalse(self.check_output.called)
+
+    def test_list_namespaces_without_netns_dir(self):
+        self.patch(monitor.os, 'listdir').side_effect = OSError
+        self.check_output.return_value = \
+            'qrouter-r1 (id: 0)\nqdhcp-n1\n\n'
+        self.assertEqual(self.daemon.list_namespaces(),
+                         ['qrouter-r1', 'qdhcp-n1'])
+        self.check_output.assert_called_once_with(['sudo', 'ip', 'netns'])
+
+    def test_namespace_devices(self):
+        self.check_output.return_value = IP_ALL_NETNS_LINKS
+        self.assertEqual(
+            self.daemon.namespace_devices(['qrouter-r1', 'qdhcp-n1',
+                                           'qrouter-gone']),
+            {'qrouter-r1': ['qr-1', 'qg-2'], 'qdhcp-n1': ['tap3']})
+        self.check_output.assert_called_once_with(
+            ['sudo', 'ip', '-all', 'netns', 'exec', 'ip', '-o', 'link',
+             'show'])
+
+    def test_namespace_devices_failure(self):
+        self.check_output.side_effect = \
+            monitor.subprocess.CalledProcessError(255, 'ip')
+        self.assertIsNone(self.daemon.namespace_devices(['qrouter-r1']))
+
+    def test_destroy_namespace(self):
+        devices = [MagicMock(), MagicMock()]
+        self.ip_lib.IPDevice.side_effect = devices
+        unplug = self.patch(self.daemon, 'unplug_device')
+        self.daemon.destroy_namespace('qrouter-r1', ['qr-1', 'qg-2'])
+        self.ip_lib.IPDevice.assert_has_calls([
+            call('qr-1', 'sudo', 'qrouter-r1'),
+            call('qg-2', 'sudo', 'qrouter-r1'),
+        ])
+        unplug.assert_has_calls([call(devices[0]), call(devices[1])])
+        ip = self.ip_lib.IPWrapper.return_value
+        ip.garbage_collect_namespace.assert_called_once_with()
+        self.assertFalse(ip.get_devices.called)
+
+    def test_destroy_namespace_without_inventory(self):
+        ip = self.ip_lib.IPWrapper.return_value
+        ip.netns.exists.return_value = False
+        self.daemon.destroy_namespace('qrouter-r1')
+        self.assertFalse(ip.garbage_collect_namespace.called)
+        ip.netns.exists.return_value = True
+        self.daemon.destroy_namespace('qrouter-r1')
+        ip.get_devices.assert_called_once_with(exclude_loopback=True)
+        ip.garbage_collect_namespace.assert_called_once_with()
+
+    def test_destroy_namespaces(self):
+        self.check_output.return_value = IP_ALL_NETNS_LINKS
+        destroy = self.patch(self.daemon, 'destroy_namespace')
+        destroy.side_effect = [Exception('busy'), None]
+        self.conf.cleanup_concurrency = 1
+        self.daemon.destroy_namespaces(['qrouter-r1', 'qdhcp-n1',
+                                        'qrouter-gone'])
+        self.assertEqual(destroy.call_args_list, [
+            call('qrouter-r1', ['qr-1', 'qg-2']),
+            call('qdhcp-n1', ['tap3']),
+        ])
+
+    def test_destroy_namespaces_without_inventory(self):
+        self.check_output.side_effect = OSError
+        destroy = self.patch(self.daemon, 'destroy_namespace')
+        self.daemon.destroy_namespaces(['qrouter-r1', 'qrouter-gone'])
+        self.assertEqual(sorted(destroy.call_args_list), [
+            call('qrouter-gone', None),
+            call('qrouter-r1', None),
+        ])
+
+    def test_cleanup_lists_namespaces(self):
+        self.patch(self.daemon, 'list_namespaces').return_value = [
+            'qrouter-r1', 'qdhcp-n1', 'qrouter-r2']
+        destroy = self.patch(self.daemon, 'destroy_namespaces')
+        self.daemon.cleanup_router(None)
+        destroy.assert_called_once_with(['qrouter-r1', 'qrouter-r2'])
+
+
+class TestFailoverMetric(MonitorTestCase):
+
+    def setUp(self):
+        super(TestFailoverMetric, self).setUp()
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.metrics_file = os.path.join(tmpdir, 'metrics.json')
+        self.patch(monitor, 'METRICS_FILE', self.metrics_file)
+
+    def test_export_failover_metric(self):
+        self.daemon.export_failover_metric(
+            1.23456, {'r1': 'l3-1', 'r2': 'l3-1'}, {'n1': 'dhcp-1'})
+        with open(self.metrics_file) as f:
+            metric = json.load(f)
+        self.assertEqual(metric['failover_latency_seconds'], 1.235)
+        self.assertEqual((metric['routers'], metric['networks']), (2, 1))
+        self.assertEqual(os.listdir(os.path.dirname(self.metrics_file)),
+                         ['metrics.json'])
+
+    def test_export_failover_metric_unwritable(self):
+        self.patch(monitor, 'METRICS_FILE', '/nonexistent/metrics.json')
+        self.daemon.export_failover_metric(1.0, {}, {})
+        self.assertTrue(monitor.LOG.warning.called)
+
+
+def heartbeat(age):
+    reported = datetime.datetime.utcnow() - datetime.timedelta(seconds=age)
+    return reported.strftime(monitor.HEARTBEAT_FORMAT + '.000000')
+
+
+class TestNextInterval(MonitorTestCase):
+
+    def test_survey_failed(self):
+        self.daemon._agents = None
+        self.assertEqual(self.daemon.next_interval(), 8)
+
+    def test_all_healthy(self):
+        self.daemon._agents = [agent('l3-0', 'L3 Agent', 'gateway-0',
+                                     heartbeat=heartbeat(5))]
+        self.assertEqual(self.daemon.next_interval(), 60)
+
+    def test_agent_down(self):
+        self.daemon._agents = [
+            agent('l3-0', 'L3 Agent', 'gateway-0', heartbeat=heartbeat(5)),
+            agent('l3-1', 'L3 Agent', 'gateway-1', alive=False,
+                  heartbeat=heartbeat(5)),
+        ]
+        self.assertEqual(self.daemon.next_interval(), 8)
+
+    def test_heartbeat_ageing(self):
+        self.daemon._agents = [agent('l3-0', 'L3 Agent', 'gateway-0',
+                                     heartbeat=heartbeat(50))]
+        self.assertEqual(self.daemon.next_interval(), 8)
+
+    def test_heartbeat_unknown(self):
+        self.daemon._agents = [agent('l3-0', 'L3 Agent', 'gateway-0',
+                                     heartbeat=None)]
+        self.assertEqual(self.daemon.next_interval(), 60)
+
+
+class StandInBroker(object):
+    """In-memory stand-in for an oslo.messaging notification transport."""
+
+    def __init__(self, pools=True):
+        self.pools = pools
+        self.listeners = []
+        self.module = types.ModuleType('oslo_messaging')
+        self.module.get_transport = lambda conf, url: url
+        self.module.Target = lambda topic: topic
+        self.module.get_notification_listener = \
+            self.get_notification_listener
+
+    def get_notification_listener(self, transport, targets, endpoints,
+                                  **kwargs):
+        if 'pool' in kwargs and not self.pools:
+            raise TypeError('unexpected keyword argument pool')
+        listener = MagicMock()
+        self.listeners.append({'transport': transport, 'targets': targets,
+                               'endpoints': endpoints,
+                               'pool': kwargs.get('pool'),
+                               'listener': listener})
+        return listener
+
+    def notify(self, priority, event_type):
+        for listener in self.listeners:
+            for endpoint in listener['endpoints']:
+                getattr(endpoint, priority)({}, 'network.neutron-api-0',
+                                            event_type, {}, {})
+
+
+class TestAgentStateListener(MonitorTestCase):
+
+    def start_listener(self, broker):
+        wakeup = threading.Event()
+        listener = monitor.AgentStateListener('fake://', ['agent.*'],
+                                              wakeup)
+        with patch.dict(sys.modules, {'oslo_messaging': broker.module}):
+            listener.start()
+        return wakeup
+
+    def test_agent_notification_wakes_monitor(self):
+        broker = StandInBroker()
+        wakeup = self.start_listener(broker)
+        self.assertEqual(len(broker.listeners), 1)
+        self.assertEqual(broker.listeners[0]['transport'], 'fake://')
+        self.assertEqual(broker.listeners[0]['targets'], ['notifications'])
+        self.assertEqual(broker.listeners[0]['pool'], 'neutron-ha-monitor')
+        broker.notify('info', 'port.create.end')
+        self.assertFalse(wakeup.is_set())
+        broker.notify('info', 'agent.update.end')
+        self.assertTrue(wakeup.is_set())
+
+    def test_other_priorities(self):
+        broker = StandInBroker()
+        wakeup = self.start_listener(broker)
+        broker.notify('error', 'agent.delete.end')
+        self.assertTrue(wakeup.is_set())
+
+    def test_no_pool_support(self):
+        broker = StandInBroker(pools=False)
+        wakeup = self.start_listener(broker)
+        self.assertEqual(len(broker.listeners), 1)
+        self.assertIsNone(broker.listeners[0]['pool'])
+        broker.notify('warn', 'agent.update.end')
+        self.assertTrue(wakeup.is_set())
+
+
+class TestServiceSupervisor(MonitorTestCase):
+
+    def setUp(self):
+        super(TestServiceSupervisor, self).setUp()
+        self.check_output = self.patch(monitor.subprocess, 'check_output')
+        self.subprocess_call = self.patch(monitor.subprocess, 'call')
+        self.isdir = self.patch(monitor.os.path, 'isdir')
+        self.isdir.return_value = True
+        self.supervisor = monitor.ServiceSupervisor(
+            ['openvswitch-switch', 'neutron-metadata-agent',
+             'neutron-vpn-agent'],
+            dependents={'neutron-metadata-agent': ['neutron-vpn-agent']},
+            restart_burst=2, restart_window=300)
+
+    def test_refresh_systemd(self):
+        self.check_output.return_value = (
+            'LoadState=loaded\nActiveState=active\n\n'
+            'LoadState=loaded\nActiveState=failed\n\n'
+            'LoadState=not-found\nActiveState=inactive\n')
+        self.assertEqual(self.supervisor.refresh(), {
+            'openvswitch-switch': True,
+            'neutron-metadata-agent': False,
+            'neutron-vpn-agent': None,
+        })
+        self.check_output.assert_called_once_with(
+            ['systemctl', 'show', '--property=LoadState,ActiveState',
+             'openvswitch-switch', 'neutron-metadata-agent',
+             'neutron-vpn-agent'])
+
+    def test_refresh_upstart(self):
+        self.isdir.return_value = False
+        self.check_output.return_value = (
+            'neutron-metadata-agent start/running, process 1234\n'
+            'neutron-vpn-agent stop/waiting\n'
+            'ssh start/running, process 42\n')
+        self.subprocess_call.return_value = 0
+        self.assertEqual(self.supervisor.refresh(), {
+            'openvswitch-switch': True,
+            'neutron-metadata-agent': True,
+            'neutron-vpn-agent': False,
+        })
+        self.check_output.assert_called_once_with(['initctl', 'list'])
+        self.subprocess_call.assert_called_once_with(
+            ['sudo', 'service', 'openvswitch-switch', 'status'])
+
+    def test_refresh_failure(self):
+        self.supervisor.states = {'openvswitch-switch': False}
+        self.check_output.side_effect = OSError('no systemctl')
+        self.assertEqual(self.supervisor.refresh(), {})
+        self.assertEqual(self.supervisor.supervise(), set())
+
+    def test_supervise_restarts_dependents(self):
+        self.supervisor.states = {
+            'openvswitch-switch': True,
+            'neutron-metadata-agent': False,
+            'neutron-vpn-agent': False,
+        }
+        self.assertEqual(self.supervisor.supervise(),
+                         {'neutron-metadata-agent', 'neutron-vpn-agent'})
+        self.assertEqual(self.check_output.call_args_list, [
+            call(['sudo', 'service', 'neutron-metadata-agent', 'restart']),
+            call(['sudo', 'service', 'neutron-vpn-agent', 'restart']),
+        ])
+
+    def test_supervise_running_dependency(self):
+        self.supervisor.states = {
+            'openvswitch-switch': None,
+            'neutron-metadata-agent': True,
+            'neutron-vpn-agent': False,
+        }
+        self.supervisor.supervise()
+        self.check_output.assert_called_once_with(
+            ['sudo', 'service', 'neutron-vpn-agent', 'restart'])
+
+    def test_restart_rate_limited(self):
+        self.patch(monitor.time, 'time').side_effect = [0, 10, 20, 400]
+        self.assertTrue(self.supervisor.restart('openvswitch-switch'))
+        self.assertTrue(self.supervisor.restart('openvswitch-switch'))
+        self.assertFalse(self.supervisor.restart('openvswitch-switch'))
+        self.assertEqual(self.check_output.call_count, 2)
+        # the earlier restarts have left the window
+        self.assertTrue(self.supervisor.restart('openvswitch-switch'))
+        self.assertEqual(self.check_output.call_count, 3)
+
+    def test_restart_failure(self):
+        self.check_output.side_effect = \
+            monitor.subprocess.CalledProcessError(1, 'service')
+        self.assertFalse(self.supervisor.restart('neutron-vpn-agent'))
+
+    def test_check_local_agents(self):
+        refresh = self.patch(self.daemon.supervisor, 'refresh')
+        supervise = self.patch(self.daemon.supervisor, 'supervise')
+        self.daemon.check_local_agents()
+        refresh.assert_called_once_with()
+        supervise.assert_called_once_with()
+
+
+BR_TUN_INTERFACES = {
+    'headings': ['name', 'type', 'ofport', 'error'],
+    'data': [
+        ['patch-int', 'patch', 1, ['set', []]],
+        ['vxlan-0a000002', 'vxlan', 2, ['set', []]],
+        ['vxlan-0a000003', 'vxlan', -1, 'could not open network device'],
+        ['gre-0a000004', 'gre', ['set', []], ['set', []]],
+    ],
+}
+
+
+class TestTunnelMonitor(MonitorTestCase):
+
+    def setUp(self):
+        super(TestTunnelMonitor, self).setUp()
+        self.check_output = self.patch(monitor.subprocess, 'check_output')
+        self.interfaces = BR_TUN_INTERFACES
+        self.check_output.side_effect = self.ovs_vsctl
+        self.time = self.patch(monitor.time, 'time')
+        self.time.return_value = 1000
+        self.tunnels = monitor.TunnelMonitor(debounce=30)
+        self.agent_conf = {'tunnel_types': ['vxlan'],
+                           'l2_population': True,
+                           'devices': 4}
+
+    def ovs_vsctl(self, cmd):
+        if cmd[1] == 'list-ports':
+            return '\n'.join(row[0] for row in self.interfaces['data'])
+        return json.dumps(self.interfaces)
+
+    def test_refresh_reads_br_tun(self):
+        self.tunnels.refresh()
+        self.assertEqual(self.check_output.call_args_list, [
+            call(['ovs-vsctl', 'list-ports', 'br-tun']),
+            call(['ovs-vsctl', '-f', 'json',
+                  '--columns=name,type,ofport,error', 'list', 'Interface',
+                  'patch-int', 'vxlan-0a000002', 'vxlan-0a000003',
+                  'gre-0a000004']),
+        ])
+        self.assertEqual(sorted(self.tunnels.ports),
+                         ['gre-0a000004', 'vxlan-0a000002',
+                          'vxlan-0a000003'])
+
+    def test_refresh_no_ports(self):
+        self.interfaces = {'headings': [], 'data': []}
+        self.tunnels.ports = {'vxlan-0a000002': {}}
+        self.tunnels.refresh()
+        self.assertEqual(self.tunnels.ports, {})
+        self.assertEqual(self.check_output.call_count, 1)
+
+    def test_healthy_ports(self):
+        self.tunnels.refresh()
+        self.assertEqual(self.tunnels.healthy_ports({'vxlan'}),
+                         ['vxlan-0a000002'])
+        self.assertEqual(self.tunnels.healthy_ports({'gre', 'geneve'}), [])
+
+    def test_not_checked_without_l2_population(self):
+        self.agent_conf['l2_population'] = False
+        self.assertFalse(self.tunnels.needs_restart(self.agent_conf))
+        self.assertFalse(self.check_output.called)
+
+    def test_checked_when_devices_change(self):
+        self.assertFalse(self.tunnels.needs_restart(self.agent_conf))
+        self.assertEqual(self.check_output.call_count, 2)
+        self.assertFalse(self.tunnels.needs_restart(self.agent_conf))
+        self.assertEqual(self.check_output.call_count, 2)
+        self.agent_conf['devices'] = 5
+        self.assertFalse(self.tunnels.needs_restart(self.agent_conf))
+        self.assertEqual(self.check_output.call_count, 4)
+
+    def test_restart_after_debounce(self):
+        self.agent_conf['tunnel_types'] = ['gre']
+        self.assertFalse(self.tunnels.needs_restart(self.agent_conf))
+        self.time.return_value = 1020
+        self.assertFalse(self.tunnels.needs_restart(self.agent_conf))
+        self.time.return_value = 1031
+        self.assertTrue(self.tunnels.needs_restart(self.agent_conf))
+        # checked again from scratch after the restart
+        self.assertFalse(self.tunnels.needs_restart(self.agent_conf))
+        self.assertEqual(self.check_output.call_count, 8)
+
+    def test_mismatch_cleared(self):
+        self.agent_conf['tunnel_types'] = ['gre']
+        self.assertFalse(self.tunnels.needs_restart(self.agent_conf))
+        self.agent_conf['tunnel_types'] = ['gre', 'vxlan']
+        self.time.return_value = 1031
+        self.assertFalse(self.tunnels.needs_restart(self.agent_conf))
+        self.assertIsNone(self.tunnels._mismatch_since)
+
+    def test_check_ovs_tunnel_restarts_agent(self):
+        needs_restart = self.patch(self.daemon.tunnels, 'needs_restart')
+        needs_restart.return_value = True
+        restart = self.patch(self.daemon.supervisor, 'restart')
+        local = agent('ovs-0', 'Open vSwitch agent', 'gateway-0')
+        local['configurations'] = self.agent_conf
+        self.daemon._agents = [
+            local,
+            agent('ovs-1', 'Open vSwitch agent', 'gateway-1'),
+            agent('l3-0', 'L3 Agent', 'gateway-0'),
+        ]
+        self.daemon.check_ovs_tunnel(MagicMock())
+        needs_restart.assert_called_once_with(self.agent_conf)
+        restart.assert_called_once_with('neutron-plugin-openvswitch-agent')
@@ -10,54 +10,56 @@ sys.modules['apt_pkg'] = MagicMock()
 import charmhelpers.core.hookenv as hookenv
 import charmhelpers.contrib.hardening.harden as harden
 
+import coldstart
 import neutron_hooks as hooks
+import neutron_utils
 
 from test_utils import CharmTestCase
 
 
 TO_PATCH = [
     'config',
-    'configure_installation_source',
-    'valid_plugin',
-    'apt_update',
+    'charmhelpers.contrib.openstack.utils.configure_installation_source',
+    'neutron_utils.valid_plugin',
+    'charmhelpers.fetch.apt_update',
     'apt_install',
     'apt_purge',
     'filter_installed_packages',
-    'get_early_packages',
-    'get_packages',
+    'neutron_utils.get_early_packages',
+    'neutron_utils.get_packages',
     'log',
-    'do_openstack_upgrade',
-    'openstack_upgrade_available',
+    'neutron_utils.do_openstack_upgrade',
+    'charmhelpers.contrib.openstack.utils.openstack_upgrade_available',
     'CONFIGS',
-    'configure_ovs',
+    'neutron_utils.configure_ovs',
     'relation_set',
     'relation_ids',
     'relation_get',
     'install_ca_cert',
     'execd_preinstall',
     'lsb_release',
-    'stop_services',
+    'neutron_utils.stop_services',
     'b64decode',
     'create_sysctl',
     'update_nrpe_config',
-    'update_legacy_ha_files',
-    'install_legacy_ha_files',
-    'cache_env_data',
+    'neutron_utils.update_legacy_ha_files',
+    'neutron_utils.install_legacy_ha_files',
+    'neutron_utils.cache_env_data',
     'get_hacluster_config',
-    'remove_legacy_ha_files',
-    'cleanup_ovs_netns',
-    'stop_neutron_ha_monitor_daemon',
-    'use_l3ha',
+    'neutron_utils.remove_legacy_ha_files',
+    'neutron_utils.cleanup_ovs_netns',
+    'neutron_utils.stop_neutron_ha_monitor_daemon',
+    'neutron_utils.use_l3ha',
     'kv',
     'service_restart',
-    'install_systemd_override',
-    'configure_apparmor',
-    'disable_nova_metadata',
-    'remove_legacy_nova_metadata',
-    'services',
-    'remove_old_packages',
+    'neutron_utils.install_systemd_override',
+    'neutron_utils.configure_apparmor',
+    'neutron_utils.disable_nova_metadata',
+    'neutron_utils.remove_legacy_nova_metadata',
+    'neutron_utils.services',
+    'neutron_utils.remove_old_packages',
     'is_container',
-    'charmhelpers.contrib.openstack.utils.is_unit_paused_set',
+    'neutron_restart.is_unit_paused_set',
 ]
 
 
@@ -346,7 +348,7 @@ class TestQuantumHooks(CharmTestCase):
                                                mock_resolve_config_files,
                                                mock_get_packages):
         '''Ensure no change in restart_trigger skips restarts'''
-        self.patch_object(hooks, 'disable_nova_metadata',
+        self.patch_object(neutron_utils, 'disable_nova_metadata',
                           return_value=False)
         # as restart_map is embedded into the decorator, we have to mock out
         # the bits in the restart_map to be able to make it pass.
@@ -418,8 +420,171 @@ class TestQuantumHooks(CharmTestCase):
         self.assertTrue(self.stop_neutron_ha_monitor_daemon.called)
 
     def test_quantum_network_service_relation_changed(self):
-        self.patch_object(hooks, 'disable_nova_metadata',
+        self.patch_object(neutron_utils, 'disable_nova_metadata',
                           return_value=False)
         self.test_config.set('ha-legacy-mode', True)
         self._call_hook('quantum-network-service-relation-changed')
         self.assertTrue(self.cache_env_data.called)
+
+    @patch.object(neutron_utils, 'assess_status')
+    @patch.object(hooks, 'relation_snapshot')
+    def test_main_logs_relation_snapshot_stats(self, _relation_snapshot,
+                                               _assess_status):
+        _relation_snapshot.return_value = MagicMock(hits=8, tool_calls=4,
+                                                    calls_saved=8)
+        with patch.object(hooks.sys, 'argv', ['hooks/stop']):
+            hooks.main()
+        self.assertTrue(self.stop_services.called)
+        _assess_status.assert_called_once_with(hooks.CONFIGS)
+        self.log.assert_called_with(
+            'Relation snapshot served 12 lookups using 4 hook tool calls '
+            '(8 calls saved)', level='DEBUG')
+
+    @patch.object(hooks, 'neutron_commands')
+    @patch.object(neutron_utils, 'assess_status')
+    def test_main_logs_command_stats(self, _assess_status, _commands):
+        _commands.runner.return_value.summary.return_value = \
+            'Ran 3 commands (2 forks, 1 memoized) in 0.010s'
+        with patch.object(hooks.sys, 'argv', ['hooks/stop']):
+            hooks.main()
+        self.log.assert_any_call(
+            'Ran 3 commands (2 forks, 1 memoized) in 0.010s', level='DEBUG')
+
+    @patch.object(hooks, 'neutron_profiling')
+    @patch.object(neutron_utils, 'assess_status')
+    def test_main_finishes_profile(self, _assess_status, _profiling):
+        _assess_status.side_effect = Exception('boom')
+        with patch.object(hooks.sys, 'argv', ['hooks/stop']):
+            self.assertRaises(Exception, hooks.main)
+        _profiling.span.assert_has_calls([
+            call('hook', 'stop'),
+            call('assess-status', 'assess_status'),
+        ], any_order=True)
+        _profiling.finish.assert_called_once_with()
+
+    @patch.object(hooks, 'config_digest')
+    @patch.object(hooks, 'harden_update_status')
+    def test_update_status_hardens_on_config_change(self,
+                                                    _harden_update_status,
+                                                    _config_digest):
+        kv_mock = MagicMock()
+        kv_mock.get.return_value = 'old-digest'
+        self.kv.return_value = kv_mock
+        _config_digest.return_value = 'new-digest'
+        self._call_hook('update-status')
+        _harden_update_status.assert_called_once_with()
+        self.assertFalse(kv_mock.flush.called)
+
+    @patch.object(hooks, 'config_digest')
+    def test_update_status_stores_hardened_config(self, _config_digest):
+        kv_mock = MagicMock()
+        kv_mock.get.return_value = 'old-digest'
+        self.kv.return_value = kv_mock
+        _config_digest.return_value = 'new-digest'
+        self._call_hook('update-status')
+        kv_mock.set.assert_called_once_with(hooks.UPDATE_STATUS_HARDEN_KEY,
+                                            'new-digest')
+
+    @patch.object(hooks, 'config_digest')
+    @patch.object(hooks, 'harden_update_status')
+    def test_update_status_skips_hardening(self, _harden_update_status,
+                                           _config_digest):
+        kv_mock = MagicMock()
+        kv_mock.get.return_value = 'digest'
+        self.kv.return_value = kv_mock
+        _config_digest.return_value = 'digest'
+        self._call_hook('update-status')
+        self.assertFalse(_harden_update_status.called)
+        self.assertFalse(kv_mock.set.called)
+
+    @patch.object(hooks, 'relation_snapshot')
+    @patch.object(neutron_utils, 'assess_status')
+    def test_main_every_hook(self, _assess_status, _relation_snapshot):
+        _relation_snapshot.return_value = MagicMock(hits=0, tool_calls=0,
+                                                    calls_saved=0)
+        names = coldstart.hook_names()
+        self.assertIn('amqp-relation-joined', names)
+        # hooks the charm does not handle are only logged
+        unhandled = [name for name in names if name not in hooks.hooks._hooks]
+        registered = {name: MagicMock() for name in names
+                      if name not in unhandled}
+        with patch.dict(hooks.hooks._hooks, registered):
+            for name in names:
+                _assess_status.reset_mock()
+                with patch.object(hooks.sys, 'argv',
+                                  ['hooks/{}'.format(name)]):
+                    hooks.main()
+                if hooks.ASSESS_STATUS in hooks.hook_setup(name):
+                    _assess_status.assert_called_once_with(hooks.CONFIGS)
+                else:
+                    self.assertFalse(_assess_status.called, name)
+        for name, hook in registered.items():
+            hook.assert_called_once_with()
+        self.assertEqual(sorted(unhandled), [
+            'neutron-plugin-api-relation-broken',
+            'neutron-plugin-api-relation-departed',
+            'neutron-plugin-api-relation-joined',
+            'quantum-network-service-relation-broken',
+            'start',
+        ])
+
+    def test_hook_setup(self):
+        self.assertEqual(hooks.hook_setup('config-changed'),
+                         (hooks.RESOLVE_CONFIGS, hooks.ASSESS_STATUS))
+        light = [name for name in coldstart.hook_names()
+                 if hooks.hook_setup(name) == ()]
+        self.assertEqual(sorted(light), ['amqp-nova-relation-joined',
+                                         'amqp-relation-joined'])
+
+    @patch.object(hooks, 'relation_snapshot')
+    def test_light_hook_skips_neutron_utils(self, _relation_snapshot):
+        _relation_snapshot.return_value = MagicMock(hits=0, tool_calls=0,
+                                                    calls_saved=0)
+        with patch.dict(sys.modules):
+            del sys.modules['neutron_utils']
+            with patch.object(hooks.sys, 'argv',
+                              ['hooks/amqp-relation-joined']):
+                hooks.main()
+            self.assertNotIn('neutron_utils', sys.modules)
+        self.relation_set.assert_called_once_with(
+            relation_id=None, username='neutron', vhost='openstack')
+
+    @patch.object(hooks, 'config_digest')
+    @patch.object(harden, 'harden')
+    def test_harden_only_when_enabled(self, _harden, _config_digest):
+        _config_digest.side_effect = ['digest-1', 'digest-2']
+        f = MagicMock(__name__='f', return_value='result')
+        hardened = hooks.harden()(f)
+        self.assertEqual(hardened('arg'), 'result')
+        f.assert_called_once_with('arg')
+        self.assertFalse(_harden.called)
+        self.test_config.set('harden', 'os')
+        _harden.return_value.return_value.return_value = 'hardened'
+        self.assertEqual(hardened('arg'), 'hardened')
+        _harden.assert_called_once_with(None)
+        _harden.return_value.assert_called_once_with(f)
+        # update-status only audits again once config changes
+        self.kv.return_value.set.assert_has_calls([
+            call(hooks.UPDATE_STATUS_HARDEN_KEY, 'digest-1'),
+            call(hooks.UPDATE_STATUS_HARDEN_KEY, 'digest-2'),
+        ])
+
+    @patch.object(hooks, 'config_digest')
+    def test_harden_failed_hook_not_stored(self, _config_digest):
+        f = MagicMock(__name__='f', side_effect=Exception('boom'))
+        self.assertRaises(Exception, hooks.harden()(f))
+        self.assertFalse(self.kv.return_value.set.called)
+
+
+class TestColdStart(CharmTestCase):
+
+    def setUp(self):
+        super(TestColdStart, self).setUp(coldstart, [])
+
+    def test_lazy_modules_not_imported(self):
+        # every hook runs one of these modules; import each in a fresh
+        # interpreter as Juju does.
+        modules = {m: h for h, m in coldstart.hook_names().items()}
+        for module, hook in sorted(modules.items()):
+            result = coldstart.measure(hook, module, 1)
+            self.assertEqual(result['lazy_loaded'], [], module)
@@ -0,0 +1,146 @@
+import os
+import subprocess
+import sys
+import textwrap
+import types
+
+from mock import call, patch
+
+import neutron_log
+
+from test_utils import CharmTestCase
+
+TO_PATCH = [
+    'atexit',
+]
+
+
+class TestLogBuffer(CharmTestCase):
+
+    def setUp(self):
+        super(TestLogBuffer, self).setUp(neutron_log, TO_PATCH)
+        self.patch_object(neutron_log, '_log_buffer', new=None)
+        self.patch_object(neutron_log.hookenv, 'log', name='juju_log')
+
+    def test_not_buffered(self):
+        neutron_log.log('message', level=neutron_log.DEBUG)
+        self.juju_log.assert_called_once_with('message',
+                                              level=neutron_log.DEBUG)
+
+    def test_buffered_until_error(self):
+        neutron_log.enable_log_buffer()
+        neutron_log.log('one')
+        neutron_log.log('two', level=neutron_log.INFO)
+        neutron_log.log('three', level=neutron_log.DEBUG)
+        self.assertFalse(self.juju_log.called)
+        neutron_log.log('failed', level=neutron_log.ERROR)
+        self.assertEqual(self.juju_log.call_args_list, [
+            call('one', level=None),
+            call('two', level=neutron_log.INFO),
+            call('three', level=neutron_log.DEBUG),
+            call('failed', level=neutron_log.ERROR),
+        ])
+
+    def test_consecutive_messages_joined(self):
+        neutron_log.enable_log_buffer()
+        neutron_log.log('one', level=neutron_log.INFO)
+        neutron_log.log('two', level=neutron_log.INFO)
+        neutron_log.log('three', level=neutron_log.WARNING)
+        neutron_log.log('four', level=neutron_log.INFO)
+        neutron_log._log_buffer.flush()
+        self.assertEqual(self.juju_log.call_args_list, [
+            call('one\ntwo', level=neutron_log.INFO),
+            call('three', level=neutron_log.WARNING),
+            call('four', level=neutron_log.INFO),
+        ])
+
+    def test_batches_limited_to_max_arg(self):
+        self.patch_object(neutron_log.hookenv, 'SH_MAX_ARG', new=8)
+        neutron_log.enable_log_buffer()
+        for message in ('one', 'two', 'three', 'a-long-message'):
+            neutron_log.log(message, level=neutron_log.INFO)
+        neutron_log._log_buffer.flush()
+        self.assertEqual(self.juju_log.call_args_list, [
+            call('one\ntwo', level=neutron_log.INFO),
+            call('three', level=neutron_log.INFO),
+            call('a-long-m', level=neutron_log.INFO),
+        ])
+
+    def test_flushed_when_full(self):
+        neutron_log.enable_log_buffer()
+        neutron_log._log_buffer.size = 2
+        neutron_log.log('one', level=neutron_log.DEBUG)
+        self.assertFalse(self.juju_log.called)
+        neutron_log.log('two', level=neutron_log.DEBUG)
+        self.juju_log.assert_called_once_with('one\ntwo',
+                                              level=neutron_log.DEBUG)
+
+    def test_threshold(self):
+        neutron_log.enable_log_buffer(threshold=neutron_log.INFO)
+        neutron_log.log('dropped', level=neutron_log.DEBUG)
+        neutron_log.log('default level')
+        neutron_log.log('unknown level', level='NOTICE')
+        neutron_log.log(['not', 'a', 'string'], level=neutron_log.WARNING)
+        neutron_log._log_buffer.flush()
+        self.assertEqual(self.juju_log.call_args_list, [
+            call('default level', level=None),
+            call('unknown level', level='NOTICE'),
+            call("['not', 'a', 'string']", level=neutron_log.WARNING),
+        ])
+
+    def test_charmhelpers_log_buffered(self):
+        module = types.ModuleType('charmhelpers.contrib.example')
+        module.log = module.juju_log = self.juju_log
+        module.other = 'unchanged'
+        with patch.dict(sys.modules, {module.__name__: module}):
+            neutron_log.enable_log_buffer(threshold=neutron_log.INFO)
+        self.assertIs(module.log, neutron_log._charmhelpers_log)
+        self.assertIs(module.juju_log, neutron_log._charmhelpers_log)
+        self.assertIs(neutron_log.hookenv.log, neutron_log._charmhelpers_log)
+        self.assertEqual(module.other, 'unchanged')
+        neutron_log.log('charm', level=neutron_log.INFO)
+        module.log('rendering', level=neutron_log.DEBUG)
+        neutron_log.log('dropped', level=neutron_log.DEBUG)
+        neutron_log.hookenv.log('hookenv')
+        self.assertFalse(self.juju_log.called)
+        neutron_log.log('failed', level=neutron_log.ERROR)
+        # charmhelpers' messages are in order and not subject to threshold
+        self.assertEqual(self.juju_log.call_args_list, [
+            call('charm', level=neutron_log.INFO),
+            call('rendering', level=neutron_log.DEBUG),
+            call('hookenv', level=None),
+            call('failed', level=neutron_log.ERROR),
+        ])
+
+    def test_flushed_at_exit(self):
+        neutron_log.enable_log_buffer()
+        neutron_log.enable_log_buffer(threshold=neutron_log.INFO)
+        self.atexit.register.assert_called_once_with(
+            neutron_log._log_buffer.flush)
+        self.assertEqual(neutron_log._log_buffer.threshold, neutron_log.INFO)
+
+    def test_flushed_on_unhandled_exception(self):
+        script = textwrap.dedent('''\
+            from neutron_log import enable_log_buffer, log
+            enable_log_buffer()
+            log('before the crash')
+            from charmhelpers.core.hookenv import log as charmhelpers_log
+            charmhelpers_log('from charmhelpers')
+            raise RuntimeError('crash')
+            ''')
+        env = dict(os.environ,
+                   PATH='/nonexistent',
+                   PYTHONPATH=os.path.dirname(neutron_log.__file__))
+        proc = subprocess.Popen([sys.executable, '-c', script], env=env,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE,
+                                universal_newlines=True)
+        _, stderr = proc.communicate()
+        self.assertEqual(proc.returncode, 1)
+        # juju-log is not installed, so hookenv.log() writes to stderr
+        self.assertIn('RuntimeError: crash', stderr)
+        self.assertIn('juju-log: before the crash', stderr)
+        self.assertGreater(stderr.index('juju-log: before the crash'),
+                           stderr.index('RuntimeError: crash'))
+        self.assertIn('juju-log: before the crash\nfrom charmhelpers',
+                      stderr)
@@ -0,0 +1,126 @@
+import os
+import shutil
+import tempfile
+
+import neutron_nics
+
+from test_utils import CharmTestCase
+
+TO_PATCH = [
+    'host',
+    'get_ipv4_addr',
+    'get_ipv6_addr',
+]
+
+
+class FakeSysClassNet(object):
+    '''A /sys/class/net tree under a temporary directory.'''
+
+    def __init__(self, root):
+        self.root = root
+        self.sys_net = os.path.join(root, 'class', 'net')
+        os.makedirs(self.sys_net)
+
+    def add(self, name, ifindex, physical=True, type='1', address=None,
+            mtu='1500'):
+        if physical:
+            device = os.path.join(self.root, 'devices', 'pci0000:00', name)
+        else:
+            device = os.path.join(self.root, 'devices', 'virtual', 'net',
+                                  name)
+        os.makedirs(device)
+        attrs = {'ifindex': str(ifindex), 'type': type, 'mtu': mtu}
+        if address:
+            attrs['address'] = address
+        for attr, value in attrs.items():
+            with open(os.path.join(device, attr), 'w') as f:
+                f.write(value + '\n')
+        os.symlink(device, os.path.join(self.sys_net, name))
+        return device
+
+    def link(self, name, attr, target):
+        os.symlink(os.path.join(self.sys_net, target),
+                   os.path.join(self.sys_net, name, attr))
+
+
+class TestNicInventory(CharmTestCase):
+
+    def setUp(self):
+        super(TestNicInventory, self).setUp(neutron_nics, TO_PATCH)
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.sysfs = FakeSysClassNet(self.tmpdir)
+        self.sysfs.add('lo', 1, physical=False, type='772', address='0')
+        self.sysfs.add('eth0', 2, address='fa:16:3e:00:00:01')
+        self.sysfs.add('eth1', 3, address='fa:16:3e:00:00:02')
+        self.sysfs.add('eth2', 4, address='fa:16:3e:00:00:03')
+        bond0 = self.sysfs.add('bond0', 10, physical=False,
+                               address='fa:16:3e:00:00:02')
+        os.mkdir(os.path.join(bond0, 'bonding'))
+        self.sysfs.link('eth1', 'master', 'bond0')
+        br0 = self.sysfs.add('br0', 6, physical=False,
+                             address='fa:16:3e:00:00:03')
+        os.mkdir(os.path.join(br0, 'bridge'))
+        self.sysfs.link('eth2', 'master', 'br0')
+        self.sysfs.add('eth0.100', 5, physical=False,
+                       address='fa:16:3e:00:00:01', mtu='9000')
+        self.sysfs.link('eth0.100', 'lower_eth0', 'eth0')
+        with open(os.path.join(self.sysfs.sys_net, 'bonding_masters'),
+                  'w') as f:
+            f.write('bond0\n')
+        self.get_ipv4_addr.return_value = []
+        self.get_ipv6_addr.return_value = []
+
+    def test_list_nics(self):
+        self.assertEqual(neutron_nics.list_nics(self.sysfs.sys_net),
+                         ['lo', 'eth0', 'eth1', 'eth2', 'eth0.100', 'br0',
+                          'bond0'])
+        self.assertFalse(self.host.list_nics.called)
+
+    def test_list_nics_without_sysfs(self):
+        self.host.list_nics.return_value = ['lo', 'eth0']
+        self.assertEqual(
+            neutron_nics.list_nics(os.path.join(self.tmpdir, 'missing')),
+            ['lo', 'eth0'])
+        self.host.list_nics.assert_called_once_with()
+
+    def test_inventory(self):
+        inventory = neutron_nics.NicInventory(self.sysfs.sys_net)
+        self.assertIn('eth0', inventory)
+        self.assertNotIn('bonding_masters', inventory)
+        self.assertTrue(inventory.is_physical('eth0'))
+        self.assertFalse(inventory.is_physical('bond0'))
+        self.assertFalse(inventory.is_physical('eth3'))
+        self.assertEqual(inventory.bond_master('eth1'), 'bond0')
+        self.assertIsNone(inventory.bond_master('eth0'))
+        self.assertTrue(inventory.is_bridge_member('eth2'))
+        self.assertFalse(inventory.is_bridge_member('eth1'))
+        self.assertEqual(inventory.hwaddr('eth0'), 'fa:16:3e:00:00:01')
+        self.assertEqual(inventory.hwaddr('lo'), '')
+        self.assertEqual(inventory.hwaddr('eth3'), '')
+        self.assertEqual(inventory.mtu('eth0.100'), '9000')
+        self.assertIsNone(inventory.mtu('eth3'))
+        self.assertEqual(inventory.lower('eth0.100'), ['eth0'])
+        self.assertEqual(inventory.lower('eth0'), [])
+
+    def test_addresses_looked_up_once(self):
+        self.get_ipv4_addr.return_value = ['10.0.0.10']
+        self.get_ipv6_addr.return_value = ['fe80::1']
+        inventory = neutron_nics.NicInventory(self.sysfs.sys_net)
+        self.assertFalse(self.get_ipv4_addr.called)
+        self.assertEqual(inventory.addresses('eth0'),
+                         ['10.0.0.10', 'fe80::1'])
+        self.assertEqual(inventory.addresses('eth0'),
+                         ['10.0.0.10', 'fe80::1'])
+        self.get_ipv4_addr.assert_called_once_with('eth0', fatal=False)
+        self.get_ipv6_addr.assert_called_once_with(iface='eth0', fatal=False)
+
+    def test_nic_inventory_cached(self):
+        self.patch_object(neutron_nics, '_nic_inventory', new=None)
+        self.patch_object(neutron_nics, 'NicInventory')
+        inventory = neutron_nics.nic_inventory()
+        self.assertIs(neutron_nics.nic_inventory(), inventory)
+        self.NicInventory.assert_called_once_with()
+        neutron_nics.reset_nic_inventory()
+        neutron_nics.nic_inventory()
+        self.assertEqual(self.NicInventory.call_count, 2)
@@ -0,0 +1,200 @@
+import json
+
+from mock import patch
+
+import neutron_ovs
+
+from test_utils import CharmTestCase
+
+TO_PATCH = [
+    'neutron_commands',
+    'log',
+]
+
+
+def vsctl_json(headings, data):
+    return json.dumps({'headings': headings, 'data': data})
+
+
+OVSDB_JSON = '\n'.join([
+    vsctl_json(['_uuid', 'ipfix', 'name', 'ports'], [
+        [['uuid', 'b1'], ['uuid', 'i1'], 'br-ex',
+         ['set', [['uuid', 'p1'], ['uuid', 'p2']]]],
+        [['uuid', 'b2'], ['set', []], 'br-int', ['uuid', 'p3']],
+    ]),
+    vsctl_json(['_uuid', 'name'], [
+        [['uuid', 'p1'], 'br-ex'],
+        [['uuid', 'p2'], 'eth1'],
+        [['uuid', 'p3'], 'br-int'],
+    ]),
+    vsctl_json(['_uuid', 'cache_active_timeout', 'cache_max_flows',
+                'other_config', 'sampling', 'targets'], [
+        [['uuid', 'i1'], 60, 128,
+         ['map', [['enable-tunnel-sampling', 'true']]],
+         64, '10.0.0.1:4739'],
+    ]),
+]) + '\n'
+
+OVSDB_STATE = {
+    'br-ex': {
+        'ports': {'br-ex', 'eth1'},
+        'ipfix': {
+            '_uuid': 'i1',
+            'cache_active_timeout': 60,
+            'cache_max_flows': 128,
+            'other_config': {'enable-tunnel-sampling': 'true'},
+            'sampling': 64,
+            'targets': '10.0.0.1:4739',
+        },
+    },
+    'br-int': {
+        'ports': {'br-int'},
+        'ipfix': None,
+    },
+}
+
+
+class TestOVSDBState(CharmTestCase):
+
+    def setUp(self):
+        super(TestOVSDBState, self).setUp(neutron_ovs, TO_PATCH)
+
+    def test_decode_ovsdb_value(self):
+        self.assertEqual(neutron_ovs._decode_ovsdb_value(['uuid', 'u1']),
+                         'u1')
+        self.assertEqual(
+            neutron_ovs._decode_ovsdb_value(
+                ['set', [['uuid', 'u1'], ['uuid', 'u2']]]),
+            ['u1', 'u2'])
+        self.assertEqual(
+            neutron_ovs._decode_ovsdb_value(
+                ['map', [['a', ['uuid', 'u1']], ['b', 2]]]),
+            {'a': 'u1', 'b': 2})
+        self.assertEqual(neutron_ovs._decode_ovsdb_value('br-ex'), 'br-ex')
+
+    def test_get_ovsdb_state(self):
+        self.neutron_commands.check_output.return_value = (
+            OVSDB_JSON.encode('UTF-8'))
+        self.assertEqual(neutron_ovs.get_ovsdb_state(), OVSDB_STATE)
+        self.neutron_commands.check_output.assert_called_once_with(
+            ['ovs-vsctl', '-f', 'json',
+             '--', 'list', 'Bridge',
+             '--', 'list', 'Port',
+             '--', 'list', 'IPFIX'])
+
+    def test_get_ovsdb_state_set_of_targets(self):
+        self.neutron_commands.check_output.return_value = '\n'.join([
+            vsctl_json(['_uuid', 'ipfix', 'name', 'ports'], [
+                [['uuid', 'b1'], ['uuid', 'i1'], 'br-ex', ['set', []]],
+            ]),
+            vsctl_json(['_uuid', 'name'], []),
+            vsctl_json(['_uuid', 'targets'], [
+                [['uuid', 'i1'], ['set', ['10.0.0.1:4739',
+                                          '10.0.0.2:4739']]],
+            ]),
+        ]).encode('UTF-8')
+        self.assertEqual(
+            neutron_ovs.get_ovsdb_state(),
+            {'br-ex': {'ports': set(),
+                       'ipfix': {'_uuid': 'i1',
+                                 'targets': ['10.0.0.1:4739',
+                                             '10.0.0.2:4739']}}})
+
+
+class TestOVSTransaction(CharmTestCase):
+
+    def setUp(self):
+        super(TestOVSTransaction, self).setUp(neutron_ovs, TO_PATCH)
+        self.patch_object(neutron_ovs, '_get_link_flags')
+        self.flags = {}
+        self._get_link_flags.side_effect = self.flags.get
+
+    def test_vsctl_commands_noop(self):
+        txn = neutron_ovs.OVSTransaction()
+        txn.add_bridge('br-int')
+        txn.add_bridge('br-ex')
+        txn.add_bridge_port('br-ex', 'eth1', promisc=True)
+        txn.enable_ipfix('br-ex', '10.0.0.1:4739')
+        txn.disable_ipfix('br-int')
+        self.assertEqual(txn.vsctl_commands(OVSDB_STATE), [])
+
+    def test_vsctl_commands_new_bridge_and_port(self):
+        txn = neutron_ovs.OVSTransaction()
+        txn.add_bridge('br-data', brdata={'datapath-type': 'netdev'})
+        txn.add_bridge_port('br-data', 'eth2',
+                            ifdata={'type': 'dpdk'})
+        self.assertEqual(txn.vsctl_commands(OVSDB_STATE), [
+            '--', '--may-exist', 'add-br', 'br-data',
+            '--', 'set', 'bridge', 'br-data', 'datapath-type=netdev',
+            '--', '--may-exist', 'add-port', 'br-data', 'eth2',
+            '--', 'set', 'Interface', 'eth2', 'type=dpdk',
+        ])
+
+    def test_vsctl_commands_enable_ipfix(self):
+        txn = neutron_ovs.OVSTransaction()
+        txn.enable_ipfix('br-int', '10.0.0.1:4739')
+        self.assertEqual(txn.vsctl_commands(OVSDB_STATE), [
+            '--', 'set', 'Bridge', 'br-int', 'ipfix=@i0',
+            '--', '--id=@i0', 'create', 'IPFIX',
+            'targets="10.0.0.1:4739"',
+            'sampling=64',
+            'cache_active_timeout=60',
+            'cache_max_flows=128',
+        ])
+
+    def test_vsctl_commands_change_ipfix_target(self):
+        txn = neutron_ovs.OVSTransaction()
+        txn.enable_ipfix('br-ex', '10.0.0.2:4739')
+        cmd = txn.vsctl_commands(OVSDB_STATE)
+        self.assertEqual(cmd[:5], ['--', 'set', 'Bridge', 'br-ex',
+                                   'ipfix=@i0'])
+        self.assertIn('targets="10.0.0.2:4739"', cmd)
+
+    def test_vsctl_commands_disable_ipfix(self):
+        txn = neutron_ovs.OVSTransaction()
+        txn.disable_ipfix('br-ex')
+        self.assertEqual(txn.vsctl_commands(OVSDB_STATE),
+                         ['--', 'clear', 'Bridge', 'br-ex', 'ipfix'])
+
+    def test_link_commands(self):
+        self.flags.update({
+            'eth1': neutron_ovs.IFF_UP | neutron_ovs.IFF_PROMISC,
+            'eth2': 0,
+            'eth3': neutron_ovs.IFF_UP | neutron_ovs.IFF_PROMISC,
+        })
+        txn = neutron_ovs.OVSTransaction()
+        txn.add_bridge_port('br-ex', 'eth1', promisc=True)
+        txn.add_bridge_port('br-ex', 'eth2', promisc=True)
+        txn.add_bridge_port('br-ex', 'eth3')
+        txn.add_bridge_port('br-ex', 'eth4', promisc=None)
+        self.assertEqual(txn.link_commands(), [
+            'link set dev eth2 up promisc on',
+            'link set dev eth3 promisc off',
+            'link set dev eth4 up',
+        ])
+
+    @patch.object(neutron_ovs, 'get_ovsdb_state')
+    def test_commit_noop(self, get_ovsdb_state):
+        get_ovsdb_state.return_value = OVSDB_STATE
+        self.flags['eth1'] = neutron_ovs.IFF_UP | neutron_ovs.IFF_PROMISC
+        txn = neutron_ovs.OVSTransaction()
+        txn.add_bridge('br-ex')
+        txn.add_bridge_port('br-ex', 'eth1', promisc=True)
+        self.assertFalse(txn.commit())
+        self.assertFalse(self.neutron_commands.check_call.called)
+        self.assertFalse(self.neutron_commands.check_output.called)
+
+    @patch.object(neutron_ovs, 'get_ovsdb_state')
+    def test_commit(self, get_ovsdb_state):
+        get_ovsdb_state.return_value = OVSDB_STATE
+        txn = neutron_ovs.OVSTransaction()
+        txn.add_bridge('br-data')
+        txn.add_bridge_port('br-data', 'eth2', promisc=True)
+        self.assertTrue(txn.commit())
+        self.neutron_commands.check_call.assert_called_once_with([
+            'ovs-vsctl',
+            '--', '--may-exist', 'add-br', 'br-data',
+            '--', '--may-exist', 'add-port', 'br-data', 'eth2'])
+        self.neutron_commands.check_output.assert_called_once_with(
+            ['ip', '-force', '-batch', '-'],
+            input=b'link set dev eth2 up promisc on\n')
@@ -0,0 +1,145 @@
+import os
+import shutil
+import subprocess
+import tempfile
+
+import charmhelpers.fetch
+
+import neutron_packages
+
+from test_utils import CharmTestCase
+
+TO_PATCH = []
+
+DPKG_STATUS = '''\
+Package: neutron-common
+Status: install ok installed
+Priority: optional
+Architecture: all
+Version: 2:16.0.0-0ubuntu1
+Description: Neutron is a virtual network service for Openstack - common
+ Neutron is a virtual network service for Openstack.
+ Package: not-a-package
+
+Package: libc6
+Status: install ok installed
+Multi-Arch: same
+Architecture: amd64
+Version: 2.31-0ubuntu9
+
+Package: neutron-l3-agent
+Status: deinstall ok config-files
+Architecture: all
+Version: 2:16.0.0-0ubuntu1
+
+Package: openvswitch-switch
+Status: hold ok installed
+Architecture: amd64
+Version: 2.13.0-0ubuntu1
+'''
+
+
+class TestParseDpkgStatus(CharmTestCase):
+
+    def setUp(self):
+        super(TestParseDpkgStatus, self).setUp(neutron_packages, TO_PATCH)
+
+    def test_parse(self):
+        self.assertEqual(
+            neutron_packages._parse_dpkg_status(
+                DPKG_STATUS.splitlines(True)),
+            {'neutron-common': {'version': '2:16.0.0-0ubuntu1',
+                                'architecture': 'all'},
+             'libc6': {'version': '2.31-0ubuntu9',
+                       'architecture': 'amd64'},
+             'libc6:amd64': {'version': '2.31-0ubuntu9',
+                             'architecture': 'amd64'}})
+
+
+class TestDpkgStatusIndex(CharmTestCase):
+
+    def setUp(self):
+        super(TestDpkgStatusIndex, self).setUp(neutron_packages, TO_PATCH)
+        # neutron_packages imports fetch when it needs it
+        self.patch_object(charmhelpers, 'fetch')
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.status = os.path.join(self.tmpdir, 'status')
+        self.write_status(DPKG_STATUS)
+        self.index = neutron_packages.DpkgStatusIndex(self.status)
+        self.patch_object(neutron_packages, '_dpkg_status_index',
+                          new=self.index)
+        self.patch_object(
+            neutron_packages, '_parse_dpkg_status',
+            side_effect=neutron_packages._parse_dpkg_status)
+
+    def write_status(self, content):
+        # dpkg writes status-new and renames it into place
+        tmp_path = self.status + '-new'
+        with open(tmp_path, 'w') as f:
+            f.write(content)
+        os.rename(tmp_path, self.status)
+
+    def test_read_once(self):
+        self.assertEqual(
+            neutron_packages.filter_installed_packages(
+                ['neutron-common', 'neutron-l3-agent', 'libc6']),
+            ['neutron-l3-agent'])
+        self.assertEqual(
+            sorted(neutron_packages.filter_missing_packages(
+                ['neutron-common', 'neutron-l3-agent', 'libc6'])),
+            ['libc6', 'neutron-common'])
+        self.assertEqual(
+            neutron_packages.installed_version('neutron-common'),
+            '2:16.0.0-0ubuntu1')
+        self.assertIsNone(
+            neutron_packages.installed_version('neutron-l3-agent'))
+        self.assertEqual(self._parse_dpkg_status.call_count, 1)
+        self.assertFalse(self.fetch.filter_installed_packages.called)
+
+    def test_reread_when_replaced(self):
+        self.assertIsNone(
+            neutron_packages.installed_version('neutron-l3-agent'))
+        self.write_status(DPKG_STATUS.replace('deinstall ok config-files',
+                                              'install ok installed'))
+        self.assertEqual(
+            neutron_packages.installed_version('neutron-l3-agent'),
+            '2:16.0.0-0ubuntu1')
+        self.assertEqual(self._parse_dpkg_status.call_count, 2)
+
+    def test_unreadable(self):
+        os.unlink(self.status)
+        self.fetch.filter_installed_packages.return_value = ['libc6']
+        self.assertEqual(
+            neutron_packages.filter_installed_packages(['libc6']),
+            ['libc6'])
+        self.fetch.filter_installed_packages.assert_called_once_with(
+            ['libc6'])
+        self.assertIsNone(neutron_packages.installed_version('libc6'))
+
+    def test_apt_install_invalidates(self):
+        neutron_packages.filter_installed_packages(['libc6'])
+        neutron_packages.apt_install(['neutron-l3-agent'], fatal=True)
+        self.fetch.apt_install.assert_called_once_with(
+            ['neutron-l3-agent'], options=None, fatal=True)
+        neutron_packages.filter_installed_packages(['libc6'])
+        self.assertEqual(self._parse_dpkg_status.call_count, 2)
+
+    def test_apt_upgrade_invalidates(self):
+        neutron_packages.filter_installed_packages(['libc6'])
+        neutron_packages.apt_upgrade(options=['--foo'], fatal=True,
+                                     dist=True)
+        self.fetch.apt_upgrade.assert_called_once_with(
+            options=['--foo'], fatal=True, dist=True)
+        neutron_packages.filter_installed_packages(['libc6'])
+        self.assertEqual(self._parse_dpkg_status.call_count, 2)
+
+    def test_apt_purge_invalidates_on_failure(self):
+        neutron_packages.filter_installed_packages(['libc6'])
+        self.fetch.apt_purge.side_effect = \
+            subprocess.CalledProcessError(100, 'apt-get')
+        self.assertRaises(subprocess.CalledProcessError,
+                          neutron_packages.apt_purge, ['libc6'], fatal=True)
+        self.fetch.apt_purge.assert_called_once_with(['libc6'], fatal=True)
+        neutron_packages.filter_installed_packages(['libc6'])
+        self.assertEqual(self._parse_dpkg_status.call_count, 2)
@@ -0,0 +1,124 @@
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+
+import neutron_profiling
+
+from test_utils import CharmTestCase
+
+TO_PATCH = [
+    'local_unit',
+    'log',
+]
+
+
+class TestProfiling(CharmTestCase):
+
+    def setUp(self):
+        super(TestProfiling, self).setUp(neutron_profiling, TO_PATCH)
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.patch_object(neutron_profiling, 'REPORT_DIR', new=self.tmpdir)
+        self.patch_object(neutron_profiling, '_profiler', new=None)
+        self.local_unit.return_value = 'neutron-gateway/0'
+
+    def read_report(self, path):
+        self.assertEqual(
+            path, os.path.join(self.tmpdir, 'neutron-gateway-0',
+                               'config-changed.json'))
+        with open(path) as f:
+            return json.load(f)
+
+    def test_disabled(self):
+        with neutron_profiling.span('context', 'AMQPContext'):
+            pass
+        self.assertEqual(neutron_profiling.check_output(['echo', 'hi']),
+                         b'hi\n')
+        self.assertIsNone(neutron_profiling.finish())
+        self.assertEqual(os.listdir(self.tmpdir), [])
+        self.assertFalse(self.log.called)
+
+    def test_report(self):
+        popen = subprocess.Popen
+        neutron_profiling.enable('config-changed')
+        self.assertIs(subprocess.Popen, popen)
+        with neutron_profiling.span('hook', 'config-changed'):
+            with neutron_profiling.span('context', 'AMQPContext'):
+                pass
+            neutron_profiling.check_call(['true'])
+            self.assertEqual(neutron_profiling.call(['false']), 1)
+            self.assertRaises(subprocess.CalledProcessError,
+                              neutron_profiling.check_output,
+                              ['sh', '-c', 'exit 3'])
+            self.assertRaises(OSError, neutron_profiling.check_call,
+                              ['/nonexistent/service', 'ovs-vswitchd',
+                               'restart'])
+        path = neutron_profiling.finish()
+        self.assertIsNone(neutron_profiling.profiler())
+
+        report = self.read_report(path)
+        self.assertEqual(report['hook'], 'config-changed')
+        self.assertEqual(report['unit'], 'neutron-gateway/0')
+        spans = [(s['phase'], s['name']) for s in report['spans']]
+        self.assertEqual(spans, [
+            ('context', 'AMQPContext'),
+            ('subprocess', 'true'),
+            ('subprocess', 'false'),
+            ('subprocess', 'sh -c exit 3'),
+            ('service', '/nonexistent/service ovs-vswitchd restart'),
+            ('hook', 'config-changed'),
+        ])
+        self.assertEqual(report['spans'][1]['argv'], ['true'])
+        self.assertEqual(report['spans'][1]['returncode'], 0)
+        self.assertEqual(report['spans'][2]['returncode'], 1)
+        self.assertEqual(report['spans'][3]['returncode'], 3)
+        self.assertIsNone(report['spans'][4]['returncode'])
+        self.assertEqual(
+            {phase: t['count'] for phase, t in report['phases'].items()},
+            {'context': 1, 'subprocess': 3, 'service': 1, 'hook': 1})
+        hook = report['spans'][-1]
+        for entry in report['spans'][:-1]:
+            self.assertGreaterEqual(entry['offset'], hook['offset'])
+            self.assertLessEqual(entry['duration'], hook['duration'])
+        self.assertGreaterEqual(report['duration'], hook['duration'])
+
+        summary = self.log.call_args[0][0]
+        self.assertTrue(summary.startswith('Hook profile config-changed: '))
+        self.assertIn('subprocess 3x', summary)
+        self.assertNotIn('slowest: config-changed', summary)
+
+    def test_report_replaced(self):
+        neutron_profiling.enable('config-changed')
+        with neutron_profiling.span('context', 'AMQPContext'):
+            pass
+        neutron_profiling.finish()
+        neutron_profiling.enable('config-changed')
+        path = neutron_profiling.finish()
+        report = self.read_report(path)
+        self.assertEqual(report['spans'], [])
+        self.assertEqual(report['phases'], {})
+        self.assertIn('no spans', self.log.call_args[0][0])
+
+    def test_report_not_written(self):
+        self.patch_object(neutron_profiling, 'REPORT_DIR',
+                          new=os.path.join(self.tmpdir, 'file'))
+        with open(neutron_profiling.REPORT_DIR, 'w'):
+            pass
+        neutron_profiling.enable('config-changed')
+        self.assertIsNone(neutron_profiling.finish())
+        self.assertEqual(self.log.call_args_list[0][1],
+                         {'level': neutron_profiling.WARNING})
+        self.assertEqual(self.log.call_args_list[1][1],
+                         {'level': neutron_profiling.INFO})
+
+    def test_subprocess_phase(self):
+        self.assertEqual(neutron_profiling.subprocess_phase(
+            ['/usr/bin/ovs-vsctl', 'list-br']), 'ovs')
+        self.assertEqual(neutron_profiling.subprocess_phase(
+            ['sudo', 'apt-get', 'install']), 'apt')
+        self.assertEqual(neutron_profiling.subprocess_phase(
+            'neutron-ovs-cleanup'), 'subprocess')
+        self.assertEqual(neutron_profiling.subprocess_phase([]),
+                         'subprocess')
@@ -0,0 +1,200 @@
+import types
+
+import neutron_relations
+
+from test_utils import CharmTestCase
+
+TO_PATCH = [
+    'hookenv',
+]
+
+RELATION_IDS = {
+    'amqp': ['amqp:1'],
+    'quantum-network-service': ['quantum-network-service:2'],
+}
+
+RELATED_UNITS = {
+    'amqp:1': ['rabbitmq-server/0', 'rabbitmq-server/1'],
+    'quantum-network-service:2': ['nova-cloud-controller/0'],
+}
+
+SETTINGS = {
+    ('amqp:1', 'rabbitmq-server/0'): {'hostname': '10.0.0.1',
+                                      'password': 'foo'},
+    ('amqp:1', 'rabbitmq-server/1'): {'hostname': '10.0.0.2',
+                                      'password': 'foo'},
+    ('quantum-network-service:2', 'nova-cloud-controller/0'): {
+        'ca_cert': 'Y2VydA=='},
+    ('amqp:1', 'neutron-gateway/0'): {'username': 'neutron'},
+}
+
+
+class TestRelationSnapshot(CharmTestCase):
+
+    def setUp(self):
+        super(TestRelationSnapshot, self).setUp(neutron_relations, TO_PATCH)
+        self.patch_object(neutron_relations, '_snapshot', new=None)
+        self.hookenv.relation_ids.side_effect = \
+            lambda reltype: list(RELATION_IDS.get(reltype, []))
+        self.hookenv.related_units.side_effect = \
+            lambda rid: list(RELATED_UNITS.get(rid, []))
+        self.hookenv.relation_get.side_effect = \
+            lambda rid, unit: (dict(SETTINGS[(rid, unit)])
+                               if (rid, unit) in SETTINGS else None)
+        self.hookenv.relation_type.return_value = None
+        self.hookenv.relation_id.return_value = None
+        self.hookenv.remote_unit.return_value = None
+        self.hookenv.local_unit.return_value = 'neutron-gateway/0'
+
+    def test_nothing_loaded_up_front(self):
+        snapshot = neutron_relations.relation_snapshot()
+        self.assertEqual(snapshot.tool_calls, 0)
+        self.assertFalse(self.hookenv.relation_ids.called)
+        self.assertFalse(self.hookenv.related_units.called)
+        self.assertFalse(self.hookenv.relation_get.called)
+
+    def test_relation_walk_miss_then_hit(self):
+        def walk():
+            return {unit: neutron_relations.relation_get(rid=rid, unit=unit)
+                    for rid in neutron_relations.relation_ids('amqp')
+                    for unit in neutron_relations.related_units(rid)}
+
+        expected = {
+            'rabbitmq-server/0': {'hostname': '10.0.0.1', 'password': 'foo'},
+            'rabbitmq-server/1': {'hostname': '10.0.0.2', 'password': 'foo'},
+        }
+        self.assertEqual(walk(), expected)
+        snapshot = neutron_relations.relation_snapshot()
+        self.assertEqual(snapshot.tool_calls, 4)
+        self.assertEqual(snapshot.hits, 0)
+        self.assertEqual(walk(), expected)
+        self.assertEqual(snapshot.tool_calls, 4)
+        self.assertEqual(snapshot.hits, 4)
+        # hookenv would have served the same questions from its own memo
+        self.assertEqual(snapshot.calls_saved, 0)
+        self.hookenv.relation_ids.assert_called_once_with('amqp')
+        self.hookenv.related_units.assert_called_once_with('amqp:1')
+        self.assertEqual(self.hookenv.relation_get.call_count, 2)
+
+    def test_attributes_share_one_relation_get(self):
+        self.hookenv.relation_id.return_value = 'quantum-network-service:2'
+        self.hookenv.remote_unit.return_value = 'nova-cloud-controller/0'
+        self.assertEqual(neutron_relations.relation_get('ca_cert'),
+                         'Y2VydA==')
+        self.assertEqual(neutron_relations.relation_get('restart_trigger'),
+                         None)
+        self.hookenv.relation_get.assert_called_once_with(
+            rid='quantum-network-service:2', unit='nova-cloud-controller/0')
+        snapshot = neutron_relations.relation_snapshot()
+        self.assertEqual((snapshot.tool_calls, snapshot.hits), (1, 1))
+        self.assertEqual(snapshot.calls_saved, 1)
+        neutron_relations.relation_get('restart_trigger')
+        self.assertEqual((snapshot.hits, snapshot.calls_saved), (2, 1))
+
+    def test_relation_get_returns_copy(self):
+        settings = neutron_relations.relation_get(rid='amqp:1',
+                                                  unit='rabbitmq-server/0')
+        settings['hostname'] = 'changed'
+        self.assertEqual(
+            neutron_relations.relation_get('hostname', rid='amqp:1',
+                                           unit='rabbitmq-server/0'),
+            '10.0.0.1')
+
+    def test_relation_get_unreadable_not_cached(self):
+        self.assertEqual(
+            neutron_relations.relation_get(rid='amqp:1',
+                                           unit='rabbitmq-server/9'),
+            None)
+        self.assertEqual(
+            neutron_relations.relation_get('hostname', rid='amqp:1',
+                                           unit='rabbitmq-server/9'),
+            None)
+        self.assertEqual(self.hookenv.relation_get.call_count, 2)
+
+    def test_relation_get_outside_relation_hook(self):
+        self.hookenv.relation_get.side_effect = None
+        self.hookenv.relation_get.return_value = 'value'
+        self.assertEqual(neutron_relations.relation_get('key'), 'value')
+        self.hookenv.relation_get.assert_called_once_with(
+            attribute='key', unit=None, rid=None)
+
+    def test_relation_ids_defaults_to_current_type(self):
+        self.hookenv.relation_type.return_value = 'amqp'
+        self.assertEqual(neutron_relations.relation_ids(), ['amqp:1'])
+        self.hookenv.relation_type.return_value = None
+        self.assertEqual(neutron_relations.relation_ids(), [])
+
+    def test_relation_set_invalidates_local_unit(self):
+        local = ('amqp:1', 'neutron-gateway/0')
+        remote = ('amqp:1', 'rabbitmq-server/0')
+        self.assertEqual(
+            neutron_relations.relation_get(rid=local[0], unit=local[1]),
+            {'username': 'neutron'})
+        neutron_relations.relation_get(rid=remote[0], unit=remote[1])
+        SETTINGS[local] = {'username': 'neutron', 'vhost': 'openstack'}
+        self.addCleanup(SETTINGS.__setitem__, local,
+                        {'username': 'neutron'})
+        neutron_relations.relation_set(relation_id='amqp:1',
+                                       vhost='openstack')
+        self.hookenv.relation_set.assert_called_once_with(
+            relation_id='amqp:1', relation_settings=None, vhost='openstack')
+        self.assertEqual(
+            neutron_relations.relation_get(rid=local[0], unit=local[1]),
+            {'username': 'neutron', 'vhost': 'openstack'})
+        # settings of remote units are unaffected
+        neutron_relations.relation_get(rid=remote[0], unit=remote[1])
+        self.assertEqual(self.hookenv.relation_get.call_count, 3)
+
+    def test_relation_set_current_relation(self):
+        self.hookenv.relation_id.return_value = 'amqp:1'
+        neutron_relations.relation_get(rid='amqp:1',
+                                       unit='neutron-gateway/0')
+        neutron_relations.relation_set(username='neutron')
+        neutron_relations.relation_get(rid='amqp:1',
+                                       unit='neutron-gateway/0')
+        self.assertEqual(self.hookenv.relation_get.call_count, 2)
+
+    def test_invalidate(self):
+        snapshot = neutron_relations.relation_snapshot()
+        for rid, unit in SETTINGS:
+            snapshot.settings(rid, unit)
+        snapshot.invalidate(rid='amqp:1')
+        self.assertEqual(
+            list(snapshot._settings),
+            [('quantum-network-service:2', 'nova-cloud-controller/0')])
+        snapshot.invalidate()
+        self.assertEqual(snapshot._settings, {})
+
+    def test_relation_set_forgets_local_questions(self):
+        snapshot = neutron_relations.relation_snapshot()
+        neutron_relations.relation_get('username', rid='amqp:1',
+                                       unit='neutron-gateway/0')
+        neutron_relations.relation_get('username', rid='amqp:1',
+                                       unit='rabbitmq-server/0')
+        neutron_relations.relation_set(relation_id='amqp:1', vhost='os')
+        neutron_relations.relation_get('username', rid='amqp:1',
+                                       unit='rabbitmq-server/0')
+        self.assertEqual(snapshot.calls_saved, 0)
+        neutron_relations.relation_get('vhost', rid='amqp:1',
+                                       unit='neutron-gateway/0')
+        self.assertEqual(snapshot.tool_calls, 3)
+        self.assertEqual(snapshot.calls_saved, 0)
+        neutron_relations.relation_get('username', rid='amqp:1',
+                                       unit='neutron-gateway/0')
+        self.assertEqual(snapshot.calls_saved, 1)
+
+    def test_snapshot_relations(self):
+        helpers = {name: object()
+                   for name in neutron_relations.RELATION_HELPERS}
+        module = types.SimpleNamespace(**helpers)
+        with neutron_relations.snapshot_relations(module):
+            self.assertEqual(module.relation_ids('amqp'), ['amqp:1'])
+            self.assertEqual(module.related_units('amqp:1'),
+                             RELATED_UNITS['amqp:1'])
+            self.assertEqual(
+                module.relation_get('hostname', rid='amqp:1',
+                                    unit='rabbitmq-server/1'),
+                '10.0.0.2')
+        for name, helper in helpers.items():
+            self.assertIs(getattr(module, name), helper)
+        self.assertEqual(neutron_relations.relation_snapshot().tool_calls, 3)
@@ -0,0 +1,115 @@
+import os
+import shutil
+import tempfile
+
+from charmhelpers.core import unitdata
+
+import neutron_release
+
+from test_utils import CharmTestCase
+
+TO_PATCH = [
+    'installed_version',
+    'kv',
+]
+
+
+class TestOSRelease(CharmTestCase):
+
+    def setUp(self):
+        super(TestOSRelease, self).setUp(neutron_release, TO_PATCH)
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.status = os.path.join(self.tmpdir, 'status')
+        self.touch_status(1000)
+        self.patch_object(neutron_release, 'DPKG_STATUS', new=self.status)
+        self.db = unitdata.Storage(':memory:')
+        self.kv.return_value = self.db
+        self.patch_object(neutron_release.ch_utils, '_os_rel', new=None)
+        self.patch_object(neutron_release.ch_utils, 'snap_install_requested',
+                          return_value=False)
+        self.patch_object(neutron_release.ch_utils, 'get_os_codename_package',
+                          return_value='ussuri')
+        self.patch_object(neutron_release.ch_utils, 'os_release',
+                          name='ch_os_release', return_value='queens')
+        self.installed_version.return_value = '2:16.0.0-0ubuntu1'
+
+    def touch_status(self, mtime):
+        with open(self.status, 'w'):
+            pass
+        os.utime(self.status, (mtime, mtime))
+
+    def new_hook(self):
+        neutron_release.ch_utils._os_rel = None
+
+    def test_persisted(self):
+        self.assertEqual(neutron_release.os_release('neutron-common'),
+                         'ussuri')
+        self.assertEqual(neutron_release.ch_utils._os_rel, 'ussuri')
+        self.assertEqual(self.db.get(neutron_release.OS_RELEASE_KEY), {
+            'neutron-common': {'mtime': 1000,
+                               'version': '2:16.0.0-0ubuntu1',
+                               'release': 'ussuri'}})
+        self.new_hook()
+        self.installed_version.reset_mock()
+        self.get_os_codename_package.reset_mock()
+        self.assertEqual(neutron_release.os_release('neutron-common'),
+                         'ussuri')
+        self.assertEqual(neutron_release.ch_utils._os_rel, 'ussuri')
+        self.assertFalse(self.installed_version.called)
+        self.assertFalse(self.get_os_codename_package.called)
+        self.assertFalse(self.ch_os_release.called)
+
+    def test_dpkg_status_changed_same_version(self):
+        neutron_release.os_release('neutron-common')
+        self.new_hook()
+        self.touch_status(2000)
+        self.get_os_codename_package.reset_mock()
+        self.assertEqual(neutron_release.os_release('neutron-common'),
+                         'ussuri')
+        self.assertFalse(self.get_os_codename_package.called)
+        self.assertEqual(
+            self.db.get(neutron_release.OS_RELEASE_KEY)
+            ['neutron-common']['mtime'], 2000)
+
+    def test_version_changed(self):
+        neutron_release.os_release('neutron-common')
+        self.new_hook()
+        self.touch_status(2000)
+        self.installed_version.return_value = '2:17.0.0-0ubuntu1'
+        self.get_os_codename_package.return_value = 'victoria'
+        self.assertEqual(neutron_release.os_release('neutron-common'),
+                         'victoria')
+        self.assertEqual(
+            self.db.get(neutron_release.OS_RELEASE_KEY)['neutron-common'],
+            {'mtime': 2000, 'version': '2:17.0.0-0ubuntu1',
+             'release': 'victoria'})
+
+    def test_not_from_package(self):
+        self.get_os_codename_package.return_value = None
+        self.installed_version.return_value = None
+        self.assertEqual(
+            neutron_release.os_release('neutron-common', base='icehouse'),
+            'queens')
+        self.ch_os_release.assert_called_once_with(
+            'neutron-common', base='icehouse', source_key=None)
+        self.assertIsNone(self.db.get(neutron_release.OS_RELEASE_KEY))
+
+    def test_snap_not_persisted(self):
+        self.snap_install_requested.return_value = True
+        self.assertEqual(neutron_release.os_release('neutron-common'),
+                         'queens')
+        self.assertFalse(self.get_os_codename_package.called)
+        self.assertIsNone(self.db.get(neutron_release.OS_RELEASE_KEY))
+
+    def test_reset_os_release(self):
+        neutron_release.os_release('neutron-common')
+        self.patch_object(neutron_release.ch_utils, 'reset_os_release')
+        neutron_release.reset_os_release()
+        self.reset_os_release.assert_called_once_with()
+        self.assertIsNone(self.db.get(neutron_release.OS_RELEASE_KEY))
+        self.new_hook()
+        self.get_os_codename_package.reset_mock()
+        neutron_release.os_release('neutron-common')
+        self.get_os_codename_package.assert_called_once_with(
+            'neutron-common', fatal=False)
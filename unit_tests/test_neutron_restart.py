@@ -0,0 +1,200 @@
+import os
+import shutil
+import tempfile
+
+from mock import MagicMock, call
+
+import neutron_restart
+
+from test_utils import CharmTestCase
+
+TO_PATCH = [
+    'kv',
+    'neutron_commands',
+    'service',
+    'is_unit_paused_set',
+]
+
+
+class FakeRenderer(object):
+
+    def __init__(self, templates):
+        self.templates = dict.fromkeys(templates)
+        self.written = []
+
+    def write(self, config_file):
+        self.written.append(config_file)
+
+
+class TestPathDigestIndex(CharmTestCase):
+
+    def setUp(self):
+        super(TestPathDigestIndex, self).setUp(neutron_restart, TO_PATCH)
+        self.kv.return_value.get.return_value = None
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.path = os.path.join(self.tmp, 'profile')
+        with open(self.path, 'w') as f:
+            f.write('profile')
+        self.patch_object(neutron_restart, 'file_hash',
+                          wraps=neutron_restart.file_hash)
+
+    def test_digest_served_from_index(self):
+        index = neutron_restart.PathDigestIndex()
+        digest = index.digest(self.path)
+        self.assertEqual(index.digest(self.path), digest)
+        self.file_hash.assert_called_once_with(self.path, 'md5')
+
+    def test_digest_changed_file(self):
+        index = neutron_restart.PathDigestIndex()
+        digest = index.digest(self.path)
+        with open(self.path, 'w') as f:
+            f.write('changed profile')
+        self.assertNotEqual(index.digest(self.path), digest)
+        self.assertEqual(self.file_hash.call_count, 2)
+
+    def test_digest_missing_file(self):
+        index = neutron_restart.PathDigestIndex()
+        index.digest(self.path)
+        os.unlink(self.path)
+        self.assertIsNone(index.digest(self.path))
+        self.assertNotIn(self.path, index.index)
+
+    def test_path_hash(self):
+        index = neutron_restart.PathDigestIndex()
+        self.assertEqual(
+            index.path_hash(os.path.join(self.tmp, '*')),
+            {self.path: neutron_restart.file_hash(self.path)})
+
+    def test_loaded_from_unitdata(self):
+        st = os.stat(self.path)
+        self.kv.return_value.get.return_value = {
+            self.path: [[st.st_mtime, st.st_ctime, st.st_size, st.st_ino],
+                        'stored-digest']}
+        index = neutron_restart.PathDigestIndex()
+        self.assertEqual(index.digest(self.path), 'stored-digest')
+        self.assertFalse(self.file_hash.called)
+        self.kv.return_value.get.assert_called_once_with('path-digests')
+
+    def test_save_only_when_changed(self):
+        index = neutron_restart.PathDigestIndex()
+        index.save()
+        self.assertFalse(self.kv.return_value.set.called)
+        index.digest(self.path)
+        index.save()
+        self.kv.return_value.set.assert_called_once_with('path-digests',
+                                                         index.index)
+        self.assertFalse(self.kv.return_value.flush.called)
+        index.save()
+        self.assertEqual(self.kv.return_value.set.call_count, 1)
+
+
+class TestRestartOnChange(CharmTestCase):
+
+    def setUp(self):
+        super(TestRestartOnChange, self).setUp(neutron_restart, TO_PATCH)
+        self.kv.return_value.get.return_value = None
+        self.patch_object(neutron_restart, '_path_digest_index', new=None)
+        self.is_unit_paused_set.return_value = False
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.profile = os.path.join(self.tmp, 'profile')
+        with open(self.profile, 'w') as f:
+            f.write('profile')
+        self.configs = FakeRenderer(['/etc/neutron/neutron.conf',
+                                     '/etc/neutron/l3_agent.ini'])
+        self.restart_map = {
+            '/etc/neutron/neutron.conf': ['neutron-l3-agent',
+                                          'neutron-dhcp-agent'],
+            '/etc/neutron/l3_agent.ini': ['neutron-l3-agent'],
+            self.profile: ['neutron-dhcp-agent'],
+        }
+        self.patch_object(neutron_restart, 'file_hash',
+                          wraps=neutron_restart.file_hash)
+
+    def helper(self, f, **kwargs):
+        return neutron_restart.restart_on_change_helper(
+            f, self.restart_map, self.configs, **kwargs)
+
+    def test_written_config_files_restart(self):
+        def f():
+            self.configs.write('/etc/neutron/l3_agent.ini')
+            return 'result'
+
+        self.assertEqual(self.helper(f), 'result')
+        self.service.assert_called_once_with('restart', 'neutron-l3-agent')
+        self.neutron_commands.invalidate.assert_called_once_with('ovs',
+                                                                 'service')
+        # rendered config files are never hashed
+        self.file_hash.assert_called_once_with(self.profile, 'md5')
+
+    def test_nothing_changed(self):
+        self.configs.write('/etc/neutron/neutron.conf')
+        self.helper(lambda: None)
+        self.assertFalse(self.service.called)
+        self.assertFalse(self.neutron_commands.invalidate.called)
+
+    def test_other_path_changed(self):
+        def f():
+            with open(self.profile, 'w') as f:
+                f.write('changed profile')
+
+        self.helper(f)
+        self.service.assert_called_once_with('restart', 'neutron-dhcp-agent')
+
+    def test_ordered_services_restarted_once(self):
+        def f():
+            self.configs.write('/etc/neutron/neutron.conf')
+            self.configs.write('/etc/neutron/l3_agent.ini')
+            with open(self.profile, 'w') as f:
+                f.write('changed profile')
+
+        self.helper(f, stopstart=True)
+        self.service.assert_has_calls([
+            call('stop', 'neutron-l3-agent'),
+            call('start', 'neutron-l3-agent'),
+            call('stop', 'neutron-dhcp-agent'),
+            call('start', 'neutron-dhcp-agent'),
+        ])
+        self.assertEqual(self.service.call_count, 4)
+
+    def test_restart_functions(self):
+        restart_l3 = MagicMock()
+        self.helper(lambda: self.configs.write('/etc/neutron/l3_agent.ini'),
+                    restart_functions={'neutron-l3-agent': restart_l3})
+        restart_l3.assert_called_once_with('neutron-l3-agent')
+        self.assertFalse(self.service.called)
+
+    def test_index_saved(self):
+        self.helper(lambda: None)
+        self.kv.return_value.set.assert_called_once_with(
+            'path-digests', neutron_restart.path_digest_index().index)
+
+    def test_decorator_resolves_lazily(self):
+        restart_map = MagicMock(return_value=self.restart_map)
+        configs = MagicMock(return_value=self.configs)
+
+        @neutron_restart.restart_on_change(restart_map, configs)
+        def hook():
+            self.configs.write('/etc/neutron/l3_agent.ini')
+
+        self.assertFalse(restart_map.called)
+        hook()
+        hook()
+        restart_map.assert_called_once_with()
+        configs.assert_called_once_with()
+        self.service.assert_has_calls(
+            [call('restart', 'neutron-l3-agent')] * 2)
+
+    def test_decorator_paused(self):
+        self.is_unit_paused_set.return_value = True
+        restart_map = MagicMock(return_value=self.restart_map)
+
+        @neutron_restart.restart_on_change(restart_map, self.configs)
+        def hook():
+            self.configs.write('/etc/neutron/l3_agent.ini')
+            return 'result'
+
+        self.assertEqual(hook(), 'result')
+        self.assertFalse(restart_map.called)
+        self.assertFalse(self.service.called)
@@ -0,0 +1,234 @@
+import os
+import shutil
+import tempfile
+
+import neutron_templating
+
+from test_utils import CharmTestCase
+
+TO_PATCH = [
+    'log',
+]
+
+
+class FakeContext(object):
+
+    interfaces = ['fake']
+
+    def __init__(self, rel_name='amqp', value='foo'):
+        self.rel_name = rel_name
+        self.value = value
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        self.complete = True
+        self.related = True
+        self.scratch = self.calls
+        return {self.rel_name: self.value}
+
+
+class OtherContext(FakeContext):
+    pass
+
+
+SHARED_CONTEXTS = {
+    FakeContext: ('rel_name',),
+}
+
+
+class TestContextCacheKey(CharmTestCase):
+
+    def setUp(self):
+        super(TestContextCacheKey, self).setUp(neutron_templating, TO_PATCH)
+
+    def test_equivalent_instances_share_key(self):
+        self.assertEqual(
+            neutron_templating.context_cache_key(FakeContext(),
+                                                 SHARED_CONTEXTS),
+            neutron_templating.context_cache_key(FakeContext(value='bar'),
+                                                 SHARED_CONTEXTS))
+
+    def test_arguments_tell_instances_apart(self):
+        self.assertEqual(
+            neutron_templating.context_cache_key(FakeContext('amqp-nova'),
+                                                 SHARED_CONTEXTS),
+            (FakeContext, 'amqp-nova'))
+        self.assertNotEqual(
+            neutron_templating.context_cache_key(FakeContext('amqp'),
+                                                 SHARED_CONTEXTS),
+            neutron_templating.context_cache_key(FakeContext('amqp-nova'),
+                                                 SHARED_CONTEXTS))
+
+    def test_unregistered_class(self):
+        self.assertIsNone(
+            neutron_templating.context_cache_key(OtherContext(),
+                                                 SHARED_CONTEXTS))
+
+
+class TestContextCache(CharmTestCase):
+
+    def setUp(self):
+        super(TestContextCache, self).setUp(neutron_templating, TO_PATCH)
+
+    def test_equivalent_contexts_evaluated_once(self):
+        cache = neutron_templating.ContextCache(SHARED_CONTEXTS)
+        first, second = FakeContext(), FakeContext()
+        self.assertEqual(cache(first), {'amqp': 'foo'})
+        self.assertEqual(cache(second), {'amqp': 'foo'})
+        self.assertEqual(cache(first), {'amqp': 'foo'})
+        self.assertEqual((first.calls, second.calls), (1, 0))
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+    def test_only_state_attributes_copied(self):
+        cache = neutron_templating.ContextCache(SHARED_CONTEXTS)
+        first, second = FakeContext(), FakeContext()
+        cache(first)
+        cache(second)
+        self.assertTrue(second.complete)
+        self.assertTrue(second.related)
+        self.assertFalse(hasattr(second, 'missing_data'))
+        self.assertFalse(hasattr(second, 'scratch'))
+        self.assertEqual(second.calls, 0)
+
+    def test_different_arguments_evaluated_separately(self):
+        cache = neutron_templating.ContextCache(SHARED_CONTEXTS)
+        self.assertEqual(cache(FakeContext('amqp')), {'amqp': 'foo'})
+        self.assertEqual(cache(FakeContext('amqp-nova', 'bar')),
+                         {'amqp-nova': 'bar'})
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+
+    def test_unregistered_contexts_not_cached(self):
+        cache = neutron_templating.ContextCache(SHARED_CONTEXTS)
+        ctxt = OtherContext()
+        cache(ctxt)
+        cache(ctxt)
+        self.assertEqual(ctxt.calls, 2)
+        self.assertEqual((cache.hits, cache.misses), (0, 0))
+
+
+class TestOSConfigRenderer(CharmTestCase):
+
+    def setUp(self):
+        super(TestOSConfigRenderer, self).setUp(neutron_templating, TO_PATCH)
+        self.templates_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.templates_dir)
+        for name in ('a.conf', 'b.conf'):
+            with open(os.path.join(self.templates_dir, name), 'w') as f:
+                f.write('{{ amqp }}\n')
+        self.renderer = neutron_templating.OSConfigRenderer(
+            templates_dir=self.templates_dir, openstack_release='ussuri',
+            shared_contexts=SHARED_CONTEXTS)
+        self.contexts = [FakeContext(), FakeContext()]
+        self.renderer.register('/etc/a.conf', [self.contexts[0]])
+        self.renderer.register('/etc/b.conf', [self.contexts[1]])
+
+    def test_complete_contexts_shares_results(self):
+        self.assertEqual(self.renderer.complete_contexts(), ['fake', 'fake'])
+        self.assertEqual([c.calls for c in self.contexts], [1, 0])
+        for ostmpl in self.renderer.templates.values():
+            self.assertIsNone(ostmpl.cache)
+
+    def test_write_all_shares_results(self):
+        rendered = {}
+
+        def write(config_file):
+            rendered[config_file] = self.renderer.render(config_file)
+
+        self.patch_object(self.renderer, 'write', side_effect=write)
+        self.renderer.write_all()
+        self.assertEqual(rendered, {'/etc/a.conf': 'foo',
+                                    '/etc/b.conf': 'foo'})
+        self.assertEqual([c.calls for c in self.contexts], [1, 0])
+        self.assertIsNone(self.renderer._context_cache)
+        self.log.assert_called_with('Context cache: 1 hits, 1 misses',
+                                    level=neutron_templating.DEBUG)
+
+    def test_not_cached_outside_write_all(self):
+        self.renderer.render('/etc/a.conf')
+        self.renderer.render('/etc/a.conf')
+        self.assertEqual(self.contexts[0].calls, 2)
+
+
+class TestOSConfigRendererWrite(CharmTestCase):
+
+    def setUp(self):
+        super(TestOSConfigRendererWrite, self).setUp(neutron_templating,
+                                                     TO_PATCH)
+        self.templates_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.templates_dir)
+        self.etc_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.etc_dir)
+        with open(os.path.join(self.templates_dir, 'a.conf'), 'w') as f:
+            f.write('{{ amqp }}\n')
+        self.config_file = os.path.join(self.etc_dir, 'a.conf')
+        self.renderer = neutron_templating.OSConfigRenderer(
+            templates_dir=self.templates_dir, openstack_release='ussuri')
+        self.context = FakeContext()
+        self.renderer.register(self.config_file, [self.context])
+
+    def read(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def test_write_new_file(self):
+        self.assertTrue(self.renderer.write(self.config_file))
+        self.assertEqual(self.read(self.config_file), 'foo')
+        self.assertEqual(os.listdir(self.etc_dir), ['a.conf'])
+
+    def test_write_unchanged(self):
+        with open(self.config_file, 'w') as f:
+            f.write('foo')
+        os.chmod(self.config_file, 0o640)
+        st = os.stat(self.config_file)
+        self.assertFalse(self.renderer.write(self.config_file))
+        self.assertEqual(os.stat(self.config_file), st)
+
+    def test_write_changed(self):
+        with open(self.config_file, 'w') as f:
+            f.write('bar')
+        os.chmod(self.config_file, 0o640)
+        ino = os.stat(self.config_file).st_ino
+        self.assertTrue(self.renderer.write(self.config_file))
+        self.assertEqual(self.read(self.config_file), 'foo')
+        st = os.stat(self.config_file)
+        self.assertEqual(st.st_mode & 0o7777, 0o640)
+        self.assertNotEqual(st.st_ino, ino)
+        self.assertEqual(os.listdir(self.etc_dir), ['a.conf'])
+
+    def test_write_symlink_target(self):
+        target_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, target_dir)
+        target = os.path.join(target_dir, 'a.conf')
+        with open(target, 'w') as f:
+            f.write('bar')
+        os.symlink(target, self.config_file)
+        self.assertTrue(self.renderer.write(self.config_file))
+        self.assertTrue(os.path.islink(self.config_file))
+        self.assertEqual(self.read(target), 'foo')
+        self.assertEqual(os.listdir(target_dir), ['a.conf'])
+        self.assertFalse(self.renderer.write(self.config_file))
+
+    def test_write_failure_removes_temp_file(self):
+        with open(self.config_file, 'w') as f:
+            f.write('bar')
+        self.patch_object(neutron_templating.os, 'rename',
+                          side_effect=OSError('rename failed'))
+        self.assertRaises(OSError, self.renderer.write, self.config_file)
+        self.assertEqual(os.listdir(self.etc_dir), ['a.conf'])
+        self.assertEqual(self.read(self.config_file), 'bar')
+
+    def test_write_not_registered(self):
+        self.assertRaises(neutron_templating.templating.OSConfigException,
+                          self.renderer.write, '/etc/unknown.conf')
+
+    def test_write_all_returns_changed(self):
+        other_file = os.path.join(self.etc_dir, 'b.conf')
+        with open(os.path.join(self.templates_dir, 'b.conf'), 'w') as f:
+            f.write('{{ amqp }}\n')
+        self.renderer.register(other_file, [FakeContext()])
+        with open(other_file, 'w') as f:
+            f.write('foo')
+        self.assertEqual(self.renderer.write_all(), {self.config_file})
+        self.assertEqual(self.renderer.write_all(), set())
+        self.assertEqual(self.renderer.written, [self.config_file])
@@ -0,0 +1,143 @@
+import os
+import shutil
+import tempfile
+
+from mock import patch
+
+from charmhelpers.core import unitdata
+
+import neutron_unitdata
+
+from test_utils import CharmTestCase
+
+TO_PATCH = [
+    'hookenv',
+]
+
+
+class TestStorage(CharmTestCase):
+
+    def setUp(self):
+        super(TestStorage, self).setUp(neutron_unitdata, TO_PATCH)
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.path = os.path.join(self.tmpdir, '.unit-state.db')
+        self.db = self.open()
+
+    def open(self):
+        db = neutron_unitdata.Storage(self.path)
+        self.addCleanup(db.close)
+        return db
+
+    def test_read_your_writes(self):
+        self.db.set('a', {'b': 1})
+        self.db.set('a.c', [1, 2])
+        self.assertEqual(self.db.get('a'), {'b': 1})
+        self.assertEqual(self.db.get('a', record=True).b, 1)
+        self.assertEqual(self.db.getrange('a.'), {'a.c': [1, 2]})
+        self.assertEqual(self.db.getrange('a.', strip=True), {'c': [1, 2]})
+        self.db.unset('a')
+        self.assertIsNone(self.db.get('a'))
+        self.assertEqual(self.db.get('a', default=0), 0)
+        # nothing was written to the database yet
+        self.assertIsNone(self.open().get('a.c'))
+
+    def test_flush(self):
+        self.db.set('a', 1)
+        self.db.set('b', 2)
+        self.db.flush()
+        self.db.unset('a')
+        self.db.set('b', 3)
+        self.db.flush()
+        db = self.open()
+        self.assertIsNone(db.get('a'))
+        self.assertEqual(db.get('b'), 3)
+
+    def test_flush_without_save(self):
+        self.db.set('a', 1)
+        self.db.flush()
+        self.db.set('a', 2)
+        self.db.set('b', 2)
+        self.db.flush(save=False)
+        self.assertEqual(self.db.get('a'), 1)
+        self.assertIsNone(self.db.get('b'))
+        self.db.flush()
+        self.assertEqual(self.open().get('a'), 1)
+
+    def test_unsetrange(self):
+        for key in ('x.1', 'x.2', 'y.1', 'y.2'):
+            self.db.set(key, key)
+        self.db.flush()
+        self.db.unsetrange(['1', '3'], prefix='x.')
+        self.assertEqual(self.db.getrange('x.'), {'x.2': 'x.2'})
+        self.db.unsetrange(prefix='y.')
+        self.assertEqual(self.db.getrange('y.'), {})
+        self.db.flush()
+        self.assertEqual(self.open().getrange(''), {'x.2': 'x.2'})
+
+    def test_delta(self):
+        self.db.set('conf.a', 1)
+        self.db.set('conf.b', 2)
+        delta = self.db.delta({'a': 1, 'b': 3, 'c': 4}, 'conf.')
+        self.assertEqual(sorted(delta), ['b', 'c'])
+        self.assertEqual(delta['b'].previous, 2)
+        self.assertEqual(delta['b'].current, 3)
+
+    def test_gethistory(self):
+        with self.db.hook_scope('config-changed'):
+            self.db.set('a', 1)
+            self.db.unset('a')
+            self.db.set('b', 1)
+            history = list(self.db.gethistory('b', deserialize=True))
+        self.assertEqual(len(history), 1)
+        self.assertEqual(history[0][1:4], ('b', 1, 'config-changed'))
+        with self.db.hook_scope('update-status'):
+            self.db.set('b', 2)
+        self.assertEqual(
+            [(h[2], h[3]) for h in self.db.gethistory('b', deserialize=True)],
+            [(1, 'config-changed'), (2, 'update-status')])
+        self.assertEqual(
+            [h[2] for h in self.db.gethistory('a', deserialize=True)],
+            ['DELETED'])
+
+    def test_hook_scope_failure_discards_writes(self):
+        self.db.set('a', 1)
+        self.db.flush()
+        try:
+            with self.db.hook_scope('config-changed'):
+                self.db.set('a', 2)
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual(self.db.get('a'), 1)
+        self.assertEqual(self.open().get('a'), 1)
+
+
+class TestKV(CharmTestCase):
+
+    def setUp(self):
+        super(TestKV, self).setUp(neutron_unitdata, TO_PATCH)
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.patch_object(unitdata, '_KV', new=None)
+        environ = patch.dict(
+            os.environ, {'UNIT_STATE_DB': os.path.join(self.tmpdir, 'db')})
+        environ.start()
+        self.addCleanup(environ.stop)
+
+    def test_kv(self):
+        db = neutron_unitdata.kv()
+        self.addCleanup(db.close)
+        self.assertIsInstance(db, neutron_unitdata.Storage)
+        self.assertIs(unitdata.kv(), db)
+        self.assertIs(neutron_unitdata.kv(), db)
+        self.hookenv.atexit.assert_called_once_with(db.flush)
+
+    def test_kv_replaces_charmhelpers_storage(self):
+        ch_db = unitdata.kv()
+        ch_db.set('a', 1)
+        db = neutron_unitdata.kv()
+        self.addCleanup(db.close)
+        self.assertIsNot(db, ch_db)
+        self.assertIs(unitdata.kv(), db)
+        self.assertEqual(db.get('a'), 1)
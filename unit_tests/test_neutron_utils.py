@@ -1,6 +1,9 @@
+import os
+
 from mock import MagicMock, call, patch, ANY
 
 import charmhelpers.core.hookenv as hookenv
+import neutron_nics
 import neutron_utils
 try:
     import neutronclient
@@ -22,9 +25,10 @@ TO_PATCH = [
     'filter_missing_packages',
     'configure_installation_source',
     'log',
-    'add_bridge',
-    'add_bridge_port',
+    'OVSTransaction',
+    'neutron_commands',
     'add_ovsbridge_linuxbridge',
+    'reset_nic_inventory',
     'is_linuxbridge_interface',
     'headers_package',
     'full_restart',
@@ -41,9 +45,11 @@ TO_PATCH = [
     'copy2',
     'init_is_systemd',
     'os_application_version_set',
+    'installed_version',
+    'hook_name',
+    'kv',
+    'path_digest_index',
     'NeutronAPIContext',
-    'enable_ipfix',
-    'disable_ipfix',
 ]
 
 
@@ -51,14 +57,21 @@ class TestNeutronUtils(CharmTestCase):
 
     def setUp(self):
         super(TestNeutronUtils, self).setUp(neutron_utils, TO_PATCH)
+        self.ovs_txn = self.OVSTransaction.return_value
+        self.add_bridge = self.ovs_txn.add_bridge
+        self.add_bridge_port = self.ovs_txn.add_bridge_port
+        self.enable_ipfix = self.ovs_txn.enable_ipfix
+        self.disable_ipfix = self.ovs_txn.disable_ipfix
         self.headers_package.return_value = 'linux-headers-2.6.18'
         self._set_distrib_codename('trusty')
+        self.patch_object(neutron_nics, '_nic_inventory', new=None)
         self.maxDiff = None
 
     def tearDown(self):
         super(TestNeutronUtils, self).tearDown()
         # Reset cached cache
         hookenv.cache = {}
+        neutron_utils._RESOLVED_CONFIG_FILES.clear()
 
     def _set_distrib_codename(self, newcodename):
         self.lsb_release.return_value = {'DISTRIB_CODENAME': newcodename}
@@ -270,20 +283,23 @@ class TestNeutronUtils(CharmTestCase):
         self.os_release.return_value = 'juno'
         self.assertTrue('keepalived' in neutron_utils.get_packages())
 
-    @patch('charmhelpers.contrib.openstack.context.config')
+    @patch('neutron_contexts.config')
     def test_configure_ovs_starts_service_if_required(self, mock_config):
         mock_config.side_effect = self.test_config.get
         self.config.return_value = 'ovs'
         self.service_running.return_value = False
         neutron_utils.configure_ovs()
         self.assertTrue(self.full_restart.called)
+        self.neutron_commands.invalidate.assert_called_once_with('ovs',
+                                                                 'service')
 
     def test_configure_ovs_doesnt_restart_service(self):
         self.service_running.return_value = True
         neutron_utils.configure_ovs()
         self.assertFalse(self.full_restart.called)
+        self.assertFalse(self.neutron_commands.invalidate.called)
 
-    @patch('charmhelpers.contrib.openstack.context.config')
+    @patch('neutron_contexts.config')
     def test_configure_ovs_ovs_ext_port(self, mock_config):
         mock_config.side_effect = self.test_config.get
         self.config.side_effect = self.test_config.get
@@ -299,9 +315,9 @@ class TestNeutronUtils(CharmTestCase):
         ])
         self.add_bridge_port.assert_called_with('br-ex', 'eth0')
 
-    @patch('charmhelpers.contrib.openstack.context.list_nics',
+    @patch('neutron_nics.list_nics',
            return_value=['eth0', 'eth0.100', 'eth0.200'])
-    @patch('charmhelpers.contrib.openstack.context.config')
+    @patch('neutron_contexts.config')
     def test_configure_ovs_ovs_data_port(self, mock_config, _nics):
         self.is_linuxbridge_interface.return_value = False
         mock_config.side_effect = self.test_config.get
@@ -348,10 +364,11 @@ class TestNeutronUtils(CharmTestCase):
         calls = [call('br1', 'eth0.100', promisc=True),
                  call('br1', 'eth0.200', promisc=True)]
         self.add_bridge_port.assert_has_calls(calls, any_order=True)
+        self.assertFalse(self.reset_nic_inventory.called)
 
-    @patch('charmhelpers.contrib.openstack.context.list_nics',
+    @patch('neutron_nics.list_nics',
            return_value=['br-eth0'])
-    @patch('charmhelpers.contrib.openstack.context.config')
+    @patch('neutron_contexts.config')
     def test_configure_ovs_ovs_data_port_bridge(self, mock_config, _nics):
         self.is_linuxbridge_interface.return_value = True
         mock_config.side_effect = self.test_config.get
@@ -370,8 +387,10 @@ class TestNeutronUtils(CharmTestCase):
         ])
         calls = [call('br-data', 'br-eth0')]
         self.add_ovsbridge_linuxbridge.assert_has_calls(calls)
+        self.reset_nic_inventory.assert_called_once_with()
+        self.neutron_commands.invalidate.assert_called_once_with('ovs', 'ip')
 
-    @patch('charmhelpers.contrib.openstack.context.config')
+    @patch('neutron_contexts.config')
     def test_configure_ovs_enable_ipfix(self, mock_config):
         mock_config.side_effect = self.test_config.get
         self.config.side_effect = self.test_config.get
@@ -383,15 +402,32 @@ class TestNeutronUtils(CharmTestCase):
             call('br-ex', '127.0.0.1:80'),
             call('br-data', '127.0.0.1:80'),
         ])
+        self.assertFalse(self.disable_ipfix.called)
+        self.ovs_txn.commit.assert_called_once_with()
+
+    @patch('neutron_contexts.config')
+    def test_configure_ovs_disable_ipfix(self, mock_config):
+        mock_config.side_effect = self.test_config.get
+        self.config.side_effect = self.test_config.get
+        self.test_config.set('plugin', 'ovs')
+        neutron_utils.configure_ovs()
+        self.disable_ipfix.assert_has_calls([
+            call('br-int'),
+            call('br-ex'),
+            call('br-data'),
+        ])
+        self.assertFalse(self.enable_ipfix.called)
+        self.ovs_txn.commit.assert_called_once_with()
 
     @patch.object(neutron_utils, 'register_configs')
-    @patch('charmhelpers.contrib.openstack.templating.OSConfigRenderer')
+    @patch('neutron_templating.OSConfigRenderer')
     def test_do_openstack_upgrade(self, mock_renderer,
                                   mock_register_configs):
         self.patch_object(neutron_utils, 'disable_nova_metadata',
                           return_value=False)
-        mock_configs = MagicMock()
-        mock_register_configs.return_value = mock_configs
+        mock_configs = MagicMock(written=['/etc/neutron/dhcp_agent.ini'])
+        new_configs = MagicMock(written=['/etc/neutron/neutron.conf'])
+        mock_register_configs.return_value = new_configs
         self.config.side_effect = self.test_config.get
         self.is_relation_made.return_value = False
         self.test_config.set('openstack-origin', 'cloud:precise-havana')
@@ -401,6 +437,11 @@ class TestNeutronUtils(CharmTestCase):
         self.filter_missing_packages.side_effect = lambda x: x
         neutron_utils.do_openstack_upgrade(mock_configs)
         mock_register_configs.assert_called_with('havana')
+        new_configs.write_all.assert_called_once_with()
+        self.assertFalse(mock_configs.write_all.called)
+        # the upgrade's writes are seen by restart_on_change
+        self.assertEqual(mock_configs.written, [
+            '/etc/neutron/dhcp_agent.ini', '/etc/neutron/neutron.conf'])
         self.assertTrue(self.log.called)
         self.apt_update.assert_called_with(fatal=True)
         dpkg_opts = [
@@ -417,7 +458,7 @@ class TestNeutronUtils(CharmTestCase):
         self.apt_autoremove.assert_not_called()
 
     @patch.object(neutron_utils, 'register_configs')
-    @patch('charmhelpers.contrib.openstack.templating.OSConfigRenderer')
+    @patch('neutron_templating.OSConfigRenderer')
     def test_do_openstack_upgrade_rocky(self, mock_renderer,
                                         mock_register_configs):
         self.patch_object(neutron_utils, 'disable_nova_metadata',
@@ -453,7 +494,7 @@ class TestNeutronUtils(CharmTestCase):
         )
         self.service_restart.assert_called_once_with('neutron-metadata-agent')
 
-    @patch('charmhelpers.contrib.openstack.templating.OSConfigRenderer')
+    @patch('neutron_templating.OSConfigRenderer')
     def test_register_configs_ovs(self, mock_renderer):
         self.patch_object(neutron_utils, 'disable_nova_metadata',
                           return_value=False)
@@ -471,7 +512,7 @@ class TestNeutronUtils(CharmTestCase):
         for conf in confs:
             configs.register.assert_any_call(conf, ANY)
 
-    @patch('charmhelpers.contrib.openstack.templating.OSConfigRenderer')
+    @patch('neutron_templating.OSConfigRenderer')
     def test_register_configs_ovs_odl(self, mock_renderer):
         self.patch_object(neutron_utils, 'disable_nova_metadata',
                           return_value=False)
@@ -490,7 +531,7 @@ class TestNeutronUtils(CharmTestCase):
         for conf in confs:
             configs.register.assert_any_call(conf, ANY)
 
-    @patch('charmhelpers.contrib.openstack.templating.OSConfigRenderer')
+    @patch('neutron_templating.OSConfigRenderer')
     def test_register_configs_amqp_nova(self, mock_renderer):
         self.patch_object(neutron_utils, 'disable_nova_metadata',
                           return_value=False)
@@ -777,7 +818,7 @@ class TestNeutronUtils(CharmTestCase):
 
         self.assertEqual(neutron_utils.restart_map(), ex_map)
 
-    @patch('charmhelpers.contrib.openstack.templating.OSConfigRenderer')
+    @patch('neutron_templating.OSConfigRenderer')
     def test_register_configs_nsx(self, mock_renderer):
         self.patch_object(neutron_utils, 'disable_nova_metadata',
                           return_value=False)
@@ -807,7 +848,7 @@ class TestNeutronUtils(CharmTestCase):
             any_order=True,
         )
 
-    @patch('charmhelpers.contrib.openstack.templating.OSConfigRenderer')
+    @patch('neutron_templating.OSConfigRenderer')
     def test_register_configs_pre_install(self, mock_renderer):
         self.patch_object(neutron_utils, 'disable_nova_metadata',
                           return_value=False)
@@ -936,6 +977,137 @@ class TestNeutronUtils(CharmTestCase):
         for config in EXC_CONFIG:
             self.assertTrue(config not in actual_configs)
 
+    def test_resolve_config_files_memoized(self):
+        self.patch_object(neutron_utils, 'disable_nova_metadata',
+                          return_value=False)
+        self._set_distrib_codename('xenial')
+        self.is_relation_made.return_value = False
+        first = neutron_utils.resolve_config_files(neutron_utils.OVS,
+                                                   'newton')
+        second = neutron_utils.resolve_config_files(neutron_utils.OVS,
+                                                    'newton')
+        self.assertIs(first, second)
+        self.assertIsNot(
+            first, neutron_utils.resolve_config_files(neutron_utils.OVS,
+                                                      'ocata'))
+        # contexts are shared with the base map rather than copied
+        nova_ctxts = first[neutron_utils.OVS][neutron_utils.NOVA_CONF][
+            'hook_contexts']
+        base_ctxts = neutron_utils.get_config_files()[neutron_utils.OVS][
+            neutron_utils.NOVA_CONF]['hook_contexts']
+        self.assertIs(nova_ctxts[0], base_ctxts[0])
+        self.assertEqual(len(nova_ctxts), len(base_ctxts) + 1)
+
+    @patch.object(neutron_utils, '_reset_os_release')
+    def test_reset_os_release_clears_config_files(self, _reset_os_release):
+        self.patch_object(neutron_utils, 'disable_nova_metadata',
+                          return_value=False)
+        self._set_distrib_codename('xenial')
+        self.is_relation_made.return_value = False
+        first = neutron_utils.resolve_config_files(neutron_utils.OVS,
+                                                   'newton')
+        neutron_utils.reset_os_release()
+        _reset_os_release.assert_called_once_with()
+        self.assertIsNot(
+            first, neutron_utils.resolve_config_files(neutron_utils.OVS,
+                                                      'newton'))
+
+    def test_complete_contexts_cache_records(self):
+        configs = MagicMock()
+        configs.complete_contexts.return_value = ['amqp']
+        kv_mock = MagicMock()
+        self.kv.return_value = kv_mock
+        cached = neutron_utils.CompleteContextsCache(configs)
+        self.assertEqual(cached.complete_contexts(), ['amqp'])
+        kv_mock.set.assert_called_once_with(
+            neutron_utils.COMPLETE_CONTEXTS_KEY, ['amqp'])
+        self.assertEqual(cached.write_all, configs.write_all)
+
+    def test_complete_contexts_cache_reuses(self):
+        configs = MagicMock()
+        kv_mock = MagicMock()
+        kv_mock.get.return_value = ['amqp', 'neutron']
+        self.kv.return_value = kv_mock
+        cached = neutron_utils.CompleteContextsCache(configs, use_cached=True)
+        self.assertEqual(cached.complete_contexts(), ['amqp', 'neutron'])
+        self.assertFalse(configs.complete_contexts.called)
+        self.assertFalse(kv_mock.set.called)
+
+    def test_set_application_version(self):
+        kv_mock = MagicMock()
+        kv_mock.get.return_value = '2:15.0.0-0ubuntu1'
+        self.kv.return_value = kv_mock
+        self.installed_version.return_value = '2:16.0.0-0ubuntu1'
+        neutron_utils.set_application_version()
+        self.os_application_version_set.assert_called_once_with(
+            neutron_utils.VERSION_PACKAGE)
+        kv_mock.set.assert_called_once_with(
+            neutron_utils.APPLICATION_VERSION_KEY, '2:16.0.0-0ubuntu1')
+
+    def test_set_application_version_unchanged(self):
+        kv_mock = MagicMock()
+        kv_mock.get.return_value = '2:16.0.0-0ubuntu1'
+        self.kv.return_value = kv_mock
+        self.installed_version.return_value = '2:16.0.0-0ubuntu1'
+        neutron_utils.set_application_version()
+        self.assertFalse(self.os_application_version_set.called)
+
+    def _apparmor_context(self, profile, mode='complain'):
+        aa_context = MagicMock()
+        aa_context.aa_profile = profile
+        aa_context.ctxt = {'aa_profile_mode': mode, 'aa_profile': profile}
+        return aa_context
+
+    @patch.object(neutron_utils, 'neutron_commands')
+    @patch.object(neutron_utils, 'context')
+    def test_configure_apparmor_batched(self, context, _commands):
+        self.os_release.return_value = 'ussuri'
+        contexts = {}
+
+        def _aa_context(profile):
+            contexts[profile] = self._apparmor_context(profile)
+            return contexts[profile]
+
+        context.AppArmorContext.side_effect = _aa_context
+        index = self.path_digest_index.return_value
+        index.digest.side_effect = lambda path: 'digest-' + path
+        kv_mock = MagicMock()
+        kv_mock.get.return_value = {
+            neutron_utils.NEUTRON_DHCP_AA_PROFILE: [
+                os.path.join('digest-/etc/apparmor.d',
+                             neutron_utils.NEUTRON_DHCP_AA_PROFILE),
+                'complain'],
+        }
+        self.kv.return_value = kv_mock
+        neutron_utils.configure_apparmor()
+        _commands.check_call.assert_called_once_with(ANY)
+        cmd = _commands.check_call.call_args[0][0]
+        self.assertEqual(cmd[0], 'aa-complain')
+        self.assertNotIn(neutron_utils.NEUTRON_DHCP_AA_PROFILE, cmd)
+        self.assertIn(neutron_utils.NEUTRON_L3_AA_PROFILE, cmd)
+        for aa_context in contexts.values():
+            self.assertFalse(aa_context.setup_aa_profile.called)
+        kv_mock.set.assert_called_once_with(
+            neutron_utils.APPARMOR_PROFILES_KEY, ANY)
+        self.assertFalse(kv_mock.flush.called)
+        index.save.assert_called_once_with()
+
+    @patch.object(neutron_utils, 'neutron_commands')
+    @patch.object(neutron_utils, 'context')
+    def test_configure_apparmor_unchanged(self, context, _commands):
+        self.os_release.return_value = 'ussuri'
+        context.AppArmorContext.side_effect = self._apparmor_context
+        index = self.path_digest_index.return_value
+        index.digest.return_value = 'digest'
+        kv_mock = MagicMock()
+        kv_mock.get.return_value = {
+            p: ['digest', 'complain']
+            for p in neutron_utils.APPARMOR_PROFILES}
+        self.kv.return_value = kv_mock
+        neutron_utils.configure_apparmor()
+        self.assertFalse(_commands.check_call.called)
+        self.assertFalse(kv_mock.set.called)
+
 
 class DummyNetworkServiceContext():
 
@@ -973,16 +1145,23 @@ class TestNeutronAgentReallocation(CharmTestCase):
         hookenv.cache = {}
 
     def test_assess_status(self):
+        self.installed_version.return_value = None
         with patch.object(neutron_utils, 'assess_status_func') as asf:
             callee = MagicMock()
             asf.return_value = callee
             neutron_utils.assess_status('test-config')
-            asf.assert_called_once_with('test-config')
+            configs = asf.call_args[0][0]
+            self.assertIsInstance(configs,
+                                  neutron_utils.CompleteContextsCache)
+            self.assertEqual(configs._configs, 'test-config')
             callee.assert_called_once_with()
             self.os_application_version_set.assert_called_with(
                 neutron_utils.VERSION_PACKAGE
             )
 
+    @patch.object(neutron_utils, 'is_unit_upgrading_set')
+    @patch.object(neutron_utils, 'is_unit_paused_set')
+    @patch.object(neutron_utils, 'check_services_running')
     @patch.object(neutron_utils, 'get_optional_interfaces')
     @patch.object(neutron_utils, 'check_optional_relations')
     @patch.object(neutron_utils, 'REQUIRED_INTERFACES')
@@ -993,43 +1172,226 @@ class TestNeutronAgentReallocation(CharmTestCase):
                                 services,
                                 REQUIRED_INTERFACES,
                                 check_optional_relations,
-                                get_optional_interfaces):
+                                get_optional_interfaces,
+                                check_services_running,
+                                is_unit_paused_set,
+                                is_unit_upgrading_set):
+        services.return_value = ['s1']
+        REQUIRED_INTERFACES.copy.return_value = {'int': ['test 1']}
+        get_optional_interfaces.return_value = {'opt': ['test 2']}
+        is_unit_paused_set.return_value = False
+        is_unit_upgrading_set.return_value = False
+        f = neutron_utils.assess_status_func('test-config')
+        self.assertFalse(make_assess_status_func.called)
+        f()
+        # ports=None whilst port checks are disabled; the services are
+        # checked by check_services_running().
+        make_assess_status_func.assert_called_once_with(
+            'test-config',
+            {'int': ['test 1'], 'opt': ['test 2']},
+            charm_func=ANY, services=None, ports=None)
+        make_assess_status_func.return_value.assert_called_once_with()
+        charm_func = make_assess_status_func.call_args[1]['charm_func']
+        self.assertEqual(charm_func('test-config'),
+                         check_services_running.return_value)
+        check_services_running.assert_called_once_with('test-config', ['s1'])
+
+    @patch.object(neutron_utils, 'is_unit_upgrading_set')
+    @patch.object(neutron_utils, 'is_unit_paused_set')
+    @patch.object(neutron_utils, 'get_optional_interfaces')
+    @patch.object(neutron_utils, 'check_optional_relations')
+    @patch.object(neutron_utils, 'REQUIRED_INTERFACES')
+    @patch.object(neutron_utils, 'services')
+    @patch.object(neutron_utils, 'make_assess_status_func')
+    def test_assess_status_func_paused(self,
+                                       make_assess_status_func,
+                                       services,
+                                       REQUIRED_INTERFACES,
+                                       check_optional_relations,
+                                       get_optional_interfaces,
+                                       is_unit_paused_set,
+                                       is_unit_upgrading_set):
         services.return_value = ['s1']
         REQUIRED_INTERFACES.copy.return_value = {'int': ['test 1']}
         get_optional_interfaces.return_value = {'opt': ['test 2']}
-        neutron_utils.assess_status_func('test-config')
-        # ports=None whilst port checks are disabled.
+        is_unit_paused_set.return_value = True
+        is_unit_upgrading_set.return_value = False
+        with patch.object(neutron_utils, 'services_running') as running:
+            running.return_value = {'s1': False}
+            neutron_utils.assess_status_func('test-config')()
+            running.assert_called_once_with(['s1'])
+        # the services were checked by check_services_paused()
         make_assess_status_func.assert_called_once_with(
             'test-config',
             {'int': ['test 1'], 'opt': ['test 2']},
-            charm_func=check_optional_relations, services=['s1'], ports=None)
+            charm_func=check_optional_relations, services=None, ports=None)
+        make_assess_status_func.return_value.assert_called_once_with()
+
+    @patch.object(neutron_utils, 'status_set')
+    @patch.object(neutron_utils, 'services_running')
+    @patch.object(neutron_utils, 'is_unit_upgrading_set')
+    @patch.object(neutron_utils, 'is_unit_paused_set')
+    @patch.object(neutron_utils, 'get_optional_interfaces')
+    @patch.object(neutron_utils, 'services')
+    @patch.object(neutron_utils, 'make_assess_status_func')
+    def test_assess_status_func_paused_running(self,
+                                               make_assess_status_func,
+                                               services,
+                                               get_optional_interfaces,
+                                               is_unit_paused_set,
+                                               is_unit_upgrading_set,
+                                               services_running,
+                                               status_set):
+        services.return_value = ['s1', 's2', 's3']
+        get_optional_interfaces.return_value = {}
+        is_unit_paused_set.return_value = True
+        is_unit_upgrading_set.return_value = False
+        services_running.return_value = {'s1': True, 's2': False, 's3': True}
+        message = ('Services should be paused but these services running: '
+                   's1, s3')
+        self.assertEqual(neutron_utils.assess_status_func('test-config')(),
+                         message)
+        status_set.assert_called_once_with('blocked', message)
+        self.assertFalse(make_assess_status_func.called)
+
+    @patch.object(neutron_utils, 'neutron_commands')
+    def test_services_running_systemd(self, _commands):
+        self.init_is_systemd.return_value = True
+        _commands.check_output.return_value = (
+            b'ActiveState=active\n\nActiveState=inactive\n\n'
+            b'ActiveState=reloading\n')
+        self.assertEqual(
+            neutron_utils.services_running(['s1', 's2', 's3']),
+            {'s1': True, 's2': False, 's3': True})
+        _commands.check_output.assert_called_once_with(
+            ['systemctl', 'show', '--property=ActiveState',
+             's1', 's2', 's3'])
+        self.assertFalse(self.service_running.called)
+
+    @patch.object(neutron_utils, 'neutron_commands')
+    def test_services_running_unexpected_output(self, _commands):
+        self.init_is_systemd.return_value = True
+        _commands.check_output.return_value = b'ActiveState=active\n'
+        self.service_running.side_effect = lambda s: s == 's1'
+        self.assertEqual(neutron_utils.services_running(['s1', 's2']),
+                         {'s1': True, 's2': False})
+        self.service_running.assert_has_calls([call('s1'), call('s2')])
+
+    @patch.object(neutron_utils, 'neutron_commands')
+    def test_services_running_not_systemd(self, _commands):
+        self.init_is_systemd.return_value = False
+        self.service_running.side_effect = lambda s: s == 's2'
+        self.assertEqual(neutron_utils.services_running(['s1', 's2']),
+                         {'s1': False, 's2': True})
+        self.assertFalse(_commands.check_output.called)
+
+    @patch.object(neutron_utils, 'services_running')
+    @patch.object(neutron_utils, 'check_optional_relations')
+    def test_check_services_running(self, check_optional_relations,
+                                    services_running):
+        check_optional_relations.return_value = ('unknown', '')
+        services_running.return_value = {'s1': True, 's2': True}
+        self.assertEqual(
+            neutron_utils.check_services_running('cfg', ['s1', 's2']),
+            ('unknown', ''))
+        services_running.return_value = {'s1': False, 's2': True}
+        self.assertEqual(
+            neutron_utils.check_services_running('cfg', ['s1', 's2']),
+            ('blocked', 'Services not running that should be: s1'))
+        check_optional_relations.assert_called_with('cfg')
+
+    @patch.object(neutron_utils, 'services_running')
+    @patch.object(neutron_utils, 'check_optional_relations')
+    def test_check_services_running_relations_blocked(
+            self, check_optional_relations, services_running):
+        check_optional_relations.return_value = ('blocked', 'veth')
+        self.assertEqual(
+            neutron_utils.check_services_running('cfg', ['s1']),
+            ('blocked', 'veth'))
+        self.assertFalse(services_running.called)
 
     def test_pause_unit_helper(self):
         with patch.object(neutron_utils, '_pause_resume_helper') as prh:
             neutron_utils.pause_unit_helper('random-config')
-            prh.assert_called_once_with(neutron_utils.pause_unit,
+            prh.assert_called_once_with(neutron_utils.pause_unit, 'pause',
                                         'random-config')
         with patch.object(neutron_utils, '_pause_resume_helper') as prh:
             neutron_utils.resume_unit_helper('random-config')
-            prh.assert_called_once_with(neutron_utils.resume_unit,
+            prh.assert_called_once_with(neutron_utils.resume_unit, 'resume',
                                         'random-config')
 
+    @patch.object(neutron_utils, 'pause_resume_services')
     @patch.object(neutron_utils, 'services')
-    def test_pause_resume_helper(self, services):
+    def test_pause_resume_helper(self, services, pause_resume_services):
         f = MagicMock()
         services.return_value = ['s1']
         with patch.object(neutron_utils, 'assess_status_func') as asf:
             asf.return_value = 'assessor'
-            neutron_utils._pause_resume_helper(f, 'some-config')
+            neutron_utils._pause_resume_helper(f, 'pause', 'some-config')
             asf.assert_called_once_with('some-config')
             # ports=None whilst port checks are disabled.
-            f.assert_called_once_with('assessor', services=['s1'], ports=None)
+            f.assert_called_once_with('assessor', services=None, ports=None,
+                                      charm_func=ANY)
+        self.assertEqual(f.call_args[1]['charm_func'](),
+                         pause_resume_services.return_value)
+        pause_resume_services.assert_called_once_with('pause', ['s1'])
+
+    @patch.object(neutron_utils, 'services_running')
+    @patch.object(neutron_utils, 'neutron_commands')
+    def test_pause_resume_services_pause(self, _commands, services_running):
+        self.init_is_systemd.return_value = True
+        services_running.return_value = {'s1': True, 's2': False,
+                                         's3': True}
+        _commands.call.side_effect = \
+            lambda cmd: 1 if cmd == ['systemctl', 'stop', 's3'] else 0
+        self.assertEqual(
+            neutron_utils.pause_resume_services('pause', ['s1', 's2', 's3']),
+            "s3 didn't pause cleanly.")
+        services_running.assert_called_once_with(['s1', 's2', 's3'])
+        self.assertEqual(_commands.call.call_args_list, [
+            call(['systemctl', 'stop', 's1']),
+            call(['systemctl', 'stop', 's3']),
+            call(['systemctl', 'disable', 's1', 's2', 's3']),
+            call(['systemctl', 'mask', 's1', 's2', 's3']),
+        ])
+        self.assertFalse(self.service_running.called)
 
-    @patch.object(neutron_utils, 'subprocess')
+    @patch.object(neutron_utils, 'services_running')
+    @patch.object(neutron_utils, 'neutron_commands')
+    def test_pause_resume_services_resume(self, _commands, services_running):
+        self.init_is_systemd.return_value = True
+        services_running.return_value = {'s1': True, 's2': False}
+        _commands.call.return_value = 0
+        self.assertIsNone(
+            neutron_utils.pause_resume_services('resume', ['s1', 's2']))
+        self.assertEqual(_commands.call.call_args_list, [
+            call(['systemctl', 'unmask', 's1', 's2']),
+            call(['systemctl', 'enable', 's1', 's2']),
+            call(['systemctl', 'start', 's2']),
+        ])
+
+    @patch.object(neutron_utils, 'service_resume')
+    @patch.object(neutron_utils, 'service_pause')
+    @patch.object(neutron_utils, 'neutron_commands')
+    def test_pause_resume_services_not_systemd(self, _commands,
+                                               service_pause,
+                                               service_resume):
+        self.init_is_systemd.return_value = False
+        service_pause.side_effect = lambda s: s == 's1'
+        service_resume.return_value = True
+        self.assertEqual(
+            neutron_utils.pause_resume_services('pause', ['s1', 's2']),
+            "s2 didn't pause cleanly.")
+        self.assertIsNone(
+            neutron_utils.pause_resume_services('resume', ['s1', 's2']))
+        service_resume.assert_has_calls([call('s1'), call('s2')])
+        self.assertFalse(_commands.call.called)
+
+    @patch.object(neutron_utils, 'neutron_commands')
     @patch.object(neutron_utils, 'shutil')
     @patch('os.path.exists')
     def test_install_systemd_override_systemd(self, _os_exists, _shutil,
-                                              _subprocess):
+                                              _commands):
         '''
         Ensure systemd override is only installed on systemd based systems
         '''
@@ -1046,12 +1408,13 @@ class TestNeutronAgentReallocation(CharmTestCase):
             'files/override.conf',
             '/etc/systemd/system/nova-api-metadata.service.d/override.conf'
         )
-        _subprocess.check_call.assert_called_with(
+        _commands.check_call.assert_called_with(
             ['systemctl', 'daemon-reload']
         )
 
+    @patch.object(neutron_utils, 'neutron_commands')
     @patch.object(neutron_utils, 'context')
-    def test_configure_apparmor_mitaka(self, context):
+    def test_configure_apparmor_mitaka(self, context, _commands):
         self.os_release.return_value = 'mitaka'
         context.AppArmorContext = MagicMock()
         neutron_utils.configure_apparmor()
@@ -1059,8 +1422,9 @@ class TestNeutronAgentReallocation(CharmTestCase):
             neutron_utils.NEUTRON_LBAAS_AA_PROFILE
         )
 
+    @patch.object(neutron_utils, 'neutron_commands')
     @patch.object(neutron_utils, 'context')
-    def test_configure_apparmor_newton(self, context):
+    def test_configure_apparmor_newton(self, context, _commands):
         self.os_release.return_value = 'newton'
         context.AppArmorContext = MagicMock()
         neutron_utils.configure_apparmor()
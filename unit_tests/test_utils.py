@@ -109,7 +109,9 @@ class TestConfig(object):
     def __init__(self):
         self.config = get_default_config()
 
-    def get(self, attr):
+    def get(self, attr=None):
+        if attr is None:
+            return self.get_all()
         try:
             return self.config[attr]
         except KeyError: